@@ -0,0 +1,307 @@
+"""
+Резервное копирование базы StudyBoost без остановки бота
+Снимок делается через backup API SQLite порциями страниц с паузами, поэтому
+запись бота не ждет копирования всей базы. Снимок проверяется
+PRAGMA integrity_check и сжимается потоком в gzip. Между полными копиями
+можно сохранять инкрементальные - только изменившиеся страницы
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+DELTA_MAGIC = b'SBDELTA1'
+# Размер хэша страницы в файле .hashes
+PAGE_DIGEST_SIZE = 8
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupRestarted(Exception):
+    """Источник слишком часто меняется во время пошагового копирования"""
+
+
+class BackupError(Exception):
+    pass
+
+
+class BackupManager:
+    def __init__(self, db_name: str = 'studyboost.db', directory: str = 'backups',
+                 pages_per_step: int = 1024, step_pause: float = 0.005,
+                 keep_full: int = 4, max_deltas: int = 24, max_restarts: int = 3):
+        self.db_name = db_name
+        self.directory = directory
+        # Страниц за шаг backup API; между шагами блокировка источника снята
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        # Сколько полных копий (вместе с их инкрементальными) хранить
+        self.keep_full = keep_full
+        # После стольких инкрементальных копий следующая делается полной
+        self.max_deltas = max_deltas
+        # Запись другим подключением перезапускает копирование с начала;
+        # после max_restarts снимок делается за один шаг (в WAL запись не ждет)
+        self.max_restarts = max_restarts
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+
+    # === МАНИФЕСТ ===
+
+    def load_manifest(self) -> List[Dict]:
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_manifest(self, entries: List[Dict]):
+        temp_path = self.manifest_path + '.part'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # === СОЗДАНИЕ ===
+
+    def backup(self, incremental: bool = False) -> Dict:
+        """
+        Резервная копия базы
+
+        Args:
+            incremental: сохранить только страницы, изменившиеся с прошлой
+                копии (полная копия делается, если цепочки нет или она длинная)
+
+        Returns:
+            запись манифеста
+        """
+        if not os.path.exists(self.db_name):
+            raise BackupError(f"База данных не найдена: {self.db_name}")
+        os.makedirs(self.directory, exist_ok=True)
+
+        entries = self.load_manifest()
+        chain = self.current_chain(entries)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        snapshot = self.path(f'snapshot_{stamp}.db')
+        started = time.perf_counter()
+        try:
+            restarts = self.snapshot(snapshot)
+            self.check_integrity(snapshot)
+            page_size, digests, sha256 = self.hash_pages(snapshot)
+
+            if (incremental and chain and len(chain) - 1 < self.max_deltas
+                    and chain[0]['page_size'] == page_size):
+                entry = self.write_delta(snapshot, chain, page_size, digests, stamp)
+            else:
+                entry = self.write_full(snapshot, stamp)
+            self.save_hashes(entry['base'], digests)
+        finally:
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+
+        entry.update({
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'page_size': page_size,
+            'page_count': len(digests),
+            'sha256': sha256,
+            'size': os.path.getsize(self.path(entry['name'])),
+            'restarts': restarts,
+            'seconds': round(time.perf_counter() - started, 2),
+        })
+        entries.append(entry)
+        entries = self.apply_retention(entries)
+        self.save_manifest(entries)
+        return entry
+
+    def snapshot(self, target: str) -> int:
+        """Согласованная копия базы в target; возвращает число перезапусков"""
+        source = sqlite3.connect(self.db_name, timeout=30)
+        state = {'remaining': None, 'restarts': 0}
+
+        def progress(status, remaining, total):
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                if state['restarts'] > self.max_restarts:
+                    raise BackupRestarted()
+            state['remaining'] = remaining
+            if remaining and self.step_pause:
+                time.sleep(self.step_pause)
+
+        try:
+            destination = sqlite3.connect(target)
+            try:
+                source.backup(destination, pages=self.pages_per_step, progress=progress)
+                return state['restarts']
+            except BackupRestarted:
+                pass
+            finally:
+                destination.close()
+
+            # Одна транзакция чтения: в WAL запись бота продолжается
+            os.remove(target)
+            destination = sqlite3.connect(target)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+            return state['restarts']
+        finally:
+            source.close()
+
+    @staticmethod
+    def check_integrity(path: str):
+        conn = sqlite3.connect(path)
+        try:
+            result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+            # Копия самостоятельна: журнал WAL не нужен
+            conn.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            conn.close()
+        if result != ['ok']:
+            raise BackupError(f"Проверка целостности не пройдена: {'; '.join(result[:5])}")
+
+    @staticmethod
+    def hash_pages(path: str):
+        conn = sqlite3.connect(path)
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        conn.close()
+
+        digests = []
+        full = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                page = f.read(page_size)
+                if not page:
+                    break
+                full.update(page)
+                digests.append(hashlib.blake2b(page, digest_size=PAGE_DIGEST_SIZE).digest())
+        return page_size, digests, full.hexdigest()
+
+    def write_full(self, snapshot: str, stamp: str) -> Dict:
+        name = f'full_{stamp}.db.gz'
+        temp_path = self.path(name + '.part')
+        with open(snapshot, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+        os.replace(temp_path, self.path(name))
+        return {'name': name, 'kind': 'full', 'base': name}
+
+    def write_delta(self, snapshot: str, chain: List[Dict], page_size: int,
+                    digests: List[bytes], stamp: str) -> Dict:
+        base = chain[0]
+        previous = self.load_hashes(base['name'])
+
+        name = f'delta_{stamp}.pages.gz'
+        temp_path = self.path(name + '.part')
+        changed = 0
+        with open(snapshot, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=6) as target:
+            target.write(DELTA_MAGIC + struct.pack('>II', page_size, len(digests)))
+            for number, digest in enumerate(digests):
+                if number < len(previous) and previous[number] == digest:
+                    continue
+                source.seek(number * page_size)
+                target.write(struct.pack('>I', number))
+                target.write(source.read(page_size))
+                changed += 1
+        os.replace(temp_path, self.path(name))
+        return {'name': name, 'kind': 'delta', 'base': base['name'],
+                'previous': chain[-1]['name'], 'changed_pages': changed}
+
+    # Хэши страниц последней копии цепочки (для следующей инкрементальной)
+
+    def save_hashes(self, base: str, digests: List[bytes]):
+        temp_path = self.path(base + '.hashes.part')
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(digests))
+        os.replace(temp_path, self.path(base + '.hashes'))
+
+    def load_hashes(self, base: str) -> List[bytes]:
+        path = self.path(base + '.hashes')
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        return [data[i:i + PAGE_DIGEST_SIZE] for i in range(0, len(data), PAGE_DIGEST_SIZE)]
+
+    # === ХРАНЕНИЕ ===
+
+    @staticmethod
+    def current_chain(entries: List[Dict]) -> List[Dict]:
+        """Последняя полная копия и инкрементальные после нее"""
+        for index in range(len(entries) - 1, -1, -1):
+            if entries[index]['kind'] == 'full':
+                return entries[index:]
+        return []
+
+    def chain_for(self, entries: List[Dict], name: str) -> List[Dict]:
+        """Копии, которые нужно применить по порядку, чтобы получить name"""
+        for index, entry in enumerate(entries):
+            if entry['name'] == name:
+                base = entry['base']
+                return [e for e in entries[:index + 1] if e['base'] == base]
+        raise BackupError(f"Копия не найдена: {name}")
+
+    def apply_retention(self, entries: List[Dict]) -> List[Dict]:
+        bases = [entry['name'] for entry in entries if entry['kind'] == 'full']
+        expired = set(bases[:-self.keep_full]) if self.keep_full else set()
+        for entry in entries:
+            if entry['base'] in expired:
+                self.remove_file(entry['name'])
+        for base in expired:
+            self.remove_file(base + '.hashes')
+        return [entry for entry in entries if entry['base'] not in expired]
+
+    def remove_file(self, name: str):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    # === ВОССТАНОВЛЕНИЕ ===
+
+    def restore(self, name: Optional[str], target: str) -> Dict:
+        """Сборка базы из полной копии и инкрементальных до name (по умолчанию - последней)"""
+        entries = self.load_manifest()
+        if not entries:
+            raise BackupError("Резервных копий нет")
+        chain = self.chain_for(entries, name or entries[-1]['name'])
+
+        temp_path = target + '.part'
+        with gzip.open(self.path(chain[0]['name']), 'rb') as source, open(temp_path, 'wb') as f:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+        with open(temp_path, 'r+b') as f:
+            for entry in chain[1:]:
+                with gzip.open(self.path(entry['name']), 'rb') as delta:
+                    header = delta.read(len(DELTA_MAGIC) + 8)
+                    if header[:len(DELTA_MAGIC)] != DELTA_MAGIC:
+                        raise BackupError(f"Поврежден файл {entry['name']}")
+                    page_size, page_count = struct.unpack('>II', header[len(DELTA_MAGIC):])
+                    while True:
+                        number = delta.read(4)
+                        if not number:
+                            break
+                        f.seek(struct.unpack('>I', number)[0] * page_size)
+                        f.write(delta.read(page_size))
+                f.truncate(page_count * page_size)
+        os.replace(temp_path, target)
+        return chain[-1]
+
+    def verify(self, name: str = None) -> Dict:
+        """Восстановление во временный файл, integrity_check и сверка SHA-256"""
+        os.makedirs(self.directory, exist_ok=True)
+        target = self.path('verify.db')
+        try:
+            entry = self.restore(name, target)
+            self.check_integrity(target)
+            _, _, sha256 = self.hash_pages(target)
+            if sha256 != entry['sha256']:
+                raise BackupError(f"Контрольная сумма {entry['name']} не совпадает")
+            return entry
+        finally:
+            for path in (target, target + '.part'):
+                if os.path.exists(path):
+                    os.remove(path)
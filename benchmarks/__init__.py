@@ -0,0 +1,7 @@
+"""
+Бенчмарки операций с базой StudyBoost
+Синтетические данные с воспроизводимым распределением (dataset) и замеры
+основных методов Database, GamificationSystem и BotUtils (suite).
+
+Запуск: python -m benchmarks --users 1000 100000 --output results.json
+"""
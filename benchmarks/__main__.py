@@ -0,0 +1,45 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.suite import BenchmarkSuite, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Бенчмарки базы StudyBoost')
+    parser.add_argument('--users', type=int, nargs='+', default=[1000],
+                        help='размеры базы, например: 1000 100000 1000000')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ops', type=int, default=200,
+                        help='операций на каждый замер')
+    parser.add_argument('--mean-notes', type=float, default=10.0,
+                        help='среднее число заметок на пользователя')
+    parser.add_argument('--workdir', default='bench_data')
+    parser.add_argument('--output', help='файл JSON с результатами')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--keep', action='store_true', help='не удалять созданные базы')
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(args.workdir, seed=args.seed, ops=args.ops,
+                           mean_notes=args.mean_notes, keep=args.keep)
+    results = suite.run(args.users)
+
+    output = args.output or f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты: {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print('\n'.join(compare(baseline, results)))
+
+
+if __name__ == '__main__':
+    main()
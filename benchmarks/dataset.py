@@ -0,0 +1,227 @@
+"""
+Генератор синтетических данных для бенчмарков
+Одинаковый seed дает одинаковую базу. Число заметок на пользователя
+распределено по степенному закону (немного очень активных пользователей
+и длинный хвост), предметы и теги - по закону Ципфа, цели, викторины
+и журнал активности согласованы с заметками и баллами пользователя
+"""
+
+import json
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from database import Database
+from gamification import GamificationSystem
+
+SUBJECTS = [
+    ('Математика', ['#математика', '#формулы', '#алгебра', '#геометрия', '#матан']),
+    ('Физика', ['#физика', '#механика', '#оптика', '#формулы']),
+    ('Программирование', ['#python', '#алгоритмы', '#код', '#sql']),
+    ('История', ['#история', '#даты', '#реформы']),
+    ('Английский', ['#english', '#слова', '#грамматика']),
+    ('Химия', ['#химия', '#реакции', '#органика']),
+    ('Биология', ['#биология', '#клетка', '#генетика']),
+    ('Литература', ['#литература', '#цитаты']),
+    ('Экономика', ['#экономика', '#микро', '#макро']),
+    ('Философия', ['#философия']),
+]
+NOTE_TYPES = ['text', 'photo', 'voice']
+NOTE_TYPE_WEIGHTS = [0.7, 0.2, 0.1]
+QUIZ_SUBJECTS = ['math', 'physics', 'chemistry', 'cs']
+FIRST_NAMES = ['Иван', 'Анна', 'Мария', 'Алексей', 'Дмитрий', 'Екатерина',
+               'Айгерим', 'Нурлан', 'Ольга', 'Сергей', 'Дана', 'Тимур']
+WORDS = ('формула производная интеграл лекция семинар задача доказательство '
+         'теорема конспект пример определение свойство график функция закон '
+         'реакция вещество дата событие правило слово перевод вывод').split()
+
+# Баллы за действия, как в боте
+NOTE_POINTS = 5
+GOAL_POINTS = 20
+QUIZ_POINTS_PER_ANSWER = 10
+
+
+class DatasetGenerator:
+    def __init__(self, db_name: str, users: int, seed: int = 42,
+                 mean_notes: float = 10.0, alpha: float = 1.5,
+                 batch_users: int = 5000, now: datetime = None):
+        self.db_name = db_name
+        self.users = users
+        self.seed = seed
+        self.mean_notes = mean_notes
+        # Показатель степенного закона: меньше - тяжелее хвост
+        self.alpha = alpha
+        self.batch_users = batch_users
+        self.now = now or datetime.now().replace(microsecond=0)
+        self.rng = random.Random(seed)
+        self.gamification = GamificationSystem()
+        self.subject_weights = [1 / rank for rank in range(1, len(SUBJECTS) + 1)]
+        # Заранее подготовленные тексты: генерация не упирается в random
+        self.contents = [
+            ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(3, 60)))
+            for _ in range(2000)
+        ]
+        self.counts = {table: 0 for table in (
+            'users', 'notes', 'goals', 'quiz_results', 'activity_log',
+            'achievements', 'schedule'
+        )}
+
+    # === РАСПРЕДЕЛЕНИЯ ===
+
+    def note_count(self) -> int:
+        # (Pareto(alpha) - 1) имеет среднее 1 / (alpha - 1)
+        scale = self.mean_notes * (self.alpha - 1)
+        value = scale * (self.rng.paretovariate(self.alpha) - 1)
+        return min(int(value), int(self.mean_notes * 100))
+
+    def timestamp(self, start: datetime, end: datetime = None) -> str:
+        end = end or self.now
+        seconds = max(0, int((end - start).total_seconds()))
+        return (start + timedelta(seconds=self.rng.randint(0, seconds))).strftime(
+            '%Y-%m-%d %H:%M:%S')
+
+    # === ГЕНЕРАЦИЯ ===
+
+    def generate(self) -> Dict[str, int]:
+        """
+        Создание базы с заданным числом пользователей
+
+        Returns:
+            Число созданных строк по таблицам
+        """
+        Database(self.db_name)
+        # Загрузка напрямую через sqlite3: без инструментирования запросов
+        conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA synchronous=OFF')
+
+        started = time.perf_counter()
+        for first in range(1, self.users + 1, self.batch_users):
+            last = min(first + self.batch_users, self.users + 1)
+            rows = {table: [] for table in self.counts}
+            for user_id in range(first, last):
+                self._add_user(user_id, rows)
+            self._insert(conn, rows)
+            conn.commit()
+            done = last - 1
+            if done % (self.batch_users * 20) == 0 or done == self.users:
+                print(f"  {done}/{self.users} пользователей, "
+                      f"{time.perf_counter() - started:.0f} с")
+
+        conn.close()
+        return dict(self.counts)
+
+    def _add_user(self, user_id: int, rows: Dict[str, list]):
+        rng = self.rng
+        created = self.now - timedelta(days=rng.uniform(1, 365))
+        points = 0
+        achievements = {}
+
+        # Заметки
+        notes = self.note_count()
+        by_type = {note_type: 0 for note_type in NOTE_TYPES}
+        subjects = rng.choices(SUBJECTS, self.subject_weights, k=min(3, notes) or 1)
+        for note_type in rng.choices(NOTE_TYPES, NOTE_TYPE_WEIGHTS, k=notes):
+            by_type[note_type] += 1
+            category, tags = rng.choice(subjects)
+            created_at = self.timestamp(created)
+            rows['notes'].append((
+                user_id, category, note_type,
+                rng.choice(self.contents) if note_type == 'text' else '',
+                f'AgAC{rng.getrandbits(64):016x}' if note_type != 'text' else '',
+                json.dumps(rng.sample(tags, rng.randint(0, min(3, len(tags)))),
+                           ensure_ascii=False),
+                created_at
+            ))
+            rows['activity_log'].append((user_id, 'note_created', NOTE_POINTS,
+                                         'Заметка', created_at))
+            points += NOTE_POINTS
+
+        # Цели: больше половины выполнены
+        goals_done = 0
+        for _ in range(min(50, int(rng.expovariate(1 / 3)))):
+            created_at = created + timedelta(days=rng.uniform(0, (self.now - created).days))
+            deadline = (created_at + timedelta(days=rng.randint(1, 30))).date().isoformat()
+            completed = rng.random() < 0.6
+            completed_at = self.timestamp(created_at) if completed else None
+            rows['goals'].append((
+                user_id, rng.choice(self.contents)[:40], '', rng.choice(['daily', 'weekly']),
+                deadline, int(completed), completed_at,
+                created_at.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            if completed:
+                goals_done += 1
+                rows['activity_log'].append((user_id, 'goal_completed', GOAL_POINTS,
+                                             'Цель', completed_at))
+                points += GOAL_POINTS
+
+        # Викторины: чаще у тех, кто много пишет
+        quizzes = min(200, int(notes * 0.3 + rng.expovariate(1 / 2)))
+        for _ in range(quizzes):
+            total = rng.choice((5, 10))
+            score = min(total, int(rng.triangular(0, total + 1, total * 0.7)))
+            completed_at = self.timestamp(created)
+            rows['quiz_results'].append((user_id, rng.choice(QUIZ_SUBJECTS), score,
+                                         total, completed_at))
+            rows['activity_log'].append((user_id, 'quiz_completed',
+                                         score * QUIZ_POINTS_PER_ANSWER, 'Викторина',
+                                         completed_at))
+            points += score * QUIZ_POINTS_PER_ANSWER
+
+        # Расписание у части пользователей
+        if rng.random() < 0.4:
+            for _ in range(rng.randint(3, 12)):
+                hour = rng.randint(8, 18)
+                rows['schedule'].append((
+                    user_id, rng.choice(SUBJECTS)[0], rng.randint(0, 5),
+                    f'{hour:02d}:00', f'{hour + 1:02d}:30', f'Ауд. {rng.randint(100, 500)}'
+                ))
+
+        # Достижения: большинство уже выдано, часть ждет проверки
+        level = self.gamification.calculate_level(points)
+        thresholds = [
+            ('first_note', notes >= 1), ('note_master_10', notes >= 10),
+            ('note_master_50', notes >= 50), ('note_master_100', notes >= 100),
+            ('quiz_master_5', quizzes >= 5), ('quiz_master_20', quizzes >= 20),
+            ('goal_achiever_5', goals_done >= 5), ('goal_achiever_25', goals_done >= 25),
+            ('voice_master', by_type['voice'] >= 10), ('photo_pro', by_type['photo'] >= 15),
+            ('level_5', level >= 5), ('level_10', level >= 10),
+        ]
+        for key, reached in thresholds:
+            if reached and rng.random() < 0.9:
+                achievements[key] = self.gamification.achievements[key]['description']
+        for key, description in achievements.items():
+            rows['achievements'].append((user_id, key, description, self.timestamp(created)))
+
+        streak = int(rng.expovariate(1 / 4))
+        last_active = (self.now - timedelta(days=int(rng.expovariate(1 / 7)))).date()
+        rows['users'].append((
+            user_id, f'user{user_id}', rng.choice(FIRST_NAMES),
+            created.strftime('%Y-%m-%d %H:%M:%S'), points, level,
+            last_active.isoformat(), streak, streak + int(rng.expovariate(1 / 3)),
+            json.dumps({'notifications': rng.random() < 0.9})
+        ))
+
+    def _insert(self, conn: sqlite3.Connection, rows: Dict[str, list]):
+        statements = {
+            'users': '''INSERT INTO users (user_id, username, first_name, created_at,
+                        total_points, current_level, last_active, streak, best_streak,
+                        settings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            'notes': '''INSERT INTO notes (user_id, category, note_type, content, file_id,
+                        tags, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            'goals': '''INSERT INTO goals (user_id, title, description, goal_type, deadline,
+                        completed, completed_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            'quiz_results': '''INSERT INTO quiz_results (user_id, subject, score,
+                               total_questions, completed_at) VALUES (?, ?, ?, ?, ?)''',
+            'activity_log': '''INSERT INTO activity_log (user_id, activity_type,
+                               points_earned, description, created_at)
+                               VALUES (?, ?, ?, ?, ?)''',
+            'achievements': '''INSERT INTO achievements (user_id, achievement_name,
+                               achievement_description, earned_at) VALUES (?, ?, ?, ?)''',
+            'schedule': '''INSERT INTO schedule (user_id, subject, day_of_week, start_time,
+                           end_time, location) VALUES (?, ?, ?, ?, ?, ?)''',
+        }
+        for table, statement in statements.items():
+            conn.executemany(statement, rows[table])
+            self.counts[table] += len(rows[table])
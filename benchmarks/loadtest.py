@@ -0,0 +1,371 @@
+"""
+Нагрузочный тест обработчиков StudyBoostBot без Telegram
+Виртуальные пользователи проходят сценарий (старт → заметка → викторина →
+статистика → PDF), обновления собираются как от Telegram и проходят через
+Application и процессор обновлений бота. Ответы Bot API подменяются
+локальными, исходящие вызовы записываются.
+
+Запуск: python -m benchmarks.loadtest --users 1000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot, Update
+
+from benchmarks.suite import environment, summarize
+from metrics import metrics
+
+BOT_ID = 100000
+FIRST_USER_ID = 10 ** 9
+
+
+class FakeTelegram:
+    """
+    Подмена Bot._do_post: ответы Bot API строятся локально
+
+    Ограничитель скорости ExtBot остается на месте, поэтому при
+    rate_limit=True замеряется и он
+    """
+
+    def __init__(self, latency: float = 0.0):
+        # Имитация сетевой задержки запроса к Bot API
+        self.latency = latency
+        self.calls = Counter()
+        self.last_text: Dict[int, str] = {}
+        self._message_ids = itertools.count(1)
+        self._original = None
+
+    def install(self):
+        self._original = Bot._do_post
+        fake = self
+
+        async def _do_post(bot, endpoint, data, **kwargs):
+            return await fake.handle(endpoint, data)
+
+        Bot._do_post = _do_post
+
+    def uninstall(self):
+        if self._original is not None:
+            Bot._do_post = self._original
+            self._original = None
+
+    async def handle(self, endpoint: str, data: Dict):
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'StudyBoost',
+                    'username': 'studyboost_loadtest_bot'}
+        if endpoint in ('sendMessage', 'sendDocument', 'sendPhoto', 'editMessageText'):
+            chat_id = int(data['chat_id'])
+            text = data.get('text') or data.get('caption') or ''
+            self.last_text[chat_id] = text
+            message = {
+                'message_id': data.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'StudyBoost'},
+                'text': text,
+            }
+            if endpoint == 'sendDocument':
+                file_number = next(self._message_ids)
+                message['document'] = {'file_id': f'BQACAg{file_number}',
+                                       'file_unique_id': f'AgAD{file_number}'}
+            return message
+        return True
+
+
+class UpdateFactory:
+    """Обновления в формате Bot API (как их присылает Telegram)"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(10 ** 6)
+
+    @staticmethod
+    def user(user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'Load{user_id % 1000}',
+                'language_code': 'ru'}
+
+    def message(self, user_id: int, text: str) -> Update:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                    'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': next(self._update_ids), 'message': message},
+                              self.bot)
+
+    def callback(self, user_id: int, data: str, message_id: int = 1) -> Update:
+        query = {
+            'id': str(next(self._update_ids)),
+            'from': self.user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'StudyBoost'},
+                'text': '',
+            },
+        }
+        return Update.de_json({'update_id': next(self._update_ids), 'callback_query': query},
+                              self.bot)
+
+
+class LoadTest:
+    def __init__(self, users: int = 100, concurrency: int = 32, think_time: float = 0.2,
+                 ramp_up: float = 5.0, latency: float = 0.0, rate_limit: bool = False,
+                 seed: int = 42, workdir: str = 'loadtest_data', dataset_users: int = 0,
+                 keep: bool = False):
+        self.users = users
+        # concurrent_updates бота (0 - по одному обновлению, как по умолчанию)
+        self.concurrency = concurrency
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.rate_limit = rate_limit
+        self.seed = seed
+        self.workdir = os.path.abspath(workdir)
+        # Предварительно созданные пользователи (benchmarks.dataset)
+        self.dataset_users = dataset_users
+        self.keep = keep
+        self.fake = FakeTelegram(latency)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.loop_lag: List[float] = []
+        self.failed_users = 0
+        self.application = None
+        self.updates = None
+
+    # === ЗАПУСК ===
+
+    def run(self) -> Dict:
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        os.makedirs(self.workdir)
+        previous = os.getcwd()
+        # GamificationSystem работает с studyboost.db в текущем каталоге
+        os.chdir(self.workdir)
+        self.fake.install()
+        try:
+            if self.dataset_users:
+                from benchmarks.dataset import DatasetGenerator
+                print(f"📦 Генерация: {self.dataset_users} пользователей")
+                DatasetGenerator('studyboost.db', self.dataset_users, seed=self.seed).generate()
+            return asyncio.run(self._run())
+        finally:
+            self.fake.uninstall()
+            os.chdir(previous)
+            if not self.keep:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def _run(self) -> Dict:
+        from studyboost_bot import StudyBoostBot
+
+        bot = StudyBoostBot('123456:LOADTEST', concurrent_updates=self.concurrency)
+        application = self.application = bot.build_application()
+        if not self.rate_limit:
+            application.bot._rate_limiter = None
+        self.updates = UpdateFactory(application.bot)
+
+        await application.initialize()
+        await bot.post_init(application)
+
+        errors_before = sum(metrics.handler_errors.values.values())
+        locks_before = sum(metrics.db_lock_errors.values.values())
+        monitor = asyncio.create_task(self._monitor_loop())
+        rng = random.Random(self.seed)
+        started = time.perf_counter()
+        try:
+            tasks = []
+            for i in range(self.users):
+                delay = self.ramp_up * i / self.users
+                tasks.append(asyncio.create_task(
+                    self._virtual_user(FIRST_USER_ID + i, delay, random.Random(rng.random()))
+                ))
+            await asyncio.gather(*tasks)
+        finally:
+            elapsed = time.perf_counter() - started
+            monitor.cancel()
+            await bot.post_stop(application)
+            await application.shutdown()
+            await bot.post_shutdown(application)
+
+        return self.report(elapsed,
+                           sum(metrics.handler_errors.values.values()) - errors_before,
+                           sum(metrics.db_lock_errors.values.values()) - locks_before)
+
+    async def _monitor_loop(self, interval: float = 0.01):
+        """Задержка цикла событий: длинные синхронные участки обработчиков"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.perf_counter() - started - interval))
+
+    # === СЦЕНАРИЙ ===
+
+    async def dispatch(self, step: str, update: Update):
+        application = self.application
+        started = time.perf_counter()
+        # Как Application при получении обновления: через процессор (порядок и лимит)
+        await application.update_processor.process_update(
+            update, application.process_update(update)
+        )
+        self.latencies[step].append(time.perf_counter() - started)
+
+    async def _think(self, rng: random.Random):
+        if self.think_time:
+            await asyncio.sleep(rng.expovariate(1 / self.think_time))
+
+    async def _virtual_user(self, user_id: int, delay: float, rng: random.Random):
+        await asyncio.sleep(delay)
+        updates = self.updates
+        steps = [
+            ('start', updates.message(user_id, '/start')),
+            ('add_note', updates.message(user_id, '📝 Добавить заметку')),
+            ('category', updates.callback(user_id, 'cat_math')),
+            ('save_note', updates.message(
+                user_id, f'Конспект лекции {rng.randint(1, 30)} #математика #лекция')),
+            ('quizzes', updates.message(user_id, '🎮 Викторины')),
+            ('quiz_start', updates.callback(user_id, 'quiz_math')),
+        ]
+        try:
+            for step, update in steps:
+                await self.dispatch(step, update)
+                await self._think(rng)
+
+            # Вопросы до завершения викторины (последний ответ бота)
+            for _ in range(20):
+                await self.dispatch('quiz_answer',
+                                    updates.callback(user_id, f'answer_{rng.randint(0, 3)}'))
+                await self._think(rng)
+                await self.dispatch('quiz_next', updates.callback(user_id, 'next_question'))
+                await self._think(rng)
+                if 'завершена' in self.fake.last_text.get(user_id, ''):
+                    break
+
+            for step, update in (
+                ('stats', updates.message(user_id, '/stats')),
+                ('goals', updates.message(user_id, '🎯 Цели и прогресс')),
+                ('notes', updates.message(user_id, '📚 Мои заметки')),
+                ('pdf', updates.callback(user_id, 'generate_pdf')),
+            ):
+                await self.dispatch(step, update)
+                await self._think(rng)
+        except Exception as e:
+            self.failed_users += 1
+            logging.getLogger(__name__).error(f"Виртуальный пользователь {user_id}: {e}")
+
+    # === ОТЧЕТ ===
+
+    def report(self, elapsed: float, handler_errors: float, lock_errors: float) -> Dict:
+        total = sum(len(samples) for samples in self.latencies.values())
+        steps = {step: summarize(samples, 0) for step, samples in self.latencies.items()}
+        for row in steps.values():
+            row.pop('queries_per_op')
+
+        handlers = {}
+        for (handler,), (_, seconds, count) in metrics.handler_seconds.series.items():
+            queries = metrics.handler_queries.series.get((handler,), [None, 0, 0])
+            handlers[handler] = {
+                'count': count,
+                'mean_ms': round(seconds / count * 1000, 3) if count else 0,
+                'p95_le_ms': metrics.handler_seconds.quantile(0.95, handler) * 1000,
+                'queries_per_update': round(queries[1] / queries[2], 2) if queries[2] else 0,
+            }
+
+        lag = sorted(self.loop_lag) or [0.0]
+        return {
+            'environment': environment(),
+            'params': {'users': self.users, 'concurrency': self.concurrency,
+                       'think_time': self.think_time, 'ramp_up': self.ramp_up,
+                       'latency': self.fake.latency, 'rate_limit': self.rate_limit,
+                       'dataset_users': self.dataset_users, 'seed': self.seed},
+            'duration_s': round(elapsed, 2),
+            'updates': total,
+            'updates_per_s': round(total / elapsed, 1) if elapsed else None,
+            'failed_users': self.failed_users,
+            'handler_errors': int(handler_errors),
+            'db_lock_errors': int(lock_errors),
+            'loop_lag_ms': {'p99': round(lag[min(len(lag) - 1, int(0.99 * len(lag)))] * 1000, 2),
+                            'max': round(lag[-1] * 1000, 2)},
+            'steps': steps,
+            'handlers': handlers,
+            'bot_api_calls': dict(self.fake.calls),
+        }
+
+
+def print_report(result: Dict):
+    print(f"\n📈 {result['updates']} обновлений за {result['duration_s']} с "
+          f"({result['updates_per_s']}/с), пользователей {result['params']['users']}, "
+          f"concurrency {result['params']['concurrency']}")
+    print(f"{'шаг':<12} {'кол-во':>7} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    for step, row in result['steps'].items():
+        print(f"{step:<12} {row['count']:>7} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    print(f"\nОшибки обработчиков: {result['handler_errors']}, "
+          f"database is locked: {result['db_lock_errors']}, "
+          f"прерванных сценариев: {result['failed_users']}")
+    print(f"Задержка цикла событий: p99 {result['loop_lag_ms']['p99']} мс, "
+          f"max {result['loop_lag_ms']['max']} мс")
+    print(f"Вызовы Bot API: {result['bot_api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest',
+                                     description='Нагрузочный тест обработчиков StudyBoost')
+    parser.add_argument('--users', type=int, default=100, help='виртуальных пользователей')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='concurrent_updates бота (0 - последовательно)')
+    parser.add_argument('--think-time', type=float, default=0.2,
+                        help='средняя пауза между действиями, с')
+    parser.add_argument('--ramp-up', type=float, default=5.0,
+                        help='время подключения всех пользователей, с')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='имитация задержки Bot API, с')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='оставить ограничитель скорости исходящих сообщений')
+    parser.add_argument('--dataset-users', type=int, default=0,
+                        help='заполнить базу синтетическими пользователями')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', default='loadtest_data')
+    parser.add_argument('--output', help='файл JSON с результатами')
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочий каталог')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = LoadTest(
+        users=args.users, concurrency=args.concurrency, think_time=args.think_time,
+        ramp_up=args.ramp_up, latency=args.latency, rate_limit=args.rate_limit,
+        seed=args.seed, workdir=args.workdir, dataset_users=args.dataset_users,
+        keep=args.keep
+    ).run()
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Результаты: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
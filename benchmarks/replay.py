@@ -0,0 +1,274 @@
+"""
+Воспроизведение записанных обновлений (recorder.UpdateRecorder)
+Обновления проходят через обработчики бота в исходном темпе, ускоренно
+или без пауз, на пустой базе или копии снимка. Результат - профиль
+задержек и SQL-запросов по обработчикам; два профиля (например, до и
+после изменения кода) сравниваются командой diff.
+
+  python -m benchmarks.replay run updates.ndjson.gz --speed 0 --output before.json
+  python -m benchmarks.replay run updates.ndjson.gz --speed 0 --output after.json
+  python -m benchmarks.replay diff before.json after.json
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+
+from benchmarks.loadtest import FakeTelegram
+from benchmarks.suite import environment, summarize
+from metrics import metrics
+
+
+def load_log(path: str, limit: int = None) -> List[Tuple[float, Dict]]:
+    opener = gzip.open if path.endswith('.gz') else open
+    records = []
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            records.append((record['t'], record['u']))
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def update_user_id(data: Dict):
+    for key in ('message', 'edited_message', 'callback_query'):
+        sender = (data.get(key) or {}).get('from')
+        if sender:
+            return sender['id']
+    return None
+
+
+class Replayer:
+    def __init__(self, log_path: str, speed: float = 0.0, concurrency: int = 32,
+                 snapshot: str = None, workdir: str = 'replay_data', latency: float = 0.0,
+                 limit: int = None, seed: int = 42, keep: bool = False):
+        self.log_path = log_path
+        # 1 - исходный темп, 2 - вдвое быстрее, 0 - без пауз
+        self.speed = speed
+        self.concurrency = concurrency
+        # База, с копии которой начинается воспроизведение (по умолчанию пустая)
+        self.snapshot = snapshot
+        self.workdir = os.path.abspath(workdir)
+        self.limit = limit
+        self.seed = seed
+        self.keep = keep
+        self.fake = FakeTelegram(latency)
+        self.samples: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+        self.latencies: List[float] = []
+        self.schedule_lag = 0.0
+
+    def run(self) -> Dict:
+        records = load_log(self.log_path, self.limit)
+        if not records:
+            raise ValueError(f"В {self.log_path} нет обновлений")
+
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        os.makedirs(self.workdir)
+        if self.snapshot:
+            # backup API: копия согласована, даже если в снимок идет запись (WAL)
+            source = sqlite3.connect(self.snapshot)
+            target = sqlite3.connect(os.path.join(self.workdir, 'studyboost.db'))
+            source.backup(target)
+            source.close()
+            target.close()
+
+        previous = os.getcwd()
+        os.chdir(self.workdir)
+        self.fake.install()
+        # Обработчики используют random (викторины): одинаковый выбор в обоих прогонах
+        random.seed(self.seed)
+        try:
+            return asyncio.run(self._run(records))
+        finally:
+            self.fake.uninstall()
+            os.chdir(previous)
+            if not self.keep:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _ensure_users(self, records):
+        """Пользователи, начавшие работу до записи, создаются заранее"""
+        from database import Database
+        db = Database('studyboost.db')
+        for user_id in {update_user_id(data) for _, data in records} - {None}:
+            if not db.user_exists(user_id):
+                db.create_user(user_id, 'User')
+
+    def _on_handler(self, name: str, elapsed: float, stats):
+        self.samples[name].append((elapsed, stats.queries))
+
+    async def _run(self, records) -> Dict:
+        from studyboost_bot import StudyBoostBot
+
+        self._ensure_users(records)
+        bot = StudyBoostBot('123456:REPLAY', concurrent_updates=self.concurrency)
+        application = bot.build_application()
+        application.bot._rate_limiter = None
+        await application.initialize()
+        await bot.post_init(application)
+
+        errors_before = sum(metrics.handler_errors.values.values())
+        locks_before = sum(metrics.db_lock_errors.values.values())
+        metrics.handler_listeners.append(self._on_handler)
+        first = records[0][0]
+        started = time.perf_counter()
+        # Обновления одного пользователя - строго по порядку записи
+        chains = {}
+        try:
+            for t, data in records:
+                if self.speed:
+                    delay = (t - first) / self.speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.schedule_lag = max(self.schedule_lag, -delay)
+                update = Update.de_json(data, application.bot)
+                key = update_user_id(data)
+                chains[key] = asyncio.create_task(
+                    self._dispatch(application, update, chains.get(key))
+                )
+            await asyncio.gather(*chains.values())
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.handler_listeners.remove(self._on_handler)
+            await bot.post_stop(application)
+            await application.shutdown()
+            await bot.post_shutdown(application)
+
+        handlers = {}
+        for name, samples in sorted(self.samples.items()):
+            row = summarize([seconds for seconds, _ in samples],
+                            sum(queries for _, queries in samples))
+            row.pop('ops_per_s')
+            handlers[name] = row
+        return {
+            'environment': environment(),
+            'params': {'log': os.path.basename(self.log_path), 'speed': self.speed,
+                       'concurrency': self.concurrency, 'latency': self.fake.latency,
+                       'snapshot': self.snapshot, 'seed': self.seed},
+            'updates': len(records),
+            'duration_s': round(elapsed, 2),
+            'updates_per_s': round(len(records) / elapsed, 1) if elapsed else None,
+            'schedule_lag_ms': round(self.schedule_lag * 1000, 1),
+            'handler_errors': int(sum(metrics.handler_errors.values.values()) - errors_before),
+            'db_lock_errors': int(sum(metrics.db_lock_errors.values.values()) - locks_before),
+            'latency': summarize(self.latencies, 0) if self.latencies else {},
+            'handlers': handlers,
+        }
+
+    async def _dispatch(self, application, update: Update, previous):
+        if previous is not None:
+            await previous
+        started = time.perf_counter()
+        await application.update_processor.process_update(
+            update, application.process_update(update)
+        )
+        self.latencies.append(time.perf_counter() - started)
+
+
+def diff_profiles(base: Dict, current: Dict, threshold: float = 0.2,
+                  min_delta_ms: float = 1.0) -> Tuple[List[str], int]:
+    """
+    Сравнение профилей по обработчикам
+
+    Returns:
+        (строки отчета, число регрессий: p95 выросло больше threshold и
+        больше min_delta_ms, либо увеличилось число SQL-запросов)
+    """
+    lines = [f"{'обработчик':<28} {'кол-во':>7} {'p50':>14} {'p95':>14} {'SQL/вызов':>12}"]
+    regressions = 0
+    for name in sorted(set(base['handlers']) | set(current['handlers'])):
+        old = base['handlers'].get(name)
+        new = current['handlers'].get(name)
+        if old is None or new is None:
+            lines.append(f"{name:<28} {'только в ' + ('новом' if old is None else 'базовом')}")
+            continue
+        p50 = new['p50_ms'] / old['p50_ms'] if old['p50_ms'] else 1.0
+        p95 = new['p95_ms'] / old['p95_ms'] if old['p95_ms'] else 1.0
+        slower = p95 > 1 + threshold and new['p95_ms'] - old['p95_ms'] > min_delta_ms
+        regressed = slower or new['queries_per_op'] > old['queries_per_op']
+        regressions += regressed
+        lines.append(
+            f"{name:<28} {new['count']:>7} {new['p50_ms']:>8.2f} ×{p50:<4.2f} "
+            f"{new['p95_ms']:>8.2f} ×{p95:<4.2f} "
+            f"{old['queries_per_op']:>5.1f}→{new['queries_per_op']:<5.1f}"
+            f"{' ⚠️' if regressed else ''}"
+        )
+    lines.append(f"\nОбновлений в секунду: {base['updates_per_s']} → {current['updates_per_s']}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replay',
+                                     description='Воспроизведение записанных обновлений')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='воспроизвести запись и сохранить профиль')
+    run.add_argument('log', help='NDJSON от UpdateRecorder (.gz или без сжатия)')
+    run.add_argument('--speed', type=float, default=0.0,
+                     help='1 - исходный темп, 2 - вдвое быстрее, 0 - без пауз')
+    run.add_argument('--concurrency', type=int, default=32)
+    run.add_argument('--snapshot', help='база, с копии которой начать')
+    run.add_argument('--latency', type=float, default=0.0, help='задержка Bot API, с')
+    run.add_argument('--limit', type=int, help='воспроизвести первые N обновлений')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--workdir', default='replay_data')
+    run.add_argument('--output', help='файл JSON с профилем')
+    run.add_argument('--keep', action='store_true', help='не удалять рабочий каталог')
+
+    diff = commands.add_parser('diff', help='сравнить два профиля')
+    diff.add_argument('base')
+    diff.add_argument('current')
+    diff.add_argument('--threshold', type=float, default=0.2,
+                      help='допустимый рост p95 (0.2 = 20%%)')
+    diff.add_argument('--min-delta-ms', type=float, default=1.0,
+                      help='меньший рост p95 не считается регрессией')
+    args = parser.parse_args()
+
+    if args.command == 'diff':
+        with open(args.base, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        lines, regressions = diff_profiles(base, current, args.threshold,
+                                           args.min_delta_ms)
+        print('\n'.join(lines))
+        print(f"Регрессий: {regressions}")
+        sys.exit(1 if regressions else 0)
+
+    profile = Replayer(
+        args.log, speed=args.speed, concurrency=args.concurrency, snapshot=args.snapshot,
+        workdir=args.workdir, latency=args.latency, limit=args.limit, seed=args.seed,
+        keep=args.keep
+    ).run()
+    print(f"📼 {profile['updates']} обновлений за {profile['duration_s']} с "
+          f"({profile['updates_per_s']}/с), ошибок {profile['handler_errors']}, "
+          f"database is locked: {profile['db_lock_errors']}")
+    for name, row in profile['handlers'].items():
+        print(f"  {name:<28} {row['count']:>6}  p50 {row['p50_ms']:>8.2f} мс  "
+              f"p95 {row['p95_ms']:>8.2f} мс  SQL {row['queries_per_op']:.1f}")
+
+    output = args.output or 'replay_profile.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Профиль: {output}")
+
+
+if __name__ == '__main__':
+    main()
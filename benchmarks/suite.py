@@ -0,0 +1,184 @@
+"""
+Замеры операций с базой на синтетических данных
+Для каждого размера создается отдельная база, затем каждая операция
+выполняется на случайной (по seed) выборке пользователей. Результат -
+квантили времени и число SQL-запросов на операцию
+"""
+
+import contextlib
+import io
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from benchmarks.dataset import DatasetGenerator
+from metrics import metrics
+
+DB_NAME = 'studyboost.db'
+
+
+def summarize(durations: List[float], queries: float) -> Dict:
+    durations = sorted(durations)
+    count = len(durations)
+
+    def quantile(q: float) -> float:
+        return durations[min(count - 1, int(q * count))] * 1000
+
+    total = sum(durations)
+    return {
+        'count': count,
+        'total_s': round(total, 4),
+        'mean_ms': round(total / count * 1000, 3),
+        'p50_ms': round(quantile(0.5), 3),
+        'p95_ms': round(quantile(0.95), 3),
+        'p99_ms': round(quantile(0.99), 3),
+        'max_ms': round(durations[-1] * 1000, 3),
+        'ops_per_s': round(count / total, 1) if total else None,
+        'queries_per_op': round(queries / count, 2),
+    }
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, timeout=5,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'commit': commit,
+    }
+
+
+class BenchmarkSuite:
+    def __init__(self, workdir: str = 'bench_data', seed: int = 42, ops: int = 200,
+                 mean_notes: float = 10.0, keep: bool = False):
+        self.workdir = os.path.abspath(workdir)
+        self.seed = seed
+        # Операций на каждый замер по пользователям
+        self.ops = ops
+        self.mean_notes = mean_notes
+        self.keep = keep
+
+    def run(self, sizes: List[int]) -> Dict:
+        results = {'environment': environment(),
+                   'params': {'seed': self.seed, 'ops': self.ops,
+                              'mean_notes': self.mean_notes},
+                   'scales': []}
+        for users in sizes:
+            results['scales'].append(self.run_scale(users))
+        return results
+
+    def run_scale(self, users: int) -> Dict:
+        directory = os.path.join(self.workdir, f'users_{users}')
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        # GamificationSystem и BotUtils работают с studyboost.db в текущем каталоге
+        previous = os.getcwd()
+        os.chdir(directory)
+        try:
+            print(f"\n📦 Генерация: {users} пользователей")
+            started = time.perf_counter()
+            rows = DatasetGenerator(DB_NAME, users, seed=self.seed,
+                                    mean_notes=self.mean_notes).generate()
+            generate_seconds = time.perf_counter() - started
+
+            scale = {
+                'users': users,
+                'rows': rows,
+                'generate_s': round(generate_seconds, 2),
+                'db_size_mb': round(os.path.getsize(DB_NAME) / 1024 / 1024, 1),
+                'results': self.run_benchmarks(users),
+            }
+        finally:
+            os.chdir(previous)
+            if not self.keep:
+                shutil.rmtree(directory, ignore_errors=True)
+        return scale
+
+    def measure(self, name: str, func, calls: List[tuple], results: Dict):
+        queries_before = sum(metrics.db_queries.values.values())
+        durations = []
+        # Вывод BotUtils не нужен в отчете
+        with contextlib.redirect_stdout(io.StringIO()):
+            for args in calls:
+                started = time.perf_counter()
+                func(*args)
+                durations.append(time.perf_counter() - started)
+        queries = sum(metrics.db_queries.values.values()) - queries_before
+        results[name] = summarize(durations, queries)
+        row = results[name]
+        print(f"  {name:<28} p50 {row['p50_ms']:>9.3f} мс  p95 {row['p95_ms']:>9.3f} мс  "
+              f"p99 {row['p99_ms']:>9.3f} мс  SQL {row['queries_per_op']:.1f}")
+
+    def run_benchmarks(self, users: int) -> Dict:
+        from database import Database
+        from gamification import GamificationSystem
+        from utils import BotUtils
+
+        db = Database(DB_NAME)
+        gamification = GamificationSystem()
+        utils = BotUtils(DB_NAME)
+        rng = random.Random(self.seed)
+        sample = [(user_id,) for user_id in rng.choices(range(1, users + 1), k=self.ops)]
+
+        # Самый активный пользователь - хвост степенного распределения
+        conn = sqlite3.connect(DB_NAME)
+        heavy = conn.execute('''
+            SELECT user_id FROM notes GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        ''').fetchone()
+        conn.close()
+        heavy = [(heavy[0],)] * max(1, self.ops // 10) if heavy else []
+
+        results = {}
+        print(f"⏱  Замеры ({users} пользователей)")
+        self.measure('get_user_notes', db.get_user_notes, sample, results)
+        if heavy:
+            self.measure('get_user_notes[heavy]', db.get_user_notes, heavy, results)
+        self.measure('get_detailed_stats', db.get_detailed_stats, sample, results)
+        if heavy:
+            self.measure('get_detailed_stats[heavy]', db.get_detailed_stats, heavy, results)
+        self.measure('get_leaderboard', gamification.get_leaderboard,
+                     [()] * max(1, self.ops // 10), results)
+        self.measure('save_note', lambda user_id: db.save_note({
+            'user_id': user_id, 'category': 'Математика', 'type': 'text',
+            'content': 'Бенчмарк', 'tags': ['#математика']
+        }), sample, results)
+        self.measure('check_achievements',
+                     lambda user_id: gamification.check_achievements(user_id, db),
+                     sample, results)
+        self.measure('utils.get_statistics', utils.get_statistics, [()] * 3, results)
+        # Очистка меняет данные - последней
+        self.measure('utils.clean_old_data', utils.clean_old_data, [(90,)], results)
+        return results
+
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """Отношение p50 и p95 текущего прогона к базовому (меньше 1 - быстрее)"""
+    lines = []
+    previous = {scale['users']: scale['results'] for scale in baseline.get('scales', [])}
+    for scale in current['scales']:
+        base = previous.get(scale['users'])
+        if base is None:
+            continue
+        lines.append(f"\n📊 {scale['users']} пользователей (текущий / базовый)")
+        for name, row in scale['results'].items():
+            old = base.get(name)
+            if not old or not old['p50_ms'] or not old['p95_ms']:
+                continue
+            lines.append(f"  {name:<28} p50 ×{row['p50_ms'] / old['p50_ms']:.2f}  "
+                         f"p95 ×{row['p95_ms'] / old['p95_ms']:.2f}  "
+                         f"SQL {old['queries_per_op']:.1f} → {row['queries_per_op']:.1f}")
+    return lines
@@ -0,0 +1,83 @@
+"""
+Ежедневная рассылка дайджеста StudyBoost
+Совет дня, цели с близким сроком, серия под угрозой и баллы за вчера
+для пользователей с включенными уведомлениями. Данные собираются
+постранично одной выборкой на страницу, отправка - через очередь Outbox
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, time as dtime
+from typing import Dict
+
+from outbox import BULK, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+class DigestBroadcast:
+    def __init__(self, bot, send_time: dtime = dtime(9, 0), page_size: int = 1000,
+                 goal_days: int = 3):
+        self.bot = bot
+        self.send_time = send_time
+        self.page_size = page_size
+        self.goal_days = goal_days
+
+    def start(self, job_queue):
+        job_queue.run_daily(self.run, time=self.send_time, name='daily_digest')
+
+    async def run(self, context=None) -> int:
+        """Постановка дайджестов в очередь, возвращает число новых сообщений"""
+        db = self.bot.db
+        tips = self.bot.daily_tips
+        tip = tips[datetime.now().day % len(tips)]
+        today = date.today().isoformat()
+
+        after_user_id = 0
+        pages = 0
+        queued = 0
+        while True:
+            rows = await asyncio.to_thread(db.get_digest_page, after_user_id,
+                                           self.page_size, self.goal_days)
+            if not rows:
+                break
+            pages += 1
+
+            # Ключ с датой: повторный запуск в тот же день не дублирует рассылку
+            messages = [
+                OutboxMessage(row['user_id'], self.format_digest(row, tip),
+                              priority=BULK, key=f"digest:{today}:{row['user_id']}",
+                              coalesce=True)
+                for row in rows
+            ]
+            queued += await self.bot.outbox.enqueue(messages)
+
+            after_user_id = rows[-1]['user_id']
+            if len(rows) < self.page_size:
+                break
+
+        logger.info(f"Дайджест: {queued} сообщений в очереди ({pages} стр.)")
+        return queued
+
+    def format_digest(self, row: Dict, tip: str) -> str:
+        name = row['first_name'] or 'студент'
+        lines = [f"☀️ Доброе утро, {name}!"]
+
+        if not row['tip_read']:
+            lines.append(f"\n{tip}")
+
+        if row['due_goals']:
+            # Срок хранится как дата или дата со временем
+            deadline = datetime.strptime(row['next_deadline'][:10], '%Y-%m-%d').strftime('%d.%m')
+            lines.append(f"\n🎯 Целей со сроком в ближайшие {self.goal_days} дн.: "
+                         f"{row['due_goals']}")
+            lines.append(f"Ближайшая: «{row['next_goal']}» - до {deadline}")
+
+        if row['streak_at_risk']:
+            lines.append(f"\n🔥 Серия {row['streak']} дн. прервется, "
+                         f"если сегодня не заглянешь в бота!")
+
+        if row['points_yesterday']:
+            lines.append(f"\n⭐ Вчера заработано баллов: {row['points_yesterday']}")
+
+        return '\n'.join(lines)
@@ -0,0 +1,288 @@
+"""
+Кэш чтения для Database
+LRU с TTL по ключам, сброс из методов записи и необязательный канал
+сброса между процессами (воркерами) через таблицу SQLite
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from db_connection import connect
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def scope(db_name: str) -> str:
+    """Первый элемент ключей кэша: процесс может работать с несколькими базами"""
+    return os.path.abspath(db_name)
+
+
+class ReadThroughCache:
+    def __init__(self, name: str, maxsize: int = 10000, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        # Запись из другого процесса без канала сброса видна не позже чем через ttl
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        # Ключи, которые сейчас загружаются: ключ -> [загрузок, сброшен]
+        self._loading: Dict[object, list] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Значение из кэша или loader(), результат которого кэшируется"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                metrics.cache_requests.inc(self.name, 'hit')
+                return entry[0]
+            self.misses += 1
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = [0, False]
+            loading[0] += 1
+        metrics.cache_requests.inc(self.name, 'miss')
+
+        try:
+            value = loader()
+        except BaseException:
+            with self._lock:
+                self._done_loading(key, loading)
+            raise
+        with self._lock:
+            self._done_loading(key, loading)
+            # Запись во время чтения: результат мог устареть, не кэшируем
+            if not loading[1]:
+                self._data[key] = (value, now + self.ttl)
+                self._data.move_to_end(key)
+                if len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def _done_loading(self, key, loading: list):
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loading[key]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            loading = self._loading.get(key)
+            if loading is not None:
+                loading[1] = True
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            for loading in self._loading.values():
+                loading[1] = True
+            self.invalidations += 1
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InvalidationChannel:
+    """
+    Сброс кэшей между процессами, работающими с одной базой
+
+    Запись добавляет строку в cache_invalidations, каждый процесс
+    периодически читает новые строки и сбрасывает у себя те же ключи
+    """
+
+    def __init__(self, registry, db_name: str = 'studyboost.db',
+                 poll_interval: float = 1.0, retention: float = 600):
+        self.registry = registry
+        self.db_name = db_name
+        self.poll_interval = poll_interval
+        # Строки старше retention удаляются (дольше TTL любого кэша)
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self.last_seq = 0
+        self.received = 0
+        self._task = None
+        self._last_prune = 0.0
+        self.init_table()
+
+    def get_connection(self):
+        return connect(self.db_name, timeout=10)
+
+    def init_table(self):
+        conn = self.get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                cache TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        row = conn.execute('SELECT MAX(seq) AS seq FROM cache_invalidations').fetchone()
+        self.last_seq = row['seq'] or 0
+        conn.close()
+
+    def publish(self, items: Iterable[Tuple[str, object]]):
+        """Ключи одной записи (кэш, ключ) - одной транзакцией"""
+        now = time.time()
+        rows = [(cache, json.dumps(key), self.origin, now) for cache, key in items]
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO cache_invalidations (cache, cache_key, origin, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+        conn.close()
+
+    def poll(self) -> int:
+        """Применение сбросов из других процессов"""
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT seq, cache, cache_key, origin FROM cache_invalidations
+            WHERE seq > ? ORDER BY seq
+        ''', (self.last_seq,)).fetchall()
+        if time.monotonic() - self._last_prune >= self.retention / 2:
+            self._last_prune = time.monotonic()
+            with conn:
+                conn.execute('DELETE FROM cache_invalidations WHERE created_at < ?',
+                             (time.time() - self.retention,))
+        conn.close()
+
+        items = []
+        for row in rows:
+            self.last_seq = row['seq']
+            if row['origin'] == self.origin:
+                continue
+            key = json.loads(row['cache_key'])
+            items.append((row['cache'], tuple(key) if isinstance(key, list) else key))
+        self.registry.invalidate_many(items, publish=False)
+        self.received += len(items)
+        return len(items)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.poll)
+            except Exception as e:
+                logger.error(f"Ошибка чтения сбросов кэша: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+class CacheRegistry:
+    def __init__(self):
+        self.caches: Dict[str, ReadThroughCache] = {}
+        # Размеры и TTL из конфигурации: имя -> {maxsize, ttl}
+        self.settings: Dict[str, Dict] = {}
+        self.channel: Optional[InvalidationChannel] = None
+        self.poll_interval = 0.0
+
+    def configure(self, config: Dict):
+        """Секция cache из config.json: {"poll_interval": 1, "<кэш>": {"ttl": 30}}"""
+        self.poll_interval = config.get('poll_interval', 0.0)
+        for name, options in config.items():
+            if isinstance(options, dict):
+                self.settings[name] = options
+                cache = self.caches.get(name)
+                if cache is not None:
+                    cache.maxsize = options.get('maxsize', cache.maxsize)
+                    cache.ttl = options.get('ttl', cache.ttl)
+
+    def cache(self, name: str, maxsize: int = 10000, ttl: float = 60.0) -> ReadThroughCache:
+        cache = self.caches.get(name)
+        if cache is None:
+            options = self.settings.get(name, {})
+            cache = self.caches[name] = ReadThroughCache(
+                name, options.get('maxsize', maxsize), options.get('ttl', ttl)
+            )
+        return cache
+
+    def invalidate(self, name: str, key, publish: bool = True):
+        self.invalidate_many([(name, key)], publish)
+
+    def invalidate_many(self, items: Iterable[Tuple[str, object]], publish: bool = True):
+        """Сброс ключей (кэш, ключ); ключ None - весь кэш"""
+        items = list(items)
+        for name, key in items:
+            cache = self.caches.get(name)
+            if cache is None:
+                continue
+            if key is None:
+                cache.clear()
+            else:
+                cache.invalidate(key)
+        if publish and self.channel is not None:
+            try:
+                self.channel.publish(items)
+            except Exception as e:
+                # Остальные воркеры увидят изменение после TTL
+                logger.error(f"Не удалось опубликовать сброс кэша: {e}")
+
+    def publish(self, db_name: str, items: Iterable[Tuple[str, object]]):
+        """
+        Сброс из процесса без запущенного канала (utils.py): воркеры бота
+        применят его при следующем опросе cache_invalidations
+        """
+        channel = self.channel
+        if channel is None or scope(channel.db_name) != scope(db_name):
+            channel = InvalidationChannel(self, db_name)
+        channel.publish(items)
+
+    async def start(self, db_name: str):
+        """Канал между процессами включается, если задан poll_interval"""
+        if self.poll_interval and self.channel is None:
+            self.channel = InvalidationChannel(self, db_name, self.poll_interval)
+            await self.channel.start()
+
+    async def stop(self):
+        if self.channel is not None:
+            await self.channel.stop()
+            self.channel = None
+
+    def format_stats(self) -> str:
+        lines = ["🗄 Кэш чтения", ""]
+        for name, cache in sorted(self.caches.items()):
+            lines.append(f"{name}: {len(cache)}/{cache.maxsize}, попаданий "
+                         f"{cache.hit_ratio():.0%} ({cache.hits}/{cache.hits + cache.misses}), "
+                         f"сбросов {cache.invalidations}, вытеснено {cache.evictions}")
+        if not self.caches:
+            lines.append("Кэши еще не использовались")
+        if self.channel is not None:
+            lines.append(f"Сбросов от других процессов: {self.channel.received}")
+        return '\n'.join(lines)
+
+
+caches = CacheRegistry()
@@ -0,0 +1,183 @@
+"""
+Контентно-адресуемое хранение синхронизируемых данных
+Файлы делятся на чанки (хэш -> блоб), в облако отправляются только
+чанки, которых там еще нет
+"""
+
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Set
+
+from db_connection import connect
+
+
+class ChunkStore:
+    def __init__(self, db_name: str = 'studyboost.db', avg_records: int = 16,
+                 max_chunk_size: int = 1024 * 1024):
+        self.db_name = db_name
+        # Граница чанка ставится после записи, хэш которой делится на avg_records:
+        # одинаковые заметки дают одинаковые чанки в разных снимках
+        self.avg_records = avg_records
+        self.max_chunk_size = max_chunk_size
+        self.init_tables()
+
+    def get_connection(self):
+        return connect(self.db_name, timeout=10)
+
+    def init_tables(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        # Чанки, уже загруженные в облако пользователя
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_index (
+                user_id INTEGER,
+                service TEXT,
+                chunk_hash TEXT,
+                size INTEGER,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, service, chunk_hash)
+            ) WITHOUT ROWID
+        ''')
+
+        # Какие артефакты (снимки, дельты, экспорты) ссылаются на чанки
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_refs (
+                user_id INTEGER,
+                service TEXT,
+                artifact TEXT,
+                chunk_hash TEXT,
+                PRIMARY KEY (user_id, service, artifact, chunk_hash)
+            ) WITHOUT ROWID
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chunk_refs_hash
+            ON chunk_refs(user_id, service, chunk_hash)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def chunk_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def split_records(self, lines: Iterable[bytes]) -> Iterator[bytes]:
+        """Разбиение NDJSON на чанки с границами, зависящими от содержимого"""
+        current = []
+        size = 0
+        for line in lines:
+            current.append(line)
+            size += len(line)
+            boundary = int.from_bytes(hashlib.sha1(line).digest()[:4], 'big')
+            if boundary % self.avg_records == 0 or size >= self.max_chunk_size:
+                yield b''.join(current)
+                current = []
+                size = 0
+        if current:
+            yield b''.join(current)
+
+    def split_file(self, path: str) -> Iterator[bytes]:
+        """Разбиение бинарного файла (PDF) на чанки фиксированного размера"""
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(self.max_chunk_size)
+                if not data:
+                    break
+                yield data
+
+    def missing(self, user_id: int, service: str, hashes: Iterable[str]) -> Set[str]:
+        """Хэши чанков, которых еще нет в облаке"""
+        hashes = set(hashes)
+        if not hashes:
+            return set()
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS wanted_chunks (chunk_hash TEXT PRIMARY KEY)
+        ''')
+        cursor.executemany('INSERT OR IGNORE INTO wanted_chunks VALUES (?)',
+                           [(h,) for h in hashes])
+        cursor.execute('''
+            SELECT w.chunk_hash FROM wanted_chunks w
+            JOIN chunk_index c ON c.user_id = ? AND c.service = ?
+                               AND c.chunk_hash = w.chunk_hash
+        ''', (user_id, service))
+        present = {row['chunk_hash'] for row in cursor.fetchall()}
+        conn.close()
+        return hashes - present
+
+    def add_artifact(self, user_id: int, service: str, artifact: str,
+                     chunks: Dict[str, int]):
+        """Регистрация загруженного артефакта и его чанков (хэш -> размер)"""
+        conn = self.get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO chunk_index (user_id, service, chunk_hash, size)
+                VALUES (?, ?, ?, ?)
+            ''', [(user_id, service, h, size) for h, size in chunks.items()])
+            conn.executemany('''
+                INSERT OR IGNORE INTO chunk_refs (user_id, service, artifact, chunk_hash)
+                VALUES (?, ?, ?, ?)
+            ''', [(user_id, service, artifact, h) for h in chunks])
+        conn.close()
+
+    def artifact_exists(self, user_id: int, service: str, artifact: str) -> bool:
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT 1 FROM chunk_refs WHERE user_id = ? AND service = ? AND artifact = ?
+            LIMIT 1
+        ''', (user_id, service, artifact)).fetchone()
+        conn.close()
+        return row is not None
+
+    def orphans(self, user_id: int, service: str, dropped: List[str],
+                keep: Iterable[str] = ()) -> Set[str]:
+        """Чанки, на которые не останется ссылок после удаления артефактов"""
+        if not dropped:
+            return set()
+
+        conn = self.get_connection()
+        placeholders = ','.join('?' * len(dropped))
+        rows = conn.execute(f'''
+            SELECT chunk_hash FROM chunk_refs
+            WHERE user_id = ? AND service = ?
+            GROUP BY chunk_hash
+            HAVING SUM(artifact NOT IN ({placeholders})) = 0
+        ''', (user_id, service, *dropped)).fetchall()
+        conn.close()
+        return {row['chunk_hash'] for row in rows} - set(keep)
+
+    def drop_artifacts(self, user_id: int, service: str, artifacts: List[str]) -> List[str]:
+        """
+        Удаление ссылок артефактов и сборка мусора в индексе
+
+        Returns:
+            Хэши чанков, удаленных из индекса
+        """
+        if not artifacts:
+            return []
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(artifacts))
+        with conn:
+            cursor.execute(f'''
+                DELETE FROM chunk_refs
+                WHERE user_id = ? AND service = ? AND artifact IN ({placeholders})
+            ''', (user_id, service, *artifacts))
+            cursor.execute('''
+                SELECT chunk_hash FROM chunk_index c
+                WHERE user_id = ? AND service = ? AND NOT EXISTS (
+                    SELECT 1 FROM chunk_refs r
+                    WHERE r.user_id = c.user_id AND r.service = c.service
+                      AND r.chunk_hash = c.chunk_hash
+                )
+            ''', (user_id, service))
+            removed = [row['chunk_hash'] for row in cursor.fetchall()]
+            cursor.executemany('''
+                DELETE FROM chunk_index WHERE user_id = ? AND service = ? AND chunk_hash = ?
+            ''', [(user_id, service, h) for h in removed])
+        conn.close()
+        return removed
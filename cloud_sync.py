@@ -1,34 +1,31 @@
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
+import gzip
+import hashlib
 import json
 import os
 
+from chunk_store import ChunkStore
+from credential_store import CredentialStore
+
 
 class CloudSync:
-    def __init__(self):
-        self.config_file = 'cloud_config.json'
-        self.credentials = self.load_credentials()
-    
-    def load_credentials(self) -> Dict:
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
-        return {}
-    
-    def save_credentials(self, service: str, credentials: Dict):
-        self.credentials[service] = credentials
-        with open(self.config_file, 'w') as f:
-            json.dump(self.credentials, f)
+    def __init__(self, sync_dir: str = 'sync_batches', snapshot_every: int = 20,
+                 compress: bool = True, db_name: str = 'studyboost.db'):
+        self.credentials = CredentialStore(db_name)
+        self.chunks = ChunkStore(db_name)
+        self.sync_dir = sync_dir
+        # Через сколько дельт делать полный снимок (компакция манифеста)
+        self.snapshot_every = snapshot_every
+        self.compress = compress
     
     def connect_google_drive(self, user_id: int, auth_code: str) -> bool:
         try:
-            self.credentials[f'gdrive_{user_id}'] = {
+            self.credentials.set(user_id, 'google_drive', {
                 'service': 'google_drive',
                 'connected': True,
                 'user_id': user_id,
                 'auth_code': auth_code
-            }
-            self.save_credentials(f'gdrive_{user_id}', 
-                                 self.credentials[f'gdrive_{user_id}'])
+            })
             return True
         except Exception as e:
             print(f"Ошибка подключения Google Drive: {e}")
@@ -36,14 +33,12 @@ class CloudSync:
     
     def connect_dropbox(self, user_id: int, access_token: str) -> bool:
         try:
-            self.credentials[f'dropbox_{user_id}'] = {
+            self.credentials.set(user_id, 'dropbox', {
                 'service': 'dropbox',
                 'connected': True,
                 'user_id': user_id,
                 'access_token': access_token
-            }
-            self.save_credentials(f'dropbox_{user_id}', 
-                                 self.credentials[f'dropbox_{user_id}'])
+            })
             return True
         except Exception as e:
             print(f"Ошибка подключения Dropbox: {e}")
@@ -51,7 +46,7 @@ class CloudSync:
     
     def upload_to_google_drive(self, user_id: int, file_path: str, 
                                folder_name: str = 'StudyBoost') -> Optional[str]:
-        creds = self.credentials.get(f'gdrive_{user_id}')
+        creds = self.credentials.get(user_id, 'google_drive')
         if not creds or not creds.get('connected'):
             return None
         
@@ -60,7 +55,7 @@ class CloudSync:
     
     def upload_to_dropbox(self, user_id: int, file_path: str, 
                          folder_path: str = '/StudyBoost') -> Optional[str]:
-        creds = self.credentials.get(f'dropbox_{user_id}')
+        creds = self.credentials.get(user_id, 'dropbox')
         if not creds or not creds.get('connected'):
             return None
         
@@ -90,15 +85,277 @@ class CloudSync:
             print(f"Ошибка синхронизации: {e}")
             return False
     
+    def upload(self, user_id: int, file_path: str, 
+               service: str = 'google_drive') -> Optional[str]:
+        if service == 'google_drive':
+            return self.upload_to_google_drive(user_id, file_path)
+        elif service == 'dropbox':
+            return self.upload_to_dropbox(user_id, file_path)
+        return None
+    
+    def encode_records(self, records: List[Dict]) -> List[bytes]:
+        return [
+            (json.dumps(record, ensure_ascii=False, 
+                        separators=(',', ':'), default=str) + '\n').encode('utf-8')
+            for record in records
+        ]
+    
+    def chunk_file_name(self, chunk_hash: str) -> str:
+        return f'{chunk_hash}.gz' if self.compress else chunk_hash
+    
+    def write_chunks(self, batch_dir: str, user_id: int, service: str,
+                     chunks) -> Tuple[List[str], Dict[str, int], List[str]]:
+        """
+        Запись чанков, которых еще нет в облаке
+        
+        Returns:
+            Пути новых файлов, размеры всех чанков и их хэши по порядку
+        """
+        hashes = []
+        sizes = {}
+        payloads = {}
+        for chunk in chunks:
+            chunk_hash = self.chunks.chunk_hash(chunk)
+            hashes.append(chunk_hash)
+            sizes[chunk_hash] = len(chunk)
+            payloads[chunk_hash] = chunk
+        
+        paths = []
+        for chunk_hash in self.chunks.missing(user_id, service, sizes):
+            path = os.path.join(batch_dir, self.chunk_file_name(chunk_hash))
+            data = payloads[chunk_hash]
+            with open(path, 'wb') as f:
+                f.write(gzip.compress(data) if self.compress else data)
+            paths.append(path)
+        
+        return paths, sizes, hashes
+    
+    def prepare_sync(self, user_id: int, db, 
+                     service: str = 'google_drive') -> Optional[Dict]:
+        """
+        Подготовка пакета синхронизации: дельта с момента последнего
+        водяного знака или полный снимок, если дельт накопилось много
+        
+        Returns:
+            Описание пакета или None, если синхронизировать нечего
+        """
+        state = db.get_sync_state(user_id, service)
+        after_note_id = 0 if self.needs_snapshot(state) else state['last_note_id']
+        notes = db.get_notes_since(user_id, after_note_id)
+        return self.build_batch(user_id, service, state, notes)
+    
+    def prepare_sync_many(self, user_ids: List[int], db, 
+                          service: str = 'google_drive') -> List[Dict]:
+        """Подготовка пакетов для многих пользователей двумя запросами к БД"""
+        states = db.get_sync_states(user_ids, service)
+        watermarks = {
+            user_id: 0 if self.needs_snapshot(state) else state['last_note_id']
+            for user_id, state in states.items()
+        }
+        notes = db.get_notes_since_many(watermarks)
+        
+        batches = []
+        for user_id in user_ids:
+            batch = self.build_batch(user_id, service, states[user_id], notes[user_id])
+            if batch is not None:
+                batches.append(batch)
+        return batches
+    
+    def needs_snapshot(self, state: Dict) -> bool:
+        manifest = state['manifest']
+        return (not manifest.get('snapshot') 
+                or len(manifest.get('deltas', [])) >= self.snapshot_every)
+    
+    def build_batch(self, user_id: int, service: str, state: Dict, 
+                    notes: List[Dict]) -> Optional[Dict]:
+        manifest = state['manifest']
+        full = self.needs_snapshot(state)
+        
+        if not full and not notes:
+            return None
+        
+        seq = manifest.get('seq', 0) + 1
+        kind = 'snapshot' if full else 'delta'
+        name = f'{kind}_{seq:06d}'
+        
+        batch_dir = self.batch_directory(user_id, service, name)
+        
+        # Заметки делятся на чанки по содержимому: в облако уходят только
+        # чанки, которых там еще нет (например, из прошлого снимка)
+        lines = self.encode_records(notes)
+        paths, sizes, hashes = self.write_chunks(
+            batch_dir, user_id, service, self.chunks.split_records(lines)
+        )
+        
+        last_note_id = notes[-1]['note_id'] if notes else state['last_note_id']
+        entry = {
+            'name': name,
+            'first_note_id': notes[0]['note_id'] if notes else None,
+            'last_note_id': last_note_id,
+            'count': len(notes),
+            'sha256': hashlib.sha256(b''.join(lines)).hexdigest(),
+            'compressed': self.compress,
+            'chunks': hashes
+        }
+        
+        dropped = []
+        obsolete = []
+        if full:
+            # Снимок заменяет предыдущий снимок и все дельты
+            if manifest.get('snapshot'):
+                dropped.append(manifest['snapshot']['name'])
+            dropped.extend(delta['name'] for delta in manifest.get('deltas', []))
+            obsolete = [
+                self.chunk_file_name(chunk_hash)
+                for chunk_hash in self.chunks.orphans(user_id, service, dropped, keep=hashes)
+            ]
+            new_manifest = {
+                'version': 2,
+                'user_id': user_id,
+                'service': service,
+                'seq': seq,
+                'snapshot': entry,
+                'deltas': []
+            }
+        else:
+            new_manifest = dict(manifest, seq=seq, 
+                                deltas=manifest.get('deltas', []) + [entry])
+        
+        manifest_path = os.path.join(batch_dir, 'manifest.json')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(new_manifest, f, ensure_ascii=False, separators=(',', ':'))
+        
+        return {
+            'kind': 'notes',
+            'user_id': user_id,
+            'service': service,
+            'dir': batch_dir,
+            'files': paths + [manifest_path],
+            'last_note_id': last_note_id,
+            'manifest': new_manifest,
+            'artifact': name,
+            'chunks': sizes,
+            'dropped': dropped,
+            'obsolete': obsolete
+        }
+    
+    def batch_directory(self, user_id: int, service: str, name: str) -> str:
+        """Свой каталог у каждого пакета: синхронизация заметок и загрузка
+        экспорта идут параллельно и не удаляют файлы друг друга"""
+        batch_dir = os.path.join(self.sync_dir, f'{service}_{user_id}', name)
+        os.makedirs(batch_dir, exist_ok=True)
+        return batch_dir
+    
+    def prepare_file_sync(self, user_id: int, file_path: str,
+                          service: str = 'google_drive',
+                          content_key: str = None) -> Optional[Dict]:
+        """
+        Подготовка загрузки экспорта (PDF) по чанкам
+        
+        Args:
+            content_key: хэш исходных данных экспорта (PDFGenerator.notes_digest);
+                повторный экспорт тех же данных не загружается, даже если
+                байты файла другие. Без него - хэш самого файла
+        
+        Returns:
+            Описание пакета или None, если такой экспорт уже в облаке
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        artifact = f'export_{content_key or digest.hexdigest()}'
+        
+        if self.chunks.artifact_exists(user_id, service, artifact):
+            return None
+        
+        batch_dir = self.batch_directory(user_id, service, artifact)
+        paths, sizes, hashes = self.write_chunks(
+            batch_dir, user_id, service, self.chunks.split_file(file_path)
+        )
+        
+        descriptor_path = os.path.join(batch_dir, f'{artifact}.json')
+        with open(descriptor_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'name': os.path.basename(file_path),
+                'sha256': digest.hexdigest(),
+                'size': os.path.getsize(file_path),
+                'compressed': self.compress,
+                'chunks': hashes
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        
+        return {
+            'kind': 'export',
+            'user_id': user_id,
+            'service': service,
+            'dir': batch_dir,
+            'files': paths + [descriptor_path],
+            'artifact': artifact,
+            'chunks': sizes,
+            'dropped': [],
+            'obsolete': []
+        }
+    
+    def commit_sync(self, batch: Dict, db=None):
+        self.chunks.add_artifact(batch['user_id'], batch['service'], 
+                                 batch['artifact'], batch['chunks'])
+        self.chunks.drop_artifacts(batch['user_id'], batch['service'], batch['dropped'])
+        
+        if batch['kind'] == 'notes':
+            db.update_sync_state(batch['user_id'], batch['service'], 
+                                 batch['last_note_id'], batch['manifest'])
+            db.clear_sync_pending(batch['user_id'], batch['last_note_id'])
+        
+        for path in batch['files']:
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(batch['dir'])
+        except OSError:
+            pass
+    
+    def sync_notes_incremental(self, user_id: int, db, 
+                               service: str = 'google_drive') -> bool:
+        try:
+            batch = self.prepare_sync(user_id, db, service)
+            if batch is None:
+                return True
+            
+            for path in batch['files']:
+                if self.upload(user_id, path, service) is None:
+                    return False
+            
+            self.commit_sync(batch, db)
+            return True
+        
+        except Exception as e:
+            print(f"Ошибка синхронизации: {e}")
+            return False
+    
+    @staticmethod
+    def rebuild_from_manifest(manifest: Dict, directory: str) -> List[Dict]:
+        """Восстановление списка заметок из снимка и дельт по манифесту"""
+        notes = {}
+        entries = [manifest['snapshot']] + manifest.get('deltas', [])
+        for entry in entries:
+            for chunk_hash in entry['chunks']:
+                if entry.get('compressed'):
+                    with gzip.open(os.path.join(directory, f'{chunk_hash}.gz'), 'rb') as f:
+                        data = f.read()
+                else:
+                    with open(os.path.join(directory, chunk_hash), 'rb') as f:
+                        data = f.read()
+                for line in data.decode('utf-8').splitlines():
+                    if line.strip():
+                        note = json.loads(line)
+                        notes[note['note_id']] = note
+        return [notes[note_id] for note_id in sorted(notes)]
+    
     def is_connected(self, user_id: int, service: str = 'google_drive') -> bool:
-        key = f'{service}_{user_id}'
-        return key in self.credentials and self.credentials[key].get('connected', False)
+        return self.credentials.is_connected(user_id, service)
     
     def disconnect(self, user_id: int, service: str = 'google_drive'):
-        key = f'{service}_{user_id}'
-        if key in self.credentials:
-            del self.credentials[key]
-            self.save_credentials(key, {})
+        self.credentials.delete(user_id, service)
     
     def get_connection_url(self, service: str = 'google_drive') -> str:
         if service == 'google_drive':
@@ -0,0 +1,293 @@
+"""
+Асинхронная загрузка файлов в облако
+Ограниченный пул воркеров, лимиты запросов по провайдерам,
+повторы с экспоненциальной задержкой и докачка по частям
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Callable, Dict, List
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class UploadJob:
+    def __init__(self, user_id: int, service: str, files: List[str],
+                 on_done: Callable = None, folder: str = 'StudyBoost',
+                 obsolete: List[str] = None, artifact: str = None):
+        self.user_id = user_id
+        self.service = service
+        # Загрузка экспорта (PDF); None - синхронизация заметок
+        self.artifact = artifact
+        self.files = files
+        # Удаленные файлы, которые больше не нужны после загрузки
+        self.obsolete = obsolete or []
+        self.on_done = on_done
+        self.folder = folder
+        self.attempts = 0
+        self.sessions = {}
+        self.urls = {}
+        self.error = None
+        self.future = None
+
+    @property
+    def key(self):
+        # Экспорт не занимает ключ синхронизации заметок (is_pending)
+        if self.artifact is not None:
+            return (self.user_id, self.service, 'export', self.artifact)
+        return (self.user_id, self.service)
+
+
+class UploadBackend:
+    """Базовый интерфейс хранилища с докачкой по частям"""
+
+    async def start_session(self, job: UploadJob, file_path: str) -> str:
+        raise NotImplementedError
+
+    async def get_offset(self, session_id: str) -> int:
+        """Сколько байт уже принято хранилищем"""
+        raise NotImplementedError
+
+    async def upload_chunk(self, session_id: str, offset: int, data: bytes):
+        raise NotImplementedError
+
+    async def finish_session(self, session_id: str) -> str:
+        """Завершение загрузки, возвращает ссылку на файл"""
+        raise NotImplementedError
+
+    async def delete(self, job: UploadJob, name: str):
+        pass
+
+
+class LocalBackend(UploadBackend):
+    """
+    Хранилище в локальной папке для тестов и бенчмарков
+
+    latency и failure_rate имитируют задержку сети и сбои облака
+    """
+
+    def __init__(self, root: str = 'cloud_storage', latency: float = 0.0,
+                 failure_rate: float = 0.0):
+        self.root = root
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sessions = {}
+
+    async def _simulate_network(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise UploadError("Имитация сбоя сети")
+
+    def _remote_path(self, job: UploadJob, name: str) -> str:
+        return os.path.join(self.root, job.service, str(job.user_id), job.folder, name)
+
+    async def start_session(self, job: UploadJob, file_path: str) -> str:
+        await self._simulate_network()
+        target = self._remote_path(job, os.path.basename(file_path))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        session_id = f'{target}.part'
+        with open(session_id, 'wb'):
+            pass
+        self.sessions[session_id] = target
+        return session_id
+
+    async def get_offset(self, session_id: str) -> int:
+        return os.path.getsize(session_id) if os.path.exists(session_id) else 0
+
+    async def upload_chunk(self, session_id: str, offset: int, data: bytes):
+        await self._simulate_network()
+        with open(session_id, 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+
+    async def finish_session(self, session_id: str) -> str:
+        await self._simulate_network()
+        target = self.sessions.pop(session_id)
+        os.replace(session_id, target)
+        return f'file://{os.path.abspath(target)}'
+
+    async def delete(self, job: UploadJob, name: str):
+        path = self._remote_path(job, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class CloudSyncBackend(UploadBackend):
+    """Адаптер к синхронным методам CloudSync (файл целиком, в потоке)"""
+
+    def __init__(self, cloud, service: str):
+        self.cloud = cloud
+        self.service = service
+        self.sessions = {}
+
+    async def start_session(self, job: UploadJob, file_path: str) -> str:
+        self.sessions[file_path] = job.user_id
+        return file_path
+
+    async def get_offset(self, session_id: str) -> int:
+        return 0
+
+    async def upload_chunk(self, session_id: str, offset: int, data: bytes):
+        pass
+
+    async def finish_session(self, session_id: str) -> str:
+        user_id = self.sessions[session_id]
+        url = await asyncio.to_thread(self.cloud.upload, user_id, session_id, self.service)
+        if url is None:
+            raise UploadError("Облако не подключено", retryable=False)
+        del self.sessions[session_id]
+        return url
+
+
+class RateLimiter:
+    """Токен-бакет: не более rate запросов в секунду"""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncUploader:
+    def __init__(self, backends: Dict[str, UploadBackend], workers: int = 4,
+                 rate_limits: Dict[str, float] = None, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0,
+                 chunk_size: int = 4 * 1024 * 1024, queue_size: int = 1000):
+        self.backends = backends
+        self.workers = workers
+        self.rate_limiters = {
+            service: RateLimiter(rate)
+            for service, rate in (rate_limits or {}).items()
+        }
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.queue = None
+        self.pending = {}
+        self._tasks = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def is_pending(self, user_id: int, service: str) -> bool:
+        return (user_id, service) in self.pending
+
+    def submit(self, job: UploadJob) -> asyncio.Future:
+        """
+        Постановка загрузки в очередь без ожидания
+
+        Raises:
+            asyncio.QueueFull: очередь переполнена
+        """
+        job.future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(job)
+        self.pending[job.key] = job
+        return job.future
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run_job(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run_job(self, job: UploadJob):
+        success = False
+        while True:
+            try:
+                await self._upload_files(job)
+                success = True
+                break
+            except Exception as e:
+                job.error = e
+                job.attempts += 1
+                retryable = getattr(e, 'retryable', True)
+                if not retryable or job.attempts > self.max_retries:
+                    break
+                delay = min(self.max_delay, self.base_delay * 2 ** (job.attempts - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+        self.pending.pop(job.key, None)
+        if not job.future.done():
+            job.future.set_result(success)
+
+        if job.on_done:
+            try:
+                await job.on_done(job, success)
+            except Exception as e:
+                print(f"Ошибка обработки результата загрузки: {e}")
+
+    async def _upload_files(self, job: UploadJob):
+        backend = self.backends.get(job.service)
+        if backend is None:
+            raise UploadError(f"Неизвестный сервис: {job.service}", retryable=False)
+        limiter = self.rate_limiters.get(job.service)
+
+        for file_path in job.files:
+            if file_path in job.urls:
+                continue
+
+            # При повторе продолжаем с того места, где остановились
+            session_id = job.sessions.get(file_path)
+            if session_id is None:
+                if limiter:
+                    await limiter.acquire()
+                session_id = await backend.start_session(job, file_path)
+                job.sessions[file_path] = session_id
+
+            size = os.path.getsize(file_path)
+            offset = await backend.get_offset(session_id)
+            while offset < size:
+                data = await asyncio.to_thread(self._read_chunk, file_path, offset)
+                if limiter:
+                    await limiter.acquire()
+                await backend.upload_chunk(session_id, offset, data)
+                offset += len(data)
+
+            if limiter:
+                await limiter.acquire()
+            job.urls[file_path] = await backend.finish_session(session_id)
+            del job.sessions[file_path]
+
+        for name in job.obsolete:
+            try:
+                await backend.delete(job, name)
+            except Exception as e:
+                print(f"Не удалось удалить устаревший файл {name}: {e}")
+
+    def _read_chunk(self, file_path: str, offset: int) -> bytes:
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(self.chunk_size)
@@ -0,0 +1,135 @@
+"""
+Хранилище учетных данных облачных сервисов
+Одна строка SQLite на пару (пользователь, сервис) и LRU-кэш для проверок
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from db_connection import connect
+
+
+class CredentialStore:
+    def __init__(self, db_name: str = 'studyboost.db', cache_size: int = 10000,
+                 cache_ttl: float = 60.0, legacy_file: str = 'cloud_config.json'):
+        self.db_name = db_name
+        self.cache_size = cache_size
+        # Другие воркеры могут изменить запись, поэтому кэш живет недолго
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        # get/set вызываются из потоков (asyncio.to_thread)
+        self._lock = threading.Lock()
+        self.init_table()
+        if legacy_file and os.path.exists(legacy_file):
+            self.import_legacy(legacy_file)
+
+    def get_connection(self):
+        return connect(self.db_name, timeout=10)
+
+    def init_table(self):
+        conn = self.get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cloud_credentials (
+                user_id INTEGER,
+                service TEXT,
+                data TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, service)
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def import_legacy(self, legacy_file: str):
+        """Перенос данных из cloud_config.json (однократно)"""
+        # Воркеры стартуют одновременно: файл мог уже перенести другой процесс
+        try:
+            with open(legacy_file, 'r') as f:
+                legacy = json.load(f)
+        except FileNotFoundError:
+            return
+
+        services = {'gdrive': 'google_drive', 'google_drive': 'google_drive',
+                    'dropbox': 'dropbox'}
+        rows = []
+        for key, data in legacy.items():
+            prefix, _, user_id = key.rpartition('_')
+            if prefix in services and user_id.isdigit() and data:
+                rows.append((int(user_id), services[prefix], json.dumps(data)))
+
+        conn = self.get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO cloud_credentials (user_id, service, data)
+                VALUES (?, ?, ?)
+            ''', rows)
+        conn.close()
+
+        try:
+            os.replace(legacy_file, f'{legacy_file}.migrated')
+        except FileNotFoundError:
+            # Другой процесс перенес те же строки (INSERT OR IGNORE) и переименовал файл
+            return
+        print(f"✅ Перенесено учетных данных из {legacy_file}: {len(rows)}")
+
+    def _cache_get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return False, None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._cache[key]
+                return False, None
+            self._cache.move_to_end(key)
+            return True, value
+
+    def _cache_put(self, key, value):
+        with self._lock:
+            self._cache[key] = (value, time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get(self, user_id: int, service: str) -> Optional[Dict]:
+        key = (user_id, service)
+        found, value = self._cache_get(key)
+        if found:
+            return value
+
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT data FROM cloud_credentials WHERE user_id = ? AND service = ?
+        ''', (user_id, service)).fetchone()
+        conn.close()
+
+        value = json.loads(row['data']) if row else None
+        self._cache_put(key, value)
+        return value
+
+    def set(self, user_id: int, service: str, data: Dict):
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO cloud_credentials (user_id, service, data, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (user_id, service, json.dumps(data)))
+        conn.close()
+        self._cache_put((user_id, service), data)
+
+    def delete(self, user_id: int, service: str):
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                DELETE FROM cloud_credentials WHERE user_id = ? AND service = ?
+            ''', (user_id, service))
+        conn.close()
+        self._cache_put((user_id, service), None)
+
+    def is_connected(self, user_id: int, service: str) -> bool:
+        data = self.get(user_id, service)
+        return bool(data and data.get('connected', False))
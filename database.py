@@ -3,28 +3,176 @@
 Использует SQLite для хранения всех данных
 """
 
-import sqlite3
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import json
 
+from cache import caches, scope
+from db_connection import connect
+
+# Точные значения глобальных счетчиков (utils.py stats --exact / --reconcile).
+# Имена совпадают с теми, что ведут триггеры global_counters
+GLOBAL_COUNTS_SQL = '''
+    SELECT 'total_users', COUNT(*) FROM users
+    UNION ALL SELECT 'total_points', IFNULL(SUM(total_points), 0) FROM users
+    UNION ALL SELECT 'total_notes', COUNT(*) FROM notes
+    UNION ALL SELECT 'total_goals', COUNT(*) FROM goals
+    UNION ALL SELECT 'total_achievements', COUNT(*) FROM achievements
+    UNION ALL SELECT 'note_type:' || IFNULL(note_type, ''), COUNT(*) FROM notes
+        GROUP BY IFNULL(note_type, '')
+    UNION ALL SELECT 'category:' || IFNULL(category, ''), COUNT(*) FROM notes
+        GROUP BY IFNULL(category, '')
+'''
+
+
+def _bump(name: str, delta: str) -> str:
+    """Изменение счетчика внутри триггера"""
+    return (f"INSERT INTO global_counters (name, value) VALUES ({name}, {delta}) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;")
+
+
+# Триггеры выполняются в транзакции записи, поэтому счетчики меняются
+# вместе с данными при любом способе записи (бот, utils.py, загрузка данных)
+GLOBAL_COUNTER_TRIGGERS = {
+    'counters_users_insert': f'''
+        AFTER INSERT ON users BEGIN
+            {_bump("'total_users'", '1')}
+            {_bump("'total_points'", 'IFNULL(NEW.total_points, 0)')}
+        END''',
+    'counters_users_delete': f'''
+        AFTER DELETE ON users BEGIN
+            {_bump("'total_users'", '-1')}
+            {_bump("'total_points'", '-IFNULL(OLD.total_points, 0)')}
+        END''',
+    'counters_users_points': f'''
+        AFTER UPDATE OF total_points ON users
+        WHEN NEW.total_points IS NOT OLD.total_points BEGIN
+            {_bump("'total_points'", 'IFNULL(NEW.total_points, 0) - IFNULL(OLD.total_points, 0)')}
+        END''',
+    'counters_notes_insert': f'''
+        AFTER INSERT ON notes BEGIN
+            {_bump("'total_notes'", '1')}
+            {_bump("'note_type:' || IFNULL(NEW.note_type, '')", '1')}
+            {_bump("'category:' || IFNULL(NEW.category, '')", '1')}
+        END''',
+    'counters_notes_delete': f'''
+        AFTER DELETE ON notes BEGIN
+            {_bump("'total_notes'", '-1')}
+            {_bump("'note_type:' || IFNULL(OLD.note_type, '')", '-1')}
+            {_bump("'category:' || IFNULL(OLD.category, '')", '-1')}
+        END''',
+    'counters_notes_update': f'''
+        AFTER UPDATE OF note_type, category ON notes BEGIN
+            {_bump("'note_type:' || IFNULL(OLD.note_type, '')", '-1')}
+            {_bump("'note_type:' || IFNULL(NEW.note_type, '')", '1')}
+            {_bump("'category:' || IFNULL(OLD.category, '')", '-1')}
+            {_bump("'category:' || IFNULL(NEW.category, '')", '1')}
+        END''',
+    'counters_goals_insert': f'''
+        AFTER INSERT ON goals BEGIN
+            {_bump("'total_goals'", '1')}
+        END''',
+    'counters_goals_delete': f'''
+        AFTER DELETE ON goals BEGIN
+            {_bump("'total_goals'", '-1')}
+        END''',
+    'counters_achievements_insert': f'''
+        AFTER INSERT ON achievements BEGIN
+            {_bump("'total_achievements'", '1')}
+        END''',
+    'counters_achievements_delete': f'''
+        AFTER DELETE ON achievements BEGIN
+            {_bump("'total_achievements'", '-1')}
+        END''',
+}
+
 
 class Database:
+    # PRAGMA user_version базы с полной схемой. Проверяется при каждом
+    # создании Database: файл, удаленный и созданный заново по тому же пути,
+    # получает схему снова (раньше проверка была одна на путь и процесс)
+    SCHEMA_VERSION = 1
+    
+    # Кэши чтения (ключ - (путь к базе, user_id, ...)).
+    # Запись данных пользователя сбрасывает его ключи, utils.py публикует
+    # сбросы в cache_invalidations, TTL ограничивает остальное устаревание
+    DASHBOARD_TTL = 30
+    DASHBOARD_GOALS = 5
+    # Кэши, зависящие от баллов, заметок и целей пользователя
+    USER_CACHES = ('dashboard', 'stats', 'user_points')
+    # Таблица -> кэши, которые ее читают (сброс после записи из utils.py)
+    TABLE_CACHES = {
+        'users': ('user_exists', 'user_settings') + USER_CACHES,
+        'notes': ('dashboard', 'stats'),
+        'goals': ('dashboard', 'stats'),
+        'quiz_results': ('stats',),
+        'achievements': ('achievements',),
+        'schedule': ('schedule',),
+    }
+    
     def __init__(self, db_name='studyboost.db'):
         self.db_name = db_name
-        self.init_database()
+        # Подписчики на изменения целей и расписания: callback(table, item_id)
+        self.listeners = []
+        self.cache_scope = scope(db_name)
+        if not self.schema_ready():
+            self.init_database()
+    
+    def schema_ready(self) -> bool:
+        """Схема уже создана (один PRAGMA вместо всех CREATE ... IF NOT EXISTS)"""
+        conn = self.get_connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        return version >= self.SCHEMA_VERSION
     
     def get_connection(self):
         """Получение подключения к БД"""
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return connect(self.db_name)
+    
+    @classmethod
+    def user_cache_keys(cls, db_name: str, user_id: int, names=USER_CACHES) -> List[tuple]:
+        """Ключи (кэш, ключ) пользователя для caches.invalidate_many"""
+        return [(name, (scope(db_name), user_id)) for name in names]
+    
+    @classmethod
+    def table_cache_keys(cls, db_name: str, tables, user_id: int = None) -> List[tuple]:
+        """Ключи кэшей, читающих tables; без user_id - кэши целиком"""
+        items = []
+        for table in tables:
+            for name in cls.TABLE_CACHES.get(table, ()):
+                if user_id is None:
+                    keys = [None]
+                elif name == 'schedule':
+                    keys = [(scope(db_name), user_id, day) for day in (None, *range(7))]
+                else:
+                    keys = [(scope(db_name), user_id)]
+                items.extend((name, key) for key in keys if (name, key) not in items)
+        return items
+    
+    def invalidate_user(self, user_id: int, *names: str):
+        """Сброс кэшированных снимков пользователя после записи (одна публикация)"""
+        caches.invalidate_many(
+            self.user_cache_keys(self.db_name, user_id, self.USER_CACHES + names)
+        )
+    
+    def _notify(self, table: str, item_id: int):
+        for listener in self.listeners:
+            listener(table, item_id)
     
     def init_database(self):
         """Инициализация базы данных"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL: чтение не блокируется записью, когда обновления разных
+        # пользователей и фоновые задачи работают с БД одновременно.
+        # Режим сохраняется в файле базы, поэтому достаточно одного раза
+        if self.db_name != ':memory:':
+            # Действует только для новой (пустой) базы: освобожденные
+            # очисткой страницы возвращаются через incremental_vacuum
+            cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Таблица пользователей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -134,13 +282,155 @@ class Database:
             )
         ''')
         
+        # Кэш PDF расписаний (привязан к версии расписания)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schedule_exports (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER,
+                file_path TEXT,
+                file_id TEXT,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        ''')
+        
+        # Состояние облачной синхронизации (водяной знак и манифест)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                user_id INTEGER,
+                service TEXT,
+                last_note_id INTEGER DEFAULT 0,
+                last_synced_at TIMESTAMP,
+                manifest TEXT DEFAULT '{}',
+                PRIMARY KEY (user_id, service),
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notes_user 
+            ON notes(user_id, note_id)
+        ''')
+        
+        # Пользователи с включенной синхронизацией и несинхронизированными
+        # изменениями (очередь для фоновой синхронизации)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_pending (
+                user_id INTEGER PRIMARY KEY,
+                pending_since TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sync_pending_since 
+            ON sync_pending(pending_since)
+        ''')
+        
+        # Незавершенные цели по сроку (дайджест и напоминания)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_goals_user_deadline 
+            ON goals(user_id, deadline) WHERE completed = 0
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_goals_deadline 
+            ON goals(deadline) WHERE completed = 0
+        ''')
+        
+        # Занятия по дню недели и времени начала (напоминания о парах)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_schedule_slot 
+            ON schedule(day_of_week, start_time)
+        ''')
+        
+        # Цели, выполненные за день (панель пользователя)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_goals_user_completed 
+            ON goals(user_id, completed_at) WHERE completed = 1
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_activity_user_created 
+            ON activity_log(user_id, created_at)
+        ''')
+        
+        # Данные пользователя по порядку user_id (постраничная выгрузка
+        # exporter.py, выборки бота по пользователю)
+        for table in ('goals', 'achievements', 'quiz_results', 'schedule'):
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table}(user_id)
+            ''')
+        
+        # Дневные итоги активности, удаленной из activity_log (retention.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS activity_daily (
+                user_id INTEGER,
+                day DATE,
+                activity_type TEXT,
+                events INTEGER DEFAULT 0,
+                points INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, day, activity_type)
+            )
+        ''')
+        
+        # Миграции для баз, созданных до появления новых колонок
+        self.ensure_column(cursor, 'notes', 'file_unique_id', 'TEXT')
+        self.ensure_column(cursor, 'users', 'schedule_version', 'INTEGER DEFAULT 0')
         conn.commit()
+        
+        self.init_global_counters(conn)
+        # Последним: прерванная инициализация повторится при следующем запуске
+        conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
         conn.close()
     
+    def init_global_counters(self, conn):
+        """
+        Счетчики общей статистики (utils.py stats), которые ведут триггеры.
+        В существующей базе счетчики заполняются пересчетом один раз - в той
+        же транзакции, что и триггеры, чтобы не пропустить параллельную запись.
+        Проверка идет уже под блокировкой записи: воркеры, запущенные
+        одновременно, не создают таблицу дважды
+        """
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('''
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'global_counters'
+            ''')
+            created = cursor.fetchone() is None
+            if created:
+                cursor.execute('''
+                    CREATE TABLE global_counters (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL DEFAULT 0
+                    )
+                ''')
+            
+            for name, body in GLOBAL_COUNTER_TRIGGERS.items():
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+            
+            if created:
+                cursor.execute(f'INSERT INTO global_counters (name, value) {GLOBAL_COUNTS_SQL}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def ensure_column(self, cursor, table: str, column: str, definition: str):
+        """Добавление колонки в существующую таблицу, если ее нет"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        columns = {row['name'] for row in cursor.fetchall()}
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
     # === РАБОТА С ПОЛЬЗОВАТЕЛЯМИ ===
     
     def user_exists(self, user_id: int) -> bool:
         """Проверка существования пользователя"""
+        return caches.cache('user_exists').get((self.cache_scope, user_id),
+                                               lambda: self._user_exists(user_id))
+    
+    def _user_exists(self, user_id: int) -> bool:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
@@ -158,6 +448,7 @@ class Database:
         ''', (user_id, username, first_name))
         conn.commit()
         conn.close()
+        self.invalidate_user(user_id, 'user_exists')
     
     def update_activity(self, user_id: int):
         """Обновление активности пользователя и подсчет серии"""
@@ -196,18 +487,23 @@ class Database:
         
         conn.commit()
         conn.close()
+        self.invalidate_user(user_id)
     
     def get_user_settings(self, user_id: int) -> Dict:
         """Получение настроек пользователя"""
+        # В кэше строка JSON: вызывающий код меняет полученный словарь
+        settings = caches.cache('user_settings').get(
+            (self.cache_scope, user_id), lambda: self._load_user_settings(user_id)
+        )
+        return json.loads(settings)
+    
+    def _load_user_settings(self, user_id: int) -> str:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT settings FROM users WHERE user_id = ?', (user_id,))
         row = cursor.fetchone()
         conn.close()
-        
-        if row:
-            return json.loads(row['settings'] or '{}')
-        return {}
+        return (row['settings'] or '{}') if row else '{}'
     
     def update_user_settings(self, user_id: int, settings: Dict):
         """Обновление настроек пользователя"""
@@ -216,8 +512,16 @@ class Database:
         cursor.execute('''
             UPDATE users SET settings = ? WHERE user_id = ?
         ''', (json.dumps(settings), user_id))
+        if settings.get('cloud_sync'):
+            # После включения синхронизации отправляем накопленное
+            cursor.execute('''
+                INSERT OR IGNORE INTO sync_pending (user_id) VALUES (?)
+            ''', (user_id,))
+        else:
+            cursor.execute('DELETE FROM sync_pending WHERE user_id = ?', (user_id,))
         conn.commit()
         conn.close()
+        caches.invalidate('user_settings', (self.cache_scope, user_id))
     
     # === РАБОТА С ЗАМЕТКАМИ ===
     
@@ -227,24 +531,33 @@ class Database:
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO notes (user_id, category, note_type, content, file_id, tags)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO notes (user_id, category, note_type, content, file_id, 
+                               file_unique_id, tags)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             note_data['user_id'],
             note_data['category'],
             note_data['type'],
             note_data.get('content', ''),
             note_data.get('file_id', ''),
+            note_data.get('file_unique_id', ''),
             json.dumps(note_data.get('tags', []))
         ))
         
         note_id = cursor.lastrowid
         
-        # Обновляем активность
-        self.update_activity(note_data['user_id'])
+        # Ставим пользователя в очередь фоновой синхронизации
+        cursor.execute('''
+            INSERT OR IGNORE INTO sync_pending (user_id)
+            SELECT user_id FROM users 
+            WHERE user_id = ? AND json_extract(settings, '$.cloud_sync') = 1
+        ''', (note_data['user_id'],))
         
         conn.commit()
         conn.close()
+        
+        # Обновляем активность (после фиксации: пишет через свое подключение)
+        self.update_activity(note_data['user_id'])
         return note_id
     
     def get_user_notes(self, user_id: int, category: str = None) -> List[Dict]:
@@ -274,6 +587,25 @@ class Database:
         conn.close()
         return notes
     
+    def get_notes_since(self, user_id: int, after_note_id: int = 0) -> List[Dict]:
+        """Заметки пользователя, созданные после указанной (по note_id)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM notes 
+            WHERE user_id = ? AND note_id > ?
+            ORDER BY note_id
+        ''', (user_id, after_note_id))
+        
+        notes = []
+        for row in cursor.fetchall():
+            note = dict(row)
+            note['tags'] = json.loads(note['tags'])
+            notes.append(note)
+        
+        conn.close()
+        return notes
+    
     def get_notes_by_tags(self, user_id: int, tags: List[str]) -> List[Dict]:
         """Поиск заметок по тегам"""
         notes = self.get_user_notes(user_id)
@@ -302,6 +634,8 @@ class Database:
         goal_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        self.invalidate_user(user_id)
+        self._notify('goals', goal_id)
         return goal_id
     
     def get_user_goals(self, user_id: int, active_only: bool = False) -> List[Dict]:
@@ -335,8 +669,13 @@ class Database:
             SET completed = 1, completed_at = CURRENT_TIMESTAMP
             WHERE goal_id = ?
         ''', (goal_id,))
+        cursor.execute('SELECT user_id FROM goals WHERE goal_id = ?', (goal_id,))
+        row = cursor.fetchone()
         conn.commit()
         conn.close()
+        if row:
+            self.invalidate_user(row['user_id'])
+        self._notify('goals', goal_id)
     
     # === СТАТИСТИКА ===
     
@@ -367,60 +706,94 @@ class Database:
         conn.close()
         return user_data
     
-    def get_detailed_stats(self, user_id: int) -> Dict:
-        """Подробная статистика"""
+    def get_dashboard(self, user_id: int) -> Optional[Dict]:
+        """
+        Снимок для главных экранов (старт, цели и прогресс) одним запросом
+        
+        Returns:
+            Данные пользователя, счетчики, ближайшие активные цели
+            и выполненные сегодня или None, если пользователя нет
+        """
+        return caches.cache('dashboard', ttl=self.DASHBOARD_TTL).get(
+            (self.cache_scope, user_id), lambda: self._load_dashboard(user_id)
+        )
+    
+    def _load_dashboard(self, user_id: int) -> Optional[Dict]:
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        stats = {}
-        
-        # Данные пользователя
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = dict(cursor.fetchone())
-        stats['level'] = user['current_level']
-        stats['total_points'] = user['total_points']
-        stats['current_streak'] = user['streak']
-        stats['best_streak'] = user['best_streak']
-        stats['join_date'] = datetime.strptime(user['created_at'], 
-                                               '%Y-%m-%d %H:%M:%S')
-        
-        # Статистика заметок
+        # Все части - поиск по индексам пользователя, без отдельных подключений
         cursor.execute('''
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN note_type = 'text' THEN 1 ELSE 0 END) as text,
-                SUM(CASE WHEN note_type = 'photo' THEN 1 ELSE 0 END) as photo,
-                SUM(CASE WHEN note_type = 'voice' THEN 1 ELSE 0 END) as voice
-            FROM notes WHERE user_id = ?
-        ''', (user_id,))
-        notes_stats = dict(cursor.fetchone())
-        stats['total_notes'] = notes_stats['total']
-        stats['text_notes'] = notes_stats['text'] or 0
-        stats['photo_notes'] = notes_stats['photo'] or 0
-        stats['voice_notes'] = notes_stats['voice'] or 0
+            SELECT u.user_id, u.first_name, u.total_points, u.current_level,
+                   u.streak, u.best_streak,
+                   (SELECT COUNT(*) FROM notes WHERE user_id = u.user_id) AS total_notes,
+                   (SELECT COUNT(*) FROM goals 
+                    WHERE user_id = u.user_id AND completed = 0) AS active_goals_count,
+                   (SELECT json_group_array(json_object(
+                        'goal_id', goal_id, 'title', title, 'deadline', deadline))
+                    FROM (SELECT goal_id, title, deadline FROM goals
+                          WHERE user_id = u.user_id AND completed = 0
+                          ORDER BY deadline LIMIT ?)) AS active_goals,
+                   (SELECT json_group_array(json_object('goal_id', goal_id, 'title', title))
+                    FROM goals
+                    WHERE user_id = u.user_id AND completed = 1
+                      AND completed_at >= DATE('now')
+                      AND completed_at < DATE('now', '+1 day')) AS completed_today
+            FROM users u WHERE u.user_id = ?
+        ''', (self.DASHBOARD_GOALS, user_id))
+        row = cursor.fetchone()
+        conn.close()
         
-        # Статистика целей
-        cursor.execute('''
-            SELECT COUNT(*) as count FROM goals 
-            WHERE user_id = ? AND completed = 1
-        ''', (user_id,))
-        stats['completed_goals'] = cursor.fetchone()['count']
+        if row is None:
+            return None
+        dashboard = dict(row)
+        dashboard['active_goals'] = json.loads(dashboard['active_goals'])
+        dashboard['completed_today'] = json.loads(dashboard['completed_today'])
+        return dashboard
+    
+    def get_detailed_stats(self, user_id: int, use_cache: bool = False) -> Dict:
+        """Подробная статистика (use_cache - для экрана /stats, не для достижений)"""
+        if use_cache:
+            return caches.cache('stats', ttl=self.DASHBOARD_TTL).get(
+                (self.cache_scope, user_id), lambda: self.get_detailed_stats(user_id)
+            )
         
-        # Статистика викторин
+        conn = self.get_connection()
+        cursor = conn.cursor()
         cursor.execute('''
-            SELECT 
-                COUNT(*) as quizzes,
-                SUM(score) as correct,
-                SUM(total_questions) as total
-            FROM quiz_results WHERE user_id = ?
-        ''', (user_id,))
-        quiz_stats = dict(cursor.fetchone())
-        stats['quizzes_completed'] = quiz_stats['quizzes'] or 0
-        stats['correct_answers'] = quiz_stats['correct'] or 0
-        stats['total_answers'] = quiz_stats['total'] or 0
-        
+            SELECT u.current_level, u.total_points, u.streak, u.best_streak, u.created_at,
+                   n.total AS total_notes, n.text, n.photo, n.voice,
+                   (SELECT COUNT(*) FROM goals 
+                    WHERE user_id = u.user_id AND completed = 1) AS completed_goals,
+                   q.quizzes, q.correct, q.total AS total_answers
+            FROM users u,
+                 (SELECT COUNT(*) AS total,
+                         SUM(note_type = 'text') AS text,
+                         SUM(note_type = 'photo') AS photo,
+                         SUM(note_type = 'voice') AS voice
+                  FROM notes WHERE user_id = ?) n,
+                 (SELECT COUNT(*) AS quizzes, SUM(score) AS correct,
+                         SUM(total_questions) AS total
+                  FROM quiz_results WHERE user_id = ?) q
+            WHERE u.user_id = ?
+        ''', (user_id, user_id, user_id))
+        row = cursor.fetchone()
         conn.close()
-        return stats
+        
+        return {
+            'level': row['current_level'],
+            'total_points': row['total_points'],
+            'current_streak': row['streak'],
+            'best_streak': row['best_streak'],
+            'join_date': datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S'),
+            'total_notes': row['total_notes'],
+            'text_notes': row['text'] or 0,
+            'photo_notes': row['photo'] or 0,
+            'voice_notes': row['voice'] or 0,
+            'completed_goals': row['completed_goals'],
+            'quizzes_completed': row['quizzes'] or 0,
+            'correct_answers': row['correct'] or 0,
+            'total_answers': row['total_answers'] or 0,
+        }
     
     # === АКТИВНОСТЬ ===
     
@@ -470,11 +843,27 @@ class Database:
             INSERT INTO schedule (user_id, subject, day_of_week, start_time, end_time, location)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (user_id, subject, day_of_week, start_time, end_time, location))
+        schedule_id = cursor.lastrowid
+        # Новая версия расписания делает закэшированный PDF устаревшим
+        cursor.execute('''
+            UPDATE users SET schedule_version = schedule_version + 1
+            WHERE user_id = ?
+        ''', (user_id,))
         conn.commit()
         conn.close()
+        caches.invalidate_many([('schedule', (self.cache_scope, user_id, None)),
+                                ('schedule', (self.cache_scope, user_id, day_of_week))])
+        self._notify('schedule', schedule_id)
+        return schedule_id
     
     def get_schedule(self, user_id: int, day_of_week: int = None) -> List[Dict]:
         """Получение расписания"""
+        schedule = caches.cache('schedule').get(
+            (self.cache_scope, user_id, day_of_week), lambda: self._load_schedule(user_id, day_of_week)
+        )
+        return [dict(item) for item in schedule]
+    
+    def _load_schedule(self, user_id: int, day_of_week: int = None) -> List[Dict]:
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -494,3 +883,339 @@ class Database:
         schedule = [dict(row) for row in cursor.fetchall()]
         conn.close()
         return schedule
+    
+    def get_schedule_version(self, user_id: int) -> int:
+        """Текущая версия расписания пользователя"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT schedule_version FROM users WHERE user_id = ?', 
+                      (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return (row['schedule_version'] or 0) if row else 0
+    
+    def get_schedule_export(self, user_id: int) -> Optional[Dict]:
+        """Закэшированный PDF расписания"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM schedule_exports WHERE user_id = ?', 
+                      (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+    
+    def save_schedule_export(self, user_id: int, version: int, 
+                             file_path: str, file_id: str = None):
+        """Сохранение PDF расписания в кэш"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        # file_id той же версии сохраняется: повторная подготовка файла
+        # (prerender_schedules) не заставляет заново загружать его в Telegram
+        cursor.execute('''
+            INSERT INTO schedule_exports (user_id, version, file_path, file_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                file_id = COALESCE(excluded.file_id, CASE 
+                    WHEN schedule_exports.version = excluded.version 
+                    THEN schedule_exports.file_id END),
+                version = excluded.version,
+                file_path = excluded.file_path
+        ''', (user_id, version, file_path, file_id))
+        conn.commit()
+        conn.close()
+    
+    def get_users_with_schedule(self) -> List[Dict]:
+        """Пользователи с непустым расписанием и версией их расписания"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT u.user_id, u.first_name, u.schedule_version
+            FROM users u
+            WHERE EXISTS (SELECT 1 FROM schedule s WHERE s.user_id = u.user_id)
+        ''')
+        users = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return users
+    
+    # === СИНХРОНИЗАЦИЯ ===
+    
+    def get_sync_state(self, user_id: int, service: str) -> Dict:
+        """Водяной знак и манифест синхронизации пользователя"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM sync_state WHERE user_id = ? AND service = ?
+        ''', (user_id, service))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row:
+            state = dict(row)
+            state['manifest'] = json.loads(state['manifest'] or '{}')
+            return state
+        return {'user_id': user_id, 'service': service, 'last_note_id': 0,
+                'last_synced_at': None, 'manifest': {}}
+    
+    def update_sync_state(self, user_id: int, service: str, 
+                          last_note_id: int, manifest: Dict):
+        """Сохранение водяного знака после успешной синхронизации"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO sync_state 
+                (user_id, service, last_note_id, last_synced_at, manifest)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', (user_id, service, last_note_id, json.dumps(manifest)))
+        conn.commit()
+        conn.close()
+    
+    def get_sync_states(self, user_ids: List[int], service: str) -> Dict[int, Dict]:
+        """Состояния синхронизации сразу для нескольких пользователей"""
+        states = {
+            user_id: {'user_id': user_id, 'service': service, 'last_note_id': 0,
+                      'last_synced_at': None, 'manifest': {}}
+            for user_id in user_ids
+        }
+        if not user_ids:
+            return states
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(user_ids))
+        cursor.execute(f'''
+            SELECT * FROM sync_state 
+            WHERE service = ? AND user_id IN ({placeholders})
+        ''', (service, *user_ids))
+        for row in cursor.fetchall():
+            state = dict(row)
+            state['manifest'] = json.loads(state['manifest'] or '{}')
+            states[state['user_id']] = state
+        conn.close()
+        return states
+    
+    def get_notes_since_many(self, watermarks: Dict[int, int]) -> Dict[int, List[Dict]]:
+        """Новые заметки нескольких пользователей одним запросом"""
+        notes = {user_id: [] for user_id in watermarks}
+        if not watermarks:
+            return notes
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        values = ','.join('(?, ?)' for _ in watermarks)
+        params = [value for item in watermarks.items() for value in item]
+        cursor.execute(f'''
+            WITH marks(user_id, last_note_id) AS (VALUES {values})
+            SELECT n.* FROM marks m
+            JOIN notes n ON n.user_id = m.user_id AND n.note_id > m.last_note_id
+            ORDER BY n.user_id, n.note_id
+        ''', params)
+        for row in cursor.fetchall():
+            note = dict(row)
+            note['tags'] = json.loads(note['tags'])
+            notes[note['user_id']].append(note)
+        conn.close()
+        return notes
+    
+    def get_pending_sync_users(self, limit: int = 100) -> List[int]:
+        """Пользователи, ожидающие фоновой синхронизации (самые давние первыми)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT p.user_id FROM sync_pending p
+            JOIN users u ON u.user_id = p.user_id
+            WHERE json_extract(u.settings, '$.cloud_sync') = 1
+            ORDER BY p.pending_since
+            LIMIT ?
+        ''', (limit,))
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
+        conn.close()
+        return user_ids
+    
+    def clear_sync_pending(self, user_id: int, synced_note_id: int = None):
+        """
+        Снятие пользователя с очереди синхронизации
+        
+        Если указан synced_note_id, запись остается, когда после него
+        появились новые заметки
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if synced_note_id is None:
+            cursor.execute('DELETE FROM sync_pending WHERE user_id = ?', (user_id,))
+        else:
+            cursor.execute('''
+                DELETE FROM sync_pending 
+                WHERE user_id = ? AND NOT EXISTS (
+                    SELECT 1 FROM notes WHERE user_id = ? AND note_id > ?
+                )
+            ''', (user_id, user_id, synced_note_id))
+        conn.commit()
+        conn.close()
+    
+    def clear_synced_pending(self, user_ids: List[int], service: str):
+        """Снятие с очереди пользователей, у которых нет новых заметок"""
+        if not user_ids:
+            return
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(user_ids))
+        cursor.execute(f'''
+            DELETE FROM sync_pending 
+            WHERE user_id IN ({placeholders}) AND NOT EXISTS (
+                SELECT 1 FROM notes n
+                WHERE n.user_id = sync_pending.user_id AND n.note_id > COALESCE(
+                    (SELECT s.last_note_id FROM sync_state s 
+                     WHERE s.user_id = sync_pending.user_id AND s.service = ?), 0)
+            )
+        ''', (*user_ids, service))
+        conn.commit()
+        conn.close()
+    
+    def get_digest_page(self, after_user_id: int = 0, limit: int = 1000,
+                        goal_days: int = 3) -> List[Dict]:
+        """
+        Данные дайджеста для страницы пользователей с включенными уведомлениями
+        
+        Одна выборка на страницу: ключевая пагинация по user_id, цели и баллы
+        агрегируются сразу для всей страницы
+        
+        Returns:
+            Список словарей: user_id, first_name, streak, streak_at_risk,
+            tip_read, due_goals, next_goal, next_deadline, points_yesterday
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            WITH page AS (
+                SELECT user_id, first_name, streak, last_active FROM users
+                WHERE user_id > ?
+                  AND COALESCE(json_extract(settings, '$.notifications'), 1) != 0
+                ORDER BY user_id
+                LIMIT ?
+            ),
+            due AS (
+                SELECT g.user_id, COUNT(*) AS due_goals, MIN(g.deadline) AS next_deadline
+                FROM page p JOIN goals g ON g.user_id = p.user_id
+                WHERE g.completed = 0 
+                  AND g.deadline >= DATE('now') AND g.deadline < DATE('now', ?)
+                GROUP BY g.user_id
+            ),
+            points AS (
+                SELECT a.user_id, SUM(a.points_earned) AS points_yesterday
+                FROM page p JOIN activity_log a ON a.user_id = p.user_id
+                WHERE a.created_at >= DATE('now', '-1 day') 
+                  AND a.created_at < DATE('now')
+                GROUP BY a.user_id
+            )
+            SELECT p.user_id, p.first_name, p.streak,
+                   p.streak > 0 AND p.last_active = DATE('now', '-1 day') AS streak_at_risk,
+                   t.user_id IS NOT NULL AS tip_read,
+                   COALESCE(d.due_goals, 0) AS due_goals,
+                   d.next_deadline,
+                   (SELECT title FROM goals g 
+                    WHERE g.user_id = p.user_id AND g.completed = 0 
+                      AND g.deadline = d.next_deadline
+                    LIMIT 1) AS next_goal,
+                   COALESCE(pt.points_yesterday, 0) AS points_yesterday
+            FROM page p
+            LEFT JOIN due d ON d.user_id = p.user_id
+            LEFT JOIN points pt ON pt.user_id = p.user_id
+            LEFT JOIN daily_tips_read t ON t.user_id = p.user_id AND t.date = DATE('now')
+            ORDER BY p.user_id
+        ''', (after_user_id, limit, f'+{goal_days + 1} days'))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+    
+    # === НАПОМИНАНИЯ ===
+    
+    def get_goal_reminders(self, deadline_from: str, deadline_to: str,
+                           dates: List[str] = ()) -> List[Dict]:
+        """
+        Незавершенные цели со сроком в диапазоне [deadline_from, deadline_to)
+        или в один из дней dates (сроки без времени)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        # UNION ALL вместо OR: каждая часть - поиск по диапазону индекса
+        placeholders = ','.join('?' * len(dates))
+        by_date = f'''
+            UNION ALL
+            SELECT goal_id, user_id, title, deadline FROM goals
+            WHERE completed = 0 AND deadline IN ({placeholders})
+        ''' if dates else ''
+        cursor.execute(f'''
+            WITH due AS (
+                SELECT goal_id, user_id, title, deadline FROM goals
+                WHERE completed = 0 AND deadline >= ? AND deadline < ?
+                {by_date}
+            )
+            SELECT DISTINCT d.goal_id, d.user_id, d.title, d.deadline
+            FROM due d JOIN users u ON u.user_id = d.user_id
+            WHERE COALESCE(json_extract(u.settings, '$.notifications'), 1) != 0
+        ''', (deadline_from, deadline_to, *dates))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+    
+    def get_class_reminders(self, slots: List[tuple]) -> List[Dict]:
+        """
+        Занятия, начинающиеся в заданные интервалы
+        
+        Args:
+            slots: список (день недели, время от 'ЧЧ:ММ', время до 'ЧЧ:ММ')
+        """
+        if not slots:
+            return []
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        rows = []
+        for day_of_week, time_from, time_to in slots:
+            cursor.execute('''
+                SELECT s.schedule_id, s.user_id, s.subject, s.location,
+                       s.day_of_week, s.start_time
+                FROM schedule s JOIN users u ON u.user_id = s.user_id
+                WHERE s.day_of_week = ? AND s.start_time >= ? AND s.start_time < ?
+                  AND COALESCE(json_extract(u.settings, '$.notifications'), 1) != 0
+            ''', (day_of_week, time_from, time_to))
+            rows.extend(dict(row) for row in cursor.fetchall())
+        conn.close()
+        return rows
+    
+    def get_reminder_item(self, table: str, item_id: int) -> Optional[Dict]:
+        """Актуальное состояние цели или занятия (None - напоминание не нужно)"""
+        return self.get_reminder_items(table, [item_id]).get(item_id)
+    
+    def get_reminder_items(self, table: str, item_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Актуальное состояние целей или занятий одним запросом на порцию id
+        
+        Returns:
+            id -> строка; id, напоминание по которым не нужно, отсутствуют
+        """
+        if table == 'goals':
+            key, sql = 'goal_id', '''
+                SELECT g.goal_id, g.user_id, g.title, g.deadline
+                FROM goals g JOIN users u ON u.user_id = g.user_id
+                WHERE g.goal_id IN ({}) AND g.completed = 0 AND g.deadline IS NOT NULL
+                  AND COALESCE(json_extract(u.settings, '$.notifications'), 1) != 0
+            '''
+        else:
+            key, sql = 'schedule_id', '''
+                SELECT s.schedule_id, s.user_id, s.subject, s.location,
+                       s.day_of_week, s.start_time
+                FROM schedule s JOIN users u ON u.user_id = s.user_id
+                WHERE s.schedule_id IN ({})
+                  AND COALESCE(json_extract(u.settings, '$.notifications'), 1) != 0
+            '''
+        item_ids = list(dict.fromkeys(item_ids))
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        items = {}
+        # Порции меньше лимита параметров SQLite
+        for i in range(0, len(item_ids), 500):
+            chunk = item_ids[i:i + 500]
+            cursor.execute(sql.format(', '.join('?' * len(chunk))), chunk)
+            items.update((row[key], dict(row)) for row in cursor.fetchall())
+        conn.close()
+        return items
@@ -0,0 +1,313 @@
+"""
+Единая точка выполнения SQL для StudyBoost
+Считает выполненные запросы, прочитанные строки и время фиксации транзакций,
+ведет журнал медленных запросов с планом выполнения (EXPLAIN QUERY PLAN)
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Dict, List
+
+from metrics import metrics
+
+logger = logging.getLogger('studyboost.slow_query')
+
+
+class QueryLog:
+    def __init__(self, threshold_ms: float = 100, summary_interval: float = 600,
+                 top_n: int = 10):
+        self.threshold_ms = threshold_ms
+        self.summary_interval = summary_interval
+        self.top_n = top_n
+        self.stats: Dict[str, List] = {}
+        self._last_summary = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, threshold_ms: float = None, summary_interval: float = None,
+                  top_n: int = None):
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        if summary_interval is not None:
+            self.summary_interval = summary_interval
+        if top_n is not None:
+            self.top_n = top_n
+
+    @staticmethod
+    def normalize(sql: str) -> str:
+        """Приведение запроса к общему виду (без литералов и пробелов)"""
+        sql = ' '.join(sql.split())
+        sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+        sql = re.sub(r'\b\d+\b', '?', sql)
+        # IN (?, ?, ?) и VALUES (?, ?), (?, ?) с разным числом элементов - один запрос
+        sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*',
+                     '(?+)', sql)
+        return sql
+
+    @staticmethod
+    def params_shape(parameters, many: bool = False) -> str:
+        """Типы параметров без значений (в журнал не попадают данные пользователей)"""
+        if many:
+            rows = list(parameters) if not isinstance(parameters, list) else parameters
+            first = QueryLog.params_shape(rows[0]) if rows else '()'
+            return f'{len(rows)} × {first}'
+        if isinstance(parameters, dict):
+            return '{' + ', '.join(f'{k}: {type(v).__name__}'
+                                   for k, v in parameters.items()) + '}'
+        return '(' + ', '.join(type(v).__name__ for v in parameters) + ')'
+
+    def record(self, conn, sql: str, parameters, elapsed: float, many: bool = False):
+        normalized = self.normalize(sql)
+        with self._lock:
+            entry = self.stats.get(normalized)
+            if entry is None:
+                # количество, суммарное время, максимум
+                entry = self.stats[normalized] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+        if elapsed * 1000 >= self.threshold_ms:
+            logger.warning(
+                "Медленный запрос %.1f мс: %s | параметры: %s | план:\n%s",
+                elapsed * 1000, normalized, self.params_shape(parameters, many),
+                self.explain(conn, sql, parameters, many)
+            )
+
+        if time.monotonic() - self._last_summary >= self.summary_interval:
+            self._last_summary = time.monotonic()
+            self.log_summary()
+
+    @staticmethod
+    def explain(conn, sql: str, parameters, many: bool = False) -> str:
+        head = sql.lstrip()[:8].upper()
+        if not head.startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')):
+            return '  (нет плана)'
+        if many:
+            parameters = next(iter(parameters), ())
+        try:
+            # Базовый курсор, чтобы EXPLAIN не попал в журнал сам
+            cursor = sqlite3.Cursor(conn)
+            rows = cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+            cursor.close()
+        except sqlite3.Error as e:
+            return f'  (план недоступен: {e})'
+        return '\n'.join(f'  {row[0]}|{row[1]}| {row[3]}' for row in rows)
+
+    def top(self, n: int = None) -> List[Dict]:
+        with self._lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)
+        return [
+            {'sql': sql, 'count': count, 'total_ms': total * 1000,
+             'avg_ms': total / count * 1000, 'max_ms': maximum * 1000}
+            for sql, (count, total, maximum) in items[:n or self.top_n]
+        ]
+
+    def log_summary(self):
+        rows = self.top()
+        if not rows:
+            return
+        lines = [f"Топ-{len(rows)} запросов по суммарному времени:"]
+        for row in rows:
+            lines.append(f"  {row['total_ms']:.0f} мс всего, {row['count']} раз, "
+                         f"макс {row['max_ms']:.1f} мс: {row['sql'][:200]}")
+        logger.info('\n'.join(lines))
+
+
+query_log = QueryLog(
+    threshold_ms=float(os.getenv('STUDYBOOST_SLOW_QUERY_MS', '100'))
+)
+
+
+def _on_statement(sql: str):
+    # Служебные команды транзакций, PRAGMA, тела триггеров и EXPLAIN не считаем
+    head = sql.lstrip()[:8].upper()
+    if head.startswith(('BEGIN', 'COMMIT', 'ROLLBACK', '--', 'EXPLAIN', 'PRAGMA')):
+        return
+    metrics.record_query()
+
+
+# Операторы, которые берут блокировку записи, если транзакция ее еще не держит
+_WRITE_HEADS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'BEGIN IMMEDIATE', 'BEGIN EXCLUSIVE')
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий выполнение запроса вместе с чтением результата"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = None
+        # Строки, полученные перебором курсора (учитываются пачкой в _finish)
+        self._iterated = 0
+
+    def _finish(self):
+        if self._iterated:
+            metrics.record_rows(self._iterated)
+            self._iterated = 0
+        if self._pending is not None:
+            sql, parameters, elapsed, many = self._pending
+            self._pending = None
+            query_log.record(self.connection, sql, parameters, elapsed, many)
+
+    def _add_time(self, elapsed: float):
+        if self._pending is not None:
+            sql, parameters, total, many = self._pending
+            self._pending = (sql, parameters, total + elapsed, many)
+
+    def _locking(self, sql: str) -> bool:
+        """
+        Оператор берет блокировку записи: busy timeout ждет здесь, а не в commit
+        (неявный BEGIN отложенный, блокировка - на первой записи)
+        """
+        connection = self.connection
+        if not isinstance(connection, InstrumentedConnection):
+            return False
+        if not connection.in_transaction:
+            connection.write_locked = False
+        if connection.write_locked:
+            return False
+        return ' '.join(sql.lstrip()[:24].split()).upper().startswith(_WRITE_HEADS)
+
+    def _locked(self, locking: bool, elapsed: float, error: Exception = None):
+        if error is not None:
+            if isinstance(error, sqlite3.OperationalError) and 'locked' in str(error):
+                metrics.db_lock_errors.inc()
+        elif locking:
+            self.connection.write_locked = True
+            metrics.record_lock_wait(elapsed)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        locking = self._locking(sql)
+        started = time.perf_counter()
+        error = None
+        try:
+            return super().execute(sql, parameters)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._locked(locking, elapsed, error)
+            self._pending = (sql, parameters, elapsed, False)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        seq_of_parameters = list(seq_of_parameters)
+        locking = self._locking(sql)
+        started = time.perf_counter()
+        error = None
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._locked(locking, elapsed, error)
+            self._pending = (sql, seq_of_parameters, elapsed, True)
+            self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add_time(time.perf_counter() - started)
+        if row is None:
+            self._finish()
+        else:
+            metrics.record_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add_time(time.perf_counter() - started)
+        if rows:
+            metrics.record_rows(len(rows))
+        else:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add_time(time.perf_counter() - started)
+        if rows:
+            metrics.record_rows(len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        self._iterated += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_on_statement)
+        # Строки считаются пачкой в fetch* курсора, а не фабрикой на каждую строку
+        self.row_factory = sqlite3.Row
+        self._cursors = weakref.WeakSet()
+        # Текущая транзакция уже держит блокировку записи (см. InstrumentedCursor._locking)
+        self.write_locked = False
+
+    def cursor(self, factory=InstrumentedCursor):
+        cursor = super().cursor(factory)
+        if isinstance(cursor, InstrumentedCursor):
+            self._cursors.add(cursor)
+        return cursor
+
+    # conn.execute создает обычный sqlite3.Cursor: запросы идут через свой курсор
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                metrics.db_lock_errors.inc()
+            raise
+        finally:
+            self.write_locked = False
+            metrics.db_commit_seconds.observe(time.perf_counter() - started)
+
+    def rollback(self):
+        self.write_locked = False
+        super().rollback()
+
+    def close(self):
+        # Запросы, результат которых прочитан не до конца, фиксируем здесь
+        for cursor in list(self._cursors):
+            cursor._finish()
+        super().close()
+
+
+def connect(db_name: str, timeout: float = 5.0) -> sqlite3.Connection:
+    """
+    Подключение к БД (строки доступны как sqlite3.Row)
+
+    timeout - сколько ждать снятия блокировки другим подключением (busy timeout)
+    """
+    conn = sqlite3.connect(db_name, timeout=timeout, factory=InstrumentedConnection)
+    # В режиме WAL NORMAL не теряет целостность и не делает fsync на каждую фиксацию
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
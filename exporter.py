@@ -0,0 +1,255 @@
+"""
+Потоковая выгрузка данных пользователей
+Таблицы читаются постранично по ключу (user_id, ...), а не OFFSET, и
+строки сразу пишутся в NDJSON, поэтому память не растет с размером базы.
+Выгрузка всей базы делится на диапазоны user_id и выполняется пулом
+процессов; manifest.json содержит число строк и SHA-256 каждого файла
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from db_connection import connect
+
+# Таблица -> ключ постраничного чтения (начинается с user_id, есть индекс)
+EXPORT_TABLES = {
+    'users': ('user_id',),
+    'notes': ('user_id', 'note_id'),
+    'goals': ('user_id', 'goal_id'),
+    'achievements': ('user_id', 'achievement_id'),
+    'quiz_results': ('user_id', 'result_id'),
+    'schedule': ('user_id', 'schedule_id'),
+    'activity_log': ('user_id', 'created_at', 'log_id'),
+    'activity_daily': ('user_id', 'day', 'activity_type'),
+}
+
+
+def iter_rows(conn, table: str, low: Optional[int], high: Optional[int],
+              page_size: int = 1000) -> Iterable[Dict]:
+    """Строки таблицы с low <= user_id < high (None - без границы) по порядку ключа"""
+    key = EXPORT_TABLES[table]
+    columns = ', '.join(key)
+    # Строки без user_id не относятся ни к одному пользователю
+    bounds, params = ['user_id IS NOT NULL'], []
+    if low is not None:
+        bounds.append('user_id >= ?')
+        params.append(low)
+    if high is not None:
+        bounds.append('user_id < ?')
+        params.append(high)
+
+    last = None
+    while True:
+        where, args = list(bounds), list(params)
+        if last is not None:
+            where.append(f"({columns}) > ({', '.join('?' * len(key))})")
+            args.extend(last)
+        sql = (f"SELECT * FROM {table} WHERE {' AND '.join(where)} "
+               f"ORDER BY {columns} LIMIT ?")
+
+        rows = conn.execute(sql, args + [page_size]).fetchall()
+        for row in rows:
+            yield dict(row)
+        if len(rows) < page_size:
+            return
+        last = [rows[-1][column] for column in key]
+
+
+def dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def write_document(out, header: Dict, tables: Dict[str, Iterable[Dict]]) -> int:
+    """
+    Документ пользователя одной строкой JSON: поля header, затем массивы
+    таблиц. Строки пишутся по одной, документ целиком в памяти не собирается
+
+    Returns:
+        число записанных строк таблиц
+    """
+    out.write(dumps(header)[:-1])
+    rows = 0
+    for table, items in tables.items():
+        out.write(f',"{table}":[')
+        for index, row in enumerate(items):
+            out.write((',' if index else '') + dumps(row))
+            rows += 1
+        out.write(']')
+    out.write('}\n')
+    return rows
+
+
+class _HashingFile:
+    """Файл, считающий SHA-256 и размер записанного (после сжатия)"""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'wb')
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _OutputFile:
+    def __init__(self, directory: str, name: str, compress: bool):
+        self.name = name + ('.gz' if compress else '')
+        self.raw = _HashingFile(os.path.join(directory, self.name))
+        self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=6) \
+            if compress else None
+        self.rows = 0
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        (self.stream or self.raw).write(data)
+
+    def close(self) -> Dict:
+        if self.stream is not None:
+            self.stream.close()
+        self.raw.close()
+        return {'file': self.name, 'rows': self.rows, 'bytes': self.raw.bytes,
+                'sha256': self.raw.sha256.hexdigest()}
+
+
+class _Stream:
+    """Итератор с просмотром следующей строки (слияние таблиц по user_id)"""
+
+    def __init__(self, items: Iterable[Dict]):
+        self.items = iter(items)
+        self.head = next(self.items, None)
+
+    def take(self, user_id: int) -> Iterable[Dict]:
+        # Строки без пользователя (удаленного) пропускаются
+        while self.head is not None and self.head['user_id'] < user_id:
+            self.head = next(self.items, None)
+        while self.head is not None and self.head['user_id'] == user_id:
+            yield self.head
+            self.head = next(self.items, None)
+
+
+def export_partition(db_name: str, directory: str, part: int, low: Optional[int],
+                     high: Optional[int], layout: str, compress: bool,
+                     page_size: int) -> List[Dict]:
+    """Выгрузка диапазона user_id в отдельные файлы (выполняется в процессе пула)"""
+    conn = connect(db_name, timeout=30)
+    # Одна транзакция чтения: таблицы диапазона согласованы между собой
+    conn.execute('BEGIN')
+    files = []
+    try:
+        if layout == 'tables':
+            for table in EXPORT_TABLES:
+                output = _OutputFile(directory, f'{table}.{part:04d}.ndjson', compress)
+                for row in iter_rows(conn, table, low, high, page_size):
+                    output.write(dumps(row) + '\n')
+                    output.rows += 1
+                files.append(dict(output.close(), table=table, part=part))
+        else:
+            output = _OutputFile(directory, f'documents.{part:04d}.ndjson', compress)
+            streams = {table: _Stream(iter_rows(conn, table, low, high, page_size))
+                       for table in EXPORT_TABLES if table != 'users'}
+            for user in iter_rows(conn, 'users', low, high, page_size):
+                user_id = user['user_id']
+                write_document(
+                    output, {'user_id': user_id, 'user_info': user},
+                    {table: stream.take(user_id) for table, stream in streams.items()}
+                )
+                output.rows += 1
+            files.append(dict(output.close(), table='documents', part=part))
+    finally:
+        conn.rollback()
+        conn.close()
+    return files
+
+
+class DataExporter:
+    def __init__(self, db_name: str = 'studyboost.db', directory: str = None,
+                 layout: str = 'tables', compress: bool = True, workers: int = None,
+                 page_size: int = 1000, partitions: int = None):
+        if layout not in ('tables', 'documents'):
+            raise ValueError(f"Неизвестный формат выгрузки: {layout}")
+        self.db_name = db_name
+        self.directory = directory or f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # tables - NDJSON на таблицу, documents - документ на пользователя
+        self.layout = layout
+        self.compress = compress
+        self.workers = workers or os.cpu_count() or 1
+        self.page_size = page_size
+        # Диапазонов больше, чем процессов: неравные диапазоны выравниваются очередью
+        self.partitions = partitions or self.workers * 4
+
+    def boundaries(self) -> List[Optional[int]]:
+        """
+        Границы диапазонов user_id с примерно равным числом пользователей.
+        Один упорядоченный проход по ключу users, без OFFSET на каждую границу
+        """
+        conn = connect(self.db_name)
+        conn.execute('BEGIN')
+        try:
+            total = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+            parts = max(1, min(self.partitions, total))
+            targets = [index * total // parts for index in range(1, parts)]
+            bounds = [None]
+            if targets:
+                cursor = conn.execute('SELECT user_id FROM users ORDER BY user_id')
+                for position, (user_id,) in enumerate(cursor):
+                    if position == targets[0]:
+                        if bounds[-1] is None or user_id > bounds[-1]:
+                            bounds.append(user_id)
+                        targets.pop(0)
+                        if not targets:
+                            break
+        finally:
+            conn.rollback()
+            conn.close()
+        return bounds + [None]
+
+    def run(self) -> Dict:
+        from database import Database
+        Database(self.db_name)
+        os.makedirs(self.directory, exist_ok=True)
+
+        started = time.perf_counter()
+        bounds = self.boundaries()
+        tasks = [(self.db_name, self.directory, part, bounds[part], bounds[part + 1],
+                  self.layout, self.compress, self.page_size)
+                 for part in range(len(bounds) - 1)]
+
+        files = []
+        if self.workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                files.extend(export_partition(*task))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for result in pool.map(export_partition, *zip(*tasks)):
+                    files.extend(result)
+
+        totals = {}
+        for entry in files:
+            totals[entry['table']] = totals.get(entry['table'], 0) + entry['rows']
+        manifest = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': os.path.abspath(self.db_name),
+            'layout': self.layout,
+            'compress': self.compress,
+            'partitions': [[bounds[i], bounds[i + 1]] for i in range(len(bounds) - 1)],
+            'totals': totals,
+            'files': files,
+            'seconds': round(time.perf_counter() - started, 2),
+        }
+        with open(os.path.join(self.directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
@@ -4,11 +4,15 @@
 """
 
 from typing import List, Dict
-import sqlite3
+
+from cache import caches, scope
+from database import Database
+from db_connection import connect
 
 
 class GamificationSystem:
-    def __init__(self):
+    def __init__(self, db_name: str = 'studyboost.db'):
+        self.db_name = db_name
         # Таблица уровней и требований
         self.level_requirements = {
             1: 0,      # Новичок
@@ -161,9 +165,7 @@ class GamificationSystem:
     
     def get_connection(self):
         """Получение подключения к БД"""
-        conn = sqlite3.connect('studyboost.db')
-        conn.row_factory = sqlite3.Row
-        return conn
+        return connect(self.db_name)
     
     def add_points(self, user_id: int, points: int, reason: str = ''):
         """Добавление баллов пользователю"""
@@ -198,6 +200,7 @@ class GamificationSystem:
         
         conn.commit()
         conn.close()
+        caches.invalidate_many(Database.user_cache_keys(self.db_name, user_id))
         
         return total_points, new_level
     
@@ -211,25 +214,25 @@ class GamificationSystem:
                 break
         return level
     
+    def _points_and_level(self, user_id: int):
+        def load():
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT total_points, current_level FROM users WHERE user_id = ?', 
+                          (user_id,))
+            row = cursor.fetchone()
+            conn.close()
+            return (row['total_points'], row['current_level']) if row else (0, 1)
+        
+        return caches.cache('user_points').get((scope(self.db_name), user_id), load)
+    
     def get_user_level(self, user_id: int) -> int:
         """Получение текущего уровня пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT current_level FROM users WHERE user_id = ?', 
-                      (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return row['current_level'] if row else 1
+        return self._points_and_level(user_id)[1]
     
     def get_user_points(self, user_id: int) -> int:
         """Получение баллов пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT total_points FROM users WHERE user_id = ?', 
-                      (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return row['total_points'] if row else 0
+        return self._points_and_level(user_id)[0]
     
     def get_level_info(self, level: int) -> Dict:
         """Получение информации об уровне"""
@@ -304,62 +307,59 @@ class GamificationSystem:
             new_achievements.append('level_10')
         
         # Выдаем новые достижения
-        achievement_texts = []
         for achievement_key in new_achievements:
-            achievement = self.achievements[achievement_key]
-            
-            # Записываем в БД
             cursor.execute('''
                 INSERT INTO achievements (user_id, achievement_name, achievement_description)
                 VALUES (?, ?, ?)
-            ''', (user_id, achievement_key, achievement['description']))
-            
-            # Начисляем баллы
+            ''', (user_id, achievement_key, self.achievements[achievement_key]['description']))
+        
+        # Фиксируем до начисления баллов: add_points пишет через свое подключение
+        conn.commit()
+        conn.close()
+        if new_achievements:
+            caches.invalidate('achievements', (scope(self.db_name), user_id))
+        
+        achievement_texts = []
+        for achievement_key in new_achievements:
+            achievement = self.achievements[achievement_key]
             self.add_points(user_id, achievement['points'], 
                           f"Достижение: {achievement['name']}")
-            
             achievement_texts.append(
                 f"{achievement['emoji']} {achievement['name']} (+{achievement['points']} баллов)"
             )
         
-        conn.commit()
-        conn.close()
-        
         return achievement_texts
     
+    def _earned_achievements(self, user_id: int) -> List[tuple]:
+        def load():
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT achievement_name, earned_at 
+                FROM achievements 
+                WHERE user_id = ?
+                ORDER BY earned_at DESC
+            ''', (user_id,))
+            earned = [(row['achievement_name'], row['earned_at']) for row in cursor.fetchall()]
+            conn.close()
+            return earned
+        
+        return caches.cache('achievements').get((scope(self.db_name), user_id), load)
+    
     def get_user_achievements(self, user_id: int) -> List[Dict]:
         """Получение всех достижений пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT achievement_name, earned_at 
-            FROM achievements 
-            WHERE user_id = ?
-            ORDER BY earned_at DESC
-        ''', (user_id,))
-        
         user_achievements = []
-        for row in cursor.fetchall():
-            achievement_key = row['achievement_name']
+        for achievement_key, earned_at in self._earned_achievements(user_id):
             if achievement_key in self.achievements:
                 achievement = self.achievements[achievement_key].copy()
-                achievement['earned_at'] = row['earned_at']
+                achievement['earned_at'] = earned_at
                 user_achievements.append(achievement)
         
-        conn.close()
         return user_achievements
     
     def get_available_achievements(self, user_id: int) -> List[Dict]:
         """Получение доступных (еще не полученных) достижений"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT achievement_name FROM achievements WHERE user_id = ?
-        ''', (user_id,))
-        earned = {row['achievement_name'] for row in cursor.fetchall()}
-        conn.close()
+        earned = {name for name, _ in self._earned_achievements(user_id)}
         
         available = []
         for key, achievement in self.achievements.items():
@@ -0,0 +1,88 @@
+"""
+Ленивая загрузка тяжелых подсистем бота
+Модуль импортируется и объект создается при первом обращении
+"""
+
+import importlib
+import threading
+import time
+from typing import Dict, List
+
+
+class LazyComponent:
+    def __init__(self, module_name: str, class_name: str, *args, **kwargs):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.args = args
+        self.kwargs = kwargs
+        self.import_time = None
+        self.init_time = None
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def get(self):
+        """Получение объекта (импорт и создание при первом вызове)"""
+        if self._instance is not None:
+            return self._instance
+
+        # Прогрев может идти в фоновом потоке одновременно с обработчиком
+        with self._lock:
+            if self._instance is None:
+                started = time.perf_counter()
+                module = importlib.import_module(self.module_name)
+                self.import_time = time.perf_counter() - started
+
+                started = time.perf_counter()
+                instance = getattr(module, self.class_name)(*self.args, **self.kwargs)
+                self.init_time = time.perf_counter() - started
+
+                self._instance = instance
+
+        return self._instance
+
+
+class ComponentRegistry:
+    def __init__(self):
+        self.components: Dict[str, LazyComponent] = {}
+
+    def register(self, name: str, module_name: str, class_name: str,
+                 *args, **kwargs) -> LazyComponent:
+        component = LazyComponent(module_name, class_name, *args, **kwargs)
+        self.components[name] = component
+        return component
+
+    def get(self, name: str):
+        return self.components[name].get()
+
+    def warm_up(self, names: List[str] = None):
+        """Заблаговременная загрузка компонентов"""
+        for name in names or list(self.components):
+            self.components[name].get()
+
+    def report(self) -> List[Dict]:
+        """Время импорта и инициализации каждого компонента"""
+        rows = []
+        for name, component in self.components.items():
+            rows.append({
+                'component': name,
+                'loaded': component.loaded,
+                'import_ms': round((component.import_time or 0) * 1000, 1),
+                'init_ms': round((component.init_time or 0) * 1000, 1)
+            })
+        return rows
+
+    def format_report(self) -> str:
+        lines = ["Время запуска компонентов:"]
+        for row in self.report():
+            if row['loaded']:
+                lines.append(
+                    f"  {row['component']}: импорт {row['import_ms']} мс, "
+                    f"инициализация {row['init_ms']} мс"
+                )
+            else:
+                lines.append(f"  {row['component']}: не загружен")
+        return "\n".join(lines)
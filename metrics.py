@@ -0,0 +1,325 @@
+"""
+Метрики производительности StudyBoost
+Гистограммы задержек обработчиков и вызовов БД, счетчики SQL-запросов
+и HTTP endpoint в формате Prometheus
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from typing import Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class UpdateStats:
+    """Счетчики БД в рамках одного обновления"""
+
+    __slots__ = ('queries', 'rows', 'lock_wait')
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.lock_wait = 0.0
+
+
+# Контекст копируется в asyncio.to_thread, поэтому запросы из потоков
+# тоже попадают в счетчики текущего обновления
+current_update = contextvars.ContextVar('current_update', default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # счетчики по корзинам, сумма, количество
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q: float, *label_values) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        series = self.series.get(label_values)
+        if not series or not series[2]:
+            return 0.0
+        target = q * series[2]
+        for bound, count in zip(self.buckets, series[0]):
+            if count >= target:
+                return bound
+        return float('inf')
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self.series.items()):
+                base = [f'{k}="{v}"' for k, v in zip(self.labels, label_values)]
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = ','.join(base + [f'le="{bound}"'])
+                    lines.append(f'{self.name}_bucket{{{labels}}} {bucket_count}')
+                labels = ','.join(base + ['le="+Inf"'])
+                lines.append(f'{self.name}_bucket{{{labels}}} {count}')
+                suffix = '{' + ','.join(base) + '}' if base else ''
+                lines.append(f'{self.name}_sum{suffix} {total}')
+                lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                suffix = '{' + labels + '}' if labels else ''
+                lines.append(f'{self.name}{suffix} {value}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.handler_seconds = Histogram(
+            'studyboost_handler_seconds', 'Время обработки обновления', ('handler',))
+        self.handler_queries = Histogram(
+            'studyboost_handler_queries', 'SQL-запросов на обновление', ('handler',),
+            COUNT_BUCKETS)
+        self.handler_rows = Histogram(
+            'studyboost_handler_rows', 'Прочитано строк на обновление', ('handler',),
+            COUNT_BUCKETS)
+        self.update_wait_seconds = Histogram(
+            'studyboost_update_wait_seconds',
+            'Ожидание обновления в очереди пользователя и общем лимите')
+        self.handler_errors = Counter(
+            'studyboost_handler_errors_total', 'Ошибки обработчиков', ('handler',))
+        self.db_call_seconds = Histogram(
+            'studyboost_db_call_seconds', 'Время вызова методов БД', ('method',))
+        self.db_queries = Counter(
+            'studyboost_db_queries_total', 'Выполнено SQL-запросов')
+        self.db_rows = Counter(
+            'studyboost_db_rows_read_total', 'Прочитано строк из БД')
+        self.db_lock_wait = Histogram(
+            'studyboost_db_lock_wait_seconds',
+            'Получение блокировки записи (BEGIN IMMEDIATE или первая запись транзакции)')
+        self.db_commit_seconds = Histogram(
+            'studyboost_db_commit_seconds', 'Фиксация транзакции (в основном fsync)')
+        self.db_lock_errors = Counter(
+            'studyboost_db_lock_errors_total', 'Ошибки database is locked')
+        self.cache_requests = Counter(
+            'studyboost_cache_requests_total', 'Обращения к кэшу чтения',
+            ('cache', 'result'))
+        # Выборочное профилирование обработчиков (profiling.Profiler)
+        self.profiler = None
+        # Подписчики на завершение обработчика: callback(имя, секунды, UpdateStats)
+        self.handler_listeners = []
+
+    def collectors(self):
+        return [self.handler_seconds, self.handler_queries, self.handler_rows,
+                self.update_wait_seconds, self.handler_errors, self.db_call_seconds, self.db_queries,
+                self.db_rows, self.db_lock_wait, self.db_commit_seconds, self.db_lock_errors,
+                self.cache_requests]
+
+    def render(self) -> str:
+        lines = []
+        for collector in self.collectors():
+            lines.extend(collector.render())
+        return '\n'.join(lines) + '\n'
+
+    # === СОБЫТИЯ БД ===
+
+    def record_query(self):
+        self.db_queries.inc()
+        stats = current_update.get()
+        if stats is not None:
+            stats.queries += 1
+
+    def record_rows(self, count: int):
+        self.db_rows.inc(amount=count)
+        stats = current_update.get()
+        if stats is not None:
+            stats.rows += count
+
+    def record_lock_wait(self, seconds: float):
+        self.db_lock_wait.observe(seconds)
+        stats = current_update.get()
+        if stats is not None:
+            stats.lock_wait += seconds
+
+    # === ОБРАБОТЧИКИ ===
+
+    def wrap_handler(self, name: str, callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            stats = UpdateStats()
+            token = current_update.set(stats)
+            started = time.perf_counter()
+            try:
+                coro = callback(update, context)
+                if self.profiler is not None:
+                    coro = self.profiler.maybe_profile(name, coro)
+                return await coro
+            except Exception:
+                self.handler_errors.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.handler_seconds.observe(elapsed, name)
+                self.handler_queries.observe(stats.queries, name)
+                self.handler_rows.observe(stats.rows, name)
+                current_update.reset(token)
+                for listener in self.handler_listeners:
+                    listener(name, elapsed, stats)
+        return wrapper
+
+    def instrument_application(self, application):
+        """Обертка всех зарегистрированных обработчиков (включая диалоги)"""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                self._instrument_handler(handler)
+
+    def _instrument_handler(self, handler):
+        nested = []
+        if hasattr(handler, 'entry_points'):
+            nested.extend(handler.entry_points)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            nested.extend(handler.fallbacks)
+        for inner in nested:
+            self._instrument_handler(inner)
+
+        callback = getattr(handler, 'callback', None)
+        if callback is not None and not getattr(callback, '_instrumented', False):
+            wrapped = self.wrap_handler(getattr(callback, '__name__', 'handler'), callback)
+            wrapped._instrumented = True
+            handler.callback = wrapped
+
+    def instrument_object(self, obj, prefix: str):
+        """Замер времени всех публичных методов объекта (Database, GamificationSystem)"""
+        for name, method in inspect.getmembers(obj, inspect.ismethod):
+            if name.startswith('_') or name == 'get_connection':
+                continue
+            setattr(obj, name, self._timed(f'{prefix}.{name}', method))
+        return obj
+
+    def _timed(self, name: str, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.db_call_seconds.observe(time.perf_counter() - started, name)
+        return wrapper
+
+    def format_summary(self, limit: int = 10) -> str:
+        """Краткая сводка для команды /perf"""
+        rows = []
+        for (handler,), (_, total, count) in list(self.handler_seconds.series.items()):
+            queries = self.handler_queries.series.get((handler,), [None, 0, 0])
+            rows.append((
+                handler, count, total / count * 1000,
+                self.handler_seconds.quantile(0.95, handler) * 1000,
+                queries[1] / queries[2] if queries[2] else 0
+            ))
+        rows.sort(key=lambda row: row[3], reverse=True)
+
+        lines = ["📈 Производительность обработчиков", ""]
+        for handler, count, avg_ms, p95_ms, avg_queries in rows[:limit]:
+            lines.append(f"{handler}: {count} вызовов, среднее {avg_ms:.1f} мс, "
+                         f"p95 ≤ {p95_ms:.0f} мс, SQL {avg_queries:.1f}/обновл.")
+        if not rows:
+            lines.append("Данных пока нет")
+
+        # Импорт здесь: db_connection сам зависит от этого модуля
+        from db_connection import query_log
+        slowest = query_log.top(3)
+        if slowest:
+            lines.append("")
+            lines.append("Самые затратные запросы:")
+            for row in slowest:
+                lines.append(f"{row['total_ms']:.0f} мс / {row['count']}: {row['sql'][:80]}")
+
+        queries = sum(self.db_queries.values.values())
+        lock_count = sum(series[2] for series in self.db_lock_wait.series.values())
+        lock_total = sum(series[1] for series in self.db_lock_wait.series.values())
+        lines.append("")
+        lines.append(f"SQL-запросов всего: {int(queries)}")
+        if lock_count:
+            lines.append(f"Среднее ожидание блокировки записи: "
+                         f"{lock_total / lock_count * 1000:.1f} мс")
+        commit_count = sum(series[2] for series in self.db_commit_seconds.series.values())
+        commit_total = sum(series[1] for series in self.db_commit_seconds.series.values())
+        if commit_count:
+            lines.append(f"Средняя фиксация: {commit_total / commit_count * 1000:.1f} мс")
+        return '\n'.join(lines)
+
+
+class MetricsServer:
+    """Минимальный HTTP сервер для Prometheus (GET /metrics)"""
+
+    def __init__(self, metrics: Metrics, host: str = '127.0.0.1', port: int = 9108):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body = self.metrics.render().encode('utf-8')
+                status = '200 OK'
+            else:
+                body = b'Not Found\n'
+                status = '404 Not Found'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+# Общий экземпляр для бота и слоя БД
+metrics = Metrics()
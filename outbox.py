@@ -0,0 +1,494 @@
+"""
+Очередь исходящих сообщений StudyBoost
+Рассылки и напоминания отправляются с учетом лимитов Telegram (общего и
+на чат), по приоритетам и с сохранением очереди в SQLite, чтобы перезапуск
+не терял и не дублировал отправки. Ответы пользователям идут через тот же
+ограничитель (OutboxRateLimiter) и всегда опережают массовые рассылки
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from db_connection import connect
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+INTERACTIVE = 0
+REMINDER = 1
+BULK = 2
+
+MAX_MESSAGE_LENGTH = 4096
+
+# Методы API, которые отправляют сообщение в чат и подпадают под лимиты
+SEND_ENDPOINTS = {
+    'sendMessage', 'sendDocument', 'sendPhoto', 'sendVoice', 'sendMediaGroup',
+    'editMessageText', 'copyMessage', 'forwardMessage',
+}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float, need: float = 1.0) -> float:
+        """Через сколько секунд в корзине будет need токенов"""
+        self.refill(now)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, now: float, amount: float = 1.0):
+        # Ответы пользователям могут уходить в долг - его отработают рассылки
+        self.refill(now)
+        self.tokens -= amount
+
+
+class OutboxMessage:
+    __slots__ = ('msg_id', 'chat_id', 'text', 'options', 'priority', 'key',
+                 'coalesce', 'attempts', 'absorbed', 'entry')
+
+    def __init__(self, chat_id: int, text: str, options: Dict = None,
+                 priority: int = BULK, key: str = None, coalesce: bool = False,
+                 msg_id: int = None, attempts: int = 0):
+        self.msg_id = msg_id
+        self.chat_id = chat_id
+        self.text = text
+        # Простые параметры send_message (parse_mode, disable_web_page_preview)
+        self.options = options or {}
+        self.priority = priority
+        self.key = key
+        self.coalesce = coalesce
+        self.attempts = attempts
+        # Сообщение уже отправлено в составе объединенного
+        self.absorbed = False
+        # Номер действующей записи в очереди; записи с другим номером устарели
+        self.entry = None
+
+
+class Outbox:
+    def __init__(self, db_name: str = 'studyboost.db', global_rate: float = 30,
+                 chat_rate: float = 1, group_rate: float = 20 / 60,
+                 bulk_reserve: float = 5, max_in_flight: int = 20,
+                 max_attempts: int = 5, retention_days: int = 7):
+        self.db_name = db_name
+        # Небольшой запас на всплеск: средняя скорость не выше global_rate
+        self.global_bucket = TokenBucket(global_rate, max(1 + bulk_reserve, global_rate / 2))
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        # Сколько токенов общего лимита рассылки оставляют ответам пользователям
+        self.bulk_reserve = bulk_reserve
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.retention_days = retention_days
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.paused_until = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.bot = None
+        self._ready = []
+        self._delayed = []
+        self._by_chat: Dict[int, List[OutboxMessage]] = {}
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._sending = set()
+        self.rate_limiter = OutboxRateLimiter(self)
+        self.init_table()
+
+    def get_connection(self):
+        return connect(self.db_name, timeout=10)
+
+    def init_table(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                msg_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE,
+                chat_id INTEGER,
+                priority INTEGER,
+                text TEXT,
+                options TEXT,
+                coalesce INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                state TEXT DEFAULT 'pending',
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_pending
+            ON outbox(msg_id) WHERE state = 'pending'
+        ''')
+        conn.commit()
+        conn.close()
+
+    # === ПОСТАНОВКА В ОЧЕРЕДЬ ===
+
+    def send(self, chat_id: int, text: str, priority: int = BULK, key: str = None,
+             coalesce: bool = False, **options) -> bool:
+        """
+        Постановка сообщения в очередь
+
+        Args:
+            key: ключ идемпотентности - повторная постановка с тем же ключом игнорируется
+            coalesce: можно объединить с другими ожидающими сообщениями в этот чат
+
+        Returns:
+            False, если сообщение с таким ключом уже было
+        """
+        message = OutboxMessage(chat_id, text, options, priority, key, coalesce)
+        return self.send_many([message]) == 1
+
+    def send_many(self, messages: Iterable[OutboxMessage]) -> int:
+        """Постановка пачки сообщений одной транзакцией, возвращает число новых"""
+        return self._enqueue(self._persist(messages))
+
+    async def enqueue(self, messages: Iterable[OutboxMessage]) -> int:
+        """То же, что send_many, но запись в БД выполняется в отдельном потоке"""
+        queued = await asyncio.to_thread(self._persist, messages)
+        return self._enqueue(queued)
+
+    def _persist(self, messages: Iterable[OutboxMessage]) -> List[OutboxMessage]:
+        messages = list(messages)
+        persistent = [m for m in messages if m.priority != INTERACTIVE]
+        queued = [m for m in messages if m.priority == INTERACTIVE]
+
+        if persistent:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            with conn:
+                # Сообщения с ключом пишутся пачкой, уже известные ключи пропускаются
+                keyed = {m.key: m for m in persistent if m.key is not None}
+                if keyed:
+                    keys = json.dumps(list(keyed))
+                    cursor.execute('''
+                        SELECT idempotency_key FROM outbox
+                        WHERE idempotency_key IN (SELECT value FROM json_each(?))
+                    ''', (keys,))
+                    for row in cursor.fetchall():
+                        del keyed[row['idempotency_key']]
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO outbox
+                        (idempotency_key, chat_id, priority, text, options, coalesce)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(m.key, m.chat_id, m.priority, m.text, json.dumps(m.options),
+                           int(m.coalesce)) for m in keyed.values()])
+                    cursor.execute('''
+                        SELECT msg_id, idempotency_key FROM outbox
+                        WHERE idempotency_key IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(list(keyed)),))
+                    for row in cursor.fetchall():
+                        message = keyed[row['idempotency_key']]
+                        message.msg_id = row['msg_id']
+                        queued.append(message)
+
+                for message in persistent:
+                    if message.key is not None:
+                        continue
+                    cursor.execute('''
+                        INSERT INTO outbox (chat_id, priority, text, options, coalesce)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (message.chat_id, message.priority, message.text,
+                          json.dumps(message.options), int(message.coalesce)))
+                    message.msg_id = cursor.lastrowid
+                    queued.append(message)
+            conn.close()
+        return queued
+
+    def _enqueue(self, queued: List[OutboxMessage]) -> int:
+        # Очередь в памяти меняется только в потоке цикла событий
+        for message in queued:
+            self._push(message)
+        if queued and self._wakeup is not None:
+            self._wakeup.set()
+        return len(queued)
+
+    def _push(self, message: OutboxMessage, delay: float = 0.0):
+        if delay > 0:
+            self._schedule(message, time.monotonic() + delay)
+        else:
+            self._make_ready(message)
+        if message.coalesce:
+            self._by_chat.setdefault(message.chat_id, []).append(message)
+
+    def _make_ready(self, message: OutboxMessage):
+        message.entry = next(self._seq)
+        heapq.heappush(self._ready, (message.priority, message.entry, message))
+
+    def _schedule(self, message: OutboxMessage, at: float):
+        message.entry = next(self._seq)
+        heapq.heappush(self._delayed, (at, message.entry, message))
+
+    def _load_pending(self):
+        """Восстановление очереди после перезапуска"""
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT msg_id, idempotency_key, chat_id, priority, text, options,
+                   coalesce, attempts
+            FROM outbox WHERE state = 'pending' ORDER BY msg_id
+        ''').fetchall()
+        conn.close()
+        # Сообщения, поставленные до запуска, уже в очереди
+        queued = {message.msg_id for _, _, message in self._ready + self._delayed}
+        rows = [row for row in rows if row['msg_id'] not in queued]
+        for row in rows:
+            self._push(OutboxMessage(
+                row['chat_id'], row['text'], json.loads(row['options'] or '{}'),
+                row['priority'], row['idempotency_key'], bool(row['coalesce']),
+                msg_id=row['msg_id'], attempts=row['attempts']
+            ))
+        return len(rows)
+
+    def pending(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    # === ЛИМИТЫ ===
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 100000:
+                self._prune_buckets()
+            # В группах лимит 20 сообщений в минуту, в личных чатах - 1 в секунду;
+            # короткий всплеск (ответ и документ подряд) Telegram допускает
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, 3.0)
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if bucket.wait_time(now, bucket.capacity) == 0:
+                del self.chat_buckets[chat_id]
+
+    def pause(self, seconds: float):
+        """Ответ 429 от Telegram: приостановка всех отправок"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        logger.warning(f"Превышен лимит Telegram, пауза {seconds} с")
+
+    # === ОТПРАВКА ===
+
+    async def start(self, bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        loaded = await asyncio.to_thread(self._load_pending)
+        await asyncio.to_thread(self.purge)
+        if loaded:
+            logger.info(f"Очередь сообщений восстановлена: {loaded}")
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Дожидаемся начатых отправок, чтобы их статус попал в БД
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            while self._delayed and self._delayed[0][0] <= now:
+                _, entry, message = heapq.heappop(self._delayed)
+                if entry == message.entry:
+                    self._make_ready(message)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, entry, message = self._ready[0]
+            if entry != message.entry:
+                # Сообщение ушло в составе объединенного или поставлено заново
+                heapq.heappop(self._ready)
+                continue
+
+            chat_wait = self.chat_bucket(message.chat_id).wait_time(now)
+            if chat_wait > 0:
+                # Чат занят - не задерживаем сообщения другим пользователям
+                heapq.heappop(self._ready)
+                self._schedule(message, now + chat_wait)
+                continue
+
+            reserve = self.bulk_reserve if message.priority == BULK else 0
+            global_wait = self.global_bucket.wait_time(now, 1 + reserve)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            heapq.heappop(self._ready)
+            message.entry = None
+            self.global_bucket.take(now)
+            self.chat_bucket(message.chat_id).take(now)
+            batch = self._coalesce(message)
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    def _coalesce(self, message: OutboxMessage) -> List[OutboxMessage]:
+        """Объединение ожидающих сообщений в тот же чат в одно"""
+        if not message.coalesce:
+            return [message]
+
+        queued = self._by_chat.get(message.chat_id, [])
+        batch = [message]
+        length = len(message.text)
+        for other in queued:
+            if other is message or other.absorbed or other.options != message.options:
+                continue
+            if length + 2 + len(other.text) > MAX_MESSAGE_LENGTH:
+                continue
+            other.absorbed = True
+            # Записи в _ready/_delayed больше не действуют
+            other.entry = None
+            batch.append(other)
+            length += 2 + len(other.text)
+
+        remaining = [m for m in queued if m not in batch]
+        if remaining:
+            self._by_chat[message.chat_id] = remaining
+        else:
+            self._by_chat.pop(message.chat_id, None)
+        message.absorbed = True
+        return batch
+
+    async def _send(self, batch: List[OutboxMessage]):
+        head = batch[0]
+        text = '\n\n'.join(message.text for message in batch)
+        try:
+            await self.bot.send_message(head.chat_id, text,
+                                        rate_limit_args={'outbox': True}, **head.options)
+        except RetryAfter as e:
+            self.pause(e.retry_after)
+            self._requeue(batch)
+        except (Forbidden, BadRequest, ChatMigrated) as e:
+            # Пользователь заблокировал бота или сообщение некорректно - не повторяем
+            await asyncio.to_thread(self._mark, batch, 'failed', str(e))
+        except NetworkError as e:
+            for message in batch:
+                message.attempts += 1
+            if head.attempts >= self.max_attempts:
+                await asyncio.to_thread(self._mark, batch, 'failed', str(e))
+            else:
+                self._requeue(batch, min(300, 2 ** head.attempts))
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения в чат {head.chat_id}: {e}")
+            await asyncio.to_thread(self._mark, batch, 'failed', str(e))
+        else:
+            await asyncio.to_thread(self._mark, batch, 'sent')
+        finally:
+            self._slots.release()
+
+    def _requeue(self, batch: List[OutboxMessage], delay: float = 0.0):
+        for message in batch:
+            message.absorbed = False
+            self._push(message, delay)
+        self._wakeup.set()
+
+    def _mark(self, batch: List[OutboxMessage], state: str, error: str = None):
+        if state == 'sent':
+            self.sent += len(batch)
+        else:
+            self.failed += len(batch)
+            logger.info(f"Сообщение в чат {batch[0].chat_id} не доставлено: {error}")
+
+        rows = [(state, error, message.attempts, message.msg_id)
+                for message in batch if message.msg_id is not None]
+        if not rows:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany('''
+                UPDATE outbox SET state = ?, error = ?, attempts = ?,
+                       sent_at = CURRENT_TIMESTAMP
+                WHERE msg_id = ?
+            ''', rows)
+        conn.close()
+
+    def purge(self, days: int = None) -> int:
+        """Удаление обработанных сообщений (ключи идемпотентности живут days дней)"""
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.execute('''
+                DELETE FROM outbox
+                WHERE state != 'pending' AND sent_at < DATETIME('now', ?)
+            ''', (f'-{days or self.retention_days} days',))
+        conn.close()
+        return cursor.rowcount
+
+
+class OutboxRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель запросов бота (ApplicationBuilder.rate_limiter)
+
+    Ответы обработчиков забирают токены тех же корзин, что и очередь рассылок,
+    не дожидаясь их, поэтому всегда уходят раньше массовых сообщений
+    """
+
+    def __init__(self, outbox: Outbox, max_retries: int = 2):
+        self.outbox = outbox
+        self.max_retries = max_retries
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data,
+                              rate_limit_args: Optional[Dict]):
+        from_outbox = bool(rate_limit_args and rate_limit_args.get('outbox'))
+        chat_id = data.get('chat_id')
+        if not from_outbox and endpoint in SEND_ENDPOINTS and isinstance(chat_id, int):
+            now = time.monotonic()
+            # Лимит на чат соблюдаем и для ответов, иначе Telegram вернет 429
+            wait = self.outbox.chat_bucket(chat_id).wait_time(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = time.monotonic()
+            self.outbox.chat_bucket(chat_id).take(now)
+            self.outbox.global_bucket.take(now)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.outbox.pause(e.retry_after)
+                if from_outbox or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(e.retry_after)
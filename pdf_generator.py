@@ -2,15 +2,18 @@
 Модуль для генерации PDF конспектов из заметок
 """
 
-from reportlab.lib.pagesizes import A4
+from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.lib.colors import HexColor
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle, Image
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from datetime import datetime
 from typing import List, Dict
+import hashlib
+import json
 import os
 
 
@@ -30,8 +33,32 @@ class PDFGenerator:
             # Fallback на стандартный шрифт
             self.russian_font = 'Helvetica'
     
+    def photo_flowable(self, path: str, max_width: float = 12*cm, 
+                       max_height: float = 12*cm) -> Image:
+        """Картинка для PDF с сохранением пропорций"""
+        width, height = ImageReader(path).getSize()
+        scale = min(max_width / width, max_height / height, 1)
+        return Image(path, width=width * scale, height=height * scale)
+    
+    @staticmethod
+    def notes_digest(notes: List[Dict], category: str = None,
+                     username: str = 'Студент') -> str:
+        """
+        Хэш содержимого конспекта: одинаковые заметки - одинаковый экспорт,
+        хотя байты PDF различаются (дата создания)
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([category, username], ensure_ascii=False).encode('utf-8'))
+        for note in notes:
+            if category and note.get('category') != category:
+                continue
+            digest.update(json.dumps(note, ensure_ascii=False, sort_keys=True,
+                                     default=str).encode('utf-8'))
+        return digest.hexdigest()
+    
     def create_notes_pdf(self, user_id: int, notes: List[Dict], 
-                        category: str = None, username: str = 'Студент') -> str:
+                        category: str = None, username: str = 'Студент',
+                        thumbnails: Dict[str, str] = None) -> str:
         """
         Создание PDF конспекта из заметок
         
@@ -40,10 +67,13 @@ class PDFGenerator:
             notes: Список заметок
             category: Категория для фильтрации (опционально)
             username: Имя пользователя
+            thumbnails: Миниатюры фото (file_id -> путь), опционально
         
         Returns:
             Путь к созданному PDF файлу
         """
+        thumbnails = thumbnails or {}
+        
         # Фильтрация по категории если указана
         if category:
             notes = [n for n in notes if n.get('category') == category]
@@ -168,10 +198,14 @@ class PDFGenerator:
                     content.append(Paragraph(safe_content, normal_style))
                 
                 elif note_type == 'photo':
-                    content.append(Paragraph(
-                        f"📷 <i>Заметка с фотографией</i>", 
-                        normal_style
-                    ))
+                    thumbnail = thumbnails.get(note.get('file_id'))
+                    if thumbnail:
+                        content.append(self.photo_flowable(thumbnail))
+                    else:
+                        content.append(Paragraph(
+                            f"📷 <i>Заметка с фотографией</i>", 
+                            normal_style
+                        ))
                     if note_content:
                         safe_content = note_content.replace('&', '&amp;')\
                                                    .replace('<', '&lt;')\
@@ -242,27 +276,31 @@ class PDFGenerator:
         return filename
     
     def create_schedule_pdf(self, user_id: int, schedule: List[Dict], 
-                           username: str = 'Студент') -> str:
+                           username: str = 'Студент', version: int = None) -> str:
         """
-        Создание PDF расписания занятий
+        Создание PDF расписания занятий в виде недельной сетки
         
         Args:
             user_id: ID пользователя
             schedule: Список занятий
             username: Имя пользователя
+            version: Версия расписания (для имени файла в кэше)
         
         Returns:
             Путь к созданному PDF файлу
         """
-        filename = f"{self.output_dir}/schedule_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        if version is not None:
+            filename = f"{self.output_dir}/schedule_{user_id}_v{version}.pdf"
+        else:
+            filename = f"{self.output_dir}/schedule_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         
         doc = SimpleDocTemplate(
             filename,
-            pagesize=A4,
-            rightMargin=2*cm,
-            leftMargin=2*cm,
-            topMargin=2*cm,
-            bottomMargin=2*cm
+            pagesize=landscape(A4),
+            rightMargin=1*cm,
+            leftMargin=1*cm,
+            topMargin=1*cm,
+            bottomMargin=1*cm
         )
         
         styles = getSampleStyleSheet()
@@ -271,69 +309,112 @@ class PDFGenerator:
             'CustomTitle',
             parent=styles['Title'],
             fontName=self.russian_font,
-            fontSize=24,
+            fontSize=20,
             textColor=HexColor('#2C3E50'),
-            spaceAfter=20,
+            spaceAfter=10,
             alignment=1
         )
         
+        cell_style = ParagraphStyle(
+            'ScheduleCell',
+            parent=styles['Normal'],
+            fontName=self.russian_font,
+            fontSize=8,
+            leading=10
+        )
+        
+        meta_style = ParagraphStyle(
+            'CustomMeta',
+            parent=styles['Normal'],
+            fontName=self.russian_font,
+            fontSize=9,
+            textColor=HexColor('#7F8C8D'),
+            spaceAfter=6
+        )
+        
         content = []
         
         # Заголовок
         content.append(Paragraph("📅 Расписание занятий", title_style))
-        content.append(Paragraph(f"Студент: {username}", styles['Normal']))
-        content.append(Spacer(1, 1*cm))
+        content.append(Paragraph(f"Студент: {username}", meta_style))
+        content.append(Spacer(1, 0.3*cm))
         
         # Дни недели
-        days = {
-            0: 'Понедельник',
-            1: 'Вторник',
-            2: 'Среда',
-            3: 'Четверг',
-            4: 'Пятница',
-            5: 'Суббота',
-            6: 'Воскресенье'
-        }
-        
-        # Группировка по дням
-        schedule_by_day = {}
+        days = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+        
+        # Строки сетки - уникальные временные слоты
+        slots = sorted({(item['start_time'], item['end_time']) for item in schedule})
+        cells = {}
         for item in schedule:
-            day = item['day_of_week']
-            if day not in schedule_by_day:
-                schedule_by_day[day] = []
-            schedule_by_day[day].append(item)
-        
-        # Таблица расписания по дням
-        for day_num in sorted(schedule_by_day.keys()):
-            day_name = days.get(day_num, f"День {day_num}")
-            day_schedule = sorted(schedule_by_day[day_num], 
-                                key=lambda x: x['start_time'])
-            
-            content.append(Paragraph(f"<b>{day_name}</b>", styles['Heading2']))
-            
-            table_data = [['Время', 'Предмет', 'Аудитория']]
-            for item in day_schedule:
-                time_str = f"{item['start_time']} - {item['end_time']}"
-                table_data.append([
-                    time_str,
-                    item['subject'],
-                    item.get('location', '-')
+            key = (item['start_time'], item['end_time'], item['day_of_week'])
+            cells.setdefault(key, []).append(item)
+        
+        table_data = [['Время'] + days]
+        for start_time, end_time in slots:
+            row = [f"{start_time}\n{end_time}"]
+            for day_num in range(len(days)):
+                lessons = cells.get((start_time, end_time, day_num), [])
+                row.append([
+                    Paragraph(self._escape(lesson['subject']) + (
+                        f"<br/><font color='#7F8C8D'>{self._escape(lesson['location'])}</font>"
+                        if lesson.get('location') else ''
+                    ), cell_style)
+                    for lesson in lessons
                 ])
-            
-            schedule_table = Table(table_data, colWidths=[4*cm, 7*cm, 4*cm])
-            schedule_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), HexColor('#3498DB')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), HexColor('#FFFFFF')),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, -1), self.russian_font),
-                ('FONTSIZE', (0, 0), (-1, 0), 11),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-                ('GRID', (0, 0), (-1, -1), 1, HexColor('#BDC3C7'))
-            ]))
-            
-            content.append(schedule_table)
-            content.append(Spacer(1, 0.5*cm))
+            table_data.append(row)
+        
+        time_width = 2.2*cm
+        day_width = (doc.width - time_width) / len(days)
+        schedule_table = Table(table_data, 
+                               colWidths=[time_width] + [day_width] * len(days),
+                               repeatRows=1)
+        schedule_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), HexColor('#3498DB')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), HexColor('#FFFFFF')),
+            ('BACKGROUND', (0, 1), (0, -1), HexColor('#ECF0F1')),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('FONTNAME', (0, 0), (-1, -1), self.russian_font),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+            ('GRID', (0, 0), (-1, -1), 1, HexColor('#BDC3C7'))
+        ]))
+        
+        content.append(schedule_table)
         
         doc.build(content)
         
         return filename
+    
+    def get_schedule_pdf(self, user_id: int, schedule: List[Dict], version: int,
+                         username: str = 'Студент', previous: str = None) -> str:
+        """
+        PDF расписания из кэша или новый рендер, если версия изменилась
+        
+        Args:
+            previous: путь прошлого рендера (schedule_exports.file_path);
+                без него удаляется рендер версии version - 1
+        
+        Returns:
+            Путь к PDF файлу
+        """
+        filename = f"{self.output_dir}/schedule_{user_id}_v{version}.pdf"
+        if os.path.exists(filename):
+            return filename
+        
+        # Удаляем прошлый рендер по известному пути, без обхода всего каталога
+        previous = previous or f"{self.output_dir}/schedule_{user_id}_v{version - 1}.pdf"
+        if previous != filename:
+            try:
+                os.remove(previous)
+            except FileNotFoundError:
+                pass
+        
+        return self.create_schedule_pdf(user_id, schedule, username, version)
+    
+    @staticmethod
+    def _escape(text: str) -> str:
+        """Экранирование спецсимволов для Paragraph"""
+        return (text or '').replace('&', '&amp;')\
+                           .replace('<', '&lt;')\
+                           .replace('>', '&gt;')
@@ -0,0 +1,281 @@
+"""
+Профилирование StudyBoost по требованию
+Выборочный cProfile обработчиков с накоплением pstats по имени обработчика
+и периодические снимки tracemalloc с разницей по местам выделения памяти.
+Включается переменными окружения или командой /profile
+"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class _ProfiledCoroutine:
+    """
+    Выполнение корутины обработчика под профилировщиком
+
+    Профилировщик включается только на время шагов самой корутины,
+    поэтому обработчики, выполняющиеся параллельно, не попадают в чужой профиль
+    """
+
+    def __init__(self, coro, profile: cProfile.Profile, on_done):
+        self.coro = coro
+        self.profile = profile
+        self.on_done = on_done
+
+    def __await__(self):
+        steps = self.coro.__await__()
+        value, error = None, None
+        try:
+            while True:
+                self.profile.enable()
+                try:
+                    if error is not None:
+                        future = steps.throw(error)
+                    else:
+                        future = steps.send(value)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    self.profile.disable()
+                try:
+                    value, error = (yield future), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            self.on_done(self.profile)
+
+
+class Profiler:
+    def __init__(self, output_dir: str = 'profiles', sample_rate: float = 0.0,
+                 snapshot_interval: float = 0.0, dump_interval: float = 600,
+                 top_n: int = 25, keep_files: int = 200, frames: int = 5):
+        self.output_dir = output_dir
+        # Доля обновлений, которые проходят через cProfile (0 - выключено)
+        self.sample_rate = sample_rate
+        # Период снимков tracemalloc в секундах (0 - выключено)
+        self.snapshot_interval = snapshot_interval
+        self.dump_interval = dump_interval
+        self.top_n = top_n
+        self.keep_files = keep_files
+        self.frames = frames
+        self.stats: Dict[str, pstats.Stats] = {}
+        self.samples: Dict[str, int] = {}
+        self._last_dump = time.monotonic()
+        # stats и samples пополняются в цикле событий, а пишутся в потоке
+        self._lock = threading.Lock()
+        self._dump_future = None
+        self._snapshot = None
+        self._job_queue = None
+        self._snapshot_job = None
+
+    # === CPROFILE ===
+
+    def enable(self, sample_rate: float = 0.05):
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    def disable(self):
+        self.sample_rate = 0.0
+
+    def maybe_profile(self, name: str, coro):
+        """Корутина обработчика, с вероятностью sample_rate - под профилировщиком"""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return coro
+        return _ProfiledCoroutine(coro, cProfile.Profile(),
+                                  lambda profile: self._add(name, profile))
+
+    def _add(self, name: str, profile: cProfile.Profile):
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self.samples[name] = self.samples.get(name, 0) + 1
+            due = time.monotonic() - self._last_dump >= self.dump_interval
+            if due:
+                self._last_dump = time.monotonic()
+
+        if due:
+            # Запись файлов - в потоке, цикл событий не ждет диска
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.dump()
+            else:
+                self._dump_future = loop.run_in_executor(None, self._dump_logged)
+
+    def _dump_logged(self):
+        try:
+            self.dump()
+        except Exception as e:
+            logger.error(f"Не удалось записать профили: {e}")
+
+    def _take(self):
+        """Накопленные профили с обнулением: дальше ими владеет только вызывающий"""
+        with self._lock:
+            self._last_dump = time.monotonic()
+            taken = self.stats, self.samples
+            self.stats, self.samples = {}, {}
+        return taken
+
+    def dump(self) -> List[str]:
+        """
+        Запись накопленных профилей (.prof для snakeviz/pstats и текстовый топ).
+        Пишет файлы - вызывается из потока (asyncio.to_thread)
+
+        Returns:
+            Пути записанных файлов
+        """
+        all_stats, samples = self._take()
+        if not all_stats:
+            return []
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        paths = []
+        for name, stats in all_stats.items():
+            base = os.path.join(self.output_dir, f'{stamp}-{name}')
+            stats.dump_stats(f'{base}.prof')
+
+            report = io.StringIO()
+            stats.stream = report
+            report.write(f'{name}: {samples[name]} обновлений\n')
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+            with open(f'{base}.txt', 'w', encoding='utf-8') as f:
+                f.write(report.getvalue())
+            paths.extend([f'{base}.prof', f'{base}.txt'])
+
+        self._rotate()
+        logger.info(f"Профили записаны в {self.output_dir}: {len(paths)} файлов")
+        return paths
+
+    def _rotate(self):
+        """Удаление самых старых файлов сверх keep_files"""
+        files = sorted(
+            (entry for entry in os.scandir(self.output_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in files[:max(0, len(files) - self.keep_files)]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Снимок памяти и запись профилей могут чистить каталог одновременно
+                pass
+
+    # === TRACEMALLOC ===
+
+    def start(self, job_queue):
+        self._job_queue = job_queue
+        if self.snapshot_interval:
+            self.enable_memory(self.snapshot_interval)
+
+    def enable_memory(self, interval: float = 300):
+        self.snapshot_interval = interval
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._snapshot = self._take_snapshot()
+        if self._snapshot_job is not None:
+            self._snapshot_job.schedule_removal()
+            self._snapshot_job = None
+        if self._job_queue is not None:
+            self._snapshot_job = self._job_queue.run_repeating(
+                self._snapshot_tick, interval=interval, first=interval,
+                name='tracemalloc_snapshot'
+            )
+
+    def disable_memory(self):
+        if self._snapshot_job is not None:
+            self._snapshot_job.schedule_removal()
+            self._snapshot_job = None
+        self._snapshot = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ))
+
+    async def _snapshot_tick(self, context):
+        # Снимок крупной кучи занимает заметное время - не блокируем цикл
+        await asyncio.to_thread(self.snapshot)
+
+    def snapshot(self) -> str:
+        """
+        Снимок памяти и разница с предыдущим по местам выделения
+
+        Returns:
+            Путь к отчету или None, если tracemalloc выключен
+        """
+        if not tracemalloc.is_tracing():
+            return None
+
+        current = self._take_snapshot()
+        previous, self._snapshot = self._snapshot, current
+        size, peak = tracemalloc.get_traced_memory()
+
+        lines = [f'Отслеживается {size / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ', '']
+        if previous is not None:
+            lines.append('Прирост по строкам:')
+            diff = current.compare_to(previous, 'lineno')
+            lines.extend(f'  {stat}' for stat in diff[:self.top_n])
+            lines.append('')
+            # Рост по файлам: user_data в боте, списки заметок в БД, PDF
+            lines.append('Прирост по файлам:')
+            diff = current.compare_to(previous, 'filename')
+            lines.extend(f'  {stat}' for stat in diff[:10])
+        else:
+            lines.append('Крупнейшие места выделения:')
+            lines.extend(f'  {stat}' for stat in current.statistics('lineno')[:self.top_n])
+
+        lines.append('')
+        lines.append('Стек крупнейшего места:')
+        top = current.statistics('traceback')[:1]
+        for stat in top:
+            lines.extend(f'  {line}' for line in stat.traceback.format())
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir,
+                            f"{time.strftime('%Y%m%d-%H%M%S')}-tracemalloc.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        self._rotate()
+        return path
+
+    def format_status(self) -> str:
+        lines = ["🔬 Профилирование", ""]
+        if self.sample_rate:
+            with self._lock:
+                total = sum(self.samples.values())
+            lines.append(f"cProfile: {self.sample_rate:.0%} обновлений, "
+                         f"накоплено {total}")
+        else:
+            lines.append("cProfile: выключен")
+        if tracemalloc.is_tracing():
+            size, peak = tracemalloc.get_traced_memory()
+            lines.append(f"tracemalloc: каждые {self.snapshot_interval:.0f} с, "
+                         f"{size / 1024 / 1024:.1f} МБ (пик {peak / 1024 / 1024:.1f} МБ)")
+        else:
+            lines.append("tracemalloc: выключен")
+        lines.append(f"Каталог: {self.output_dir}")
+        return '\n'.join(lines)
+
+
+profiler = Profiler(
+    output_dir=os.getenv('STUDYBOOST_PROFILE_DIR', 'profiles'),
+    sample_rate=float(os.getenv('STUDYBOOST_PROFILE_RATE', '0')),
+    snapshot_interval=float(os.getenv('STUDYBOOST_TRACEMALLOC_INTERVAL', '0'))
+)
@@ -0,0 +1,116 @@
+"""
+Запись входящих обновлений для воспроизведения (benchmarks.replay)
+Идентификаторы пользователей и чатов заменяются ключевым хэшем, имена,
+тексты и файлы обезличиваются с сохранением длины и структуры.
+Формат - NDJSON (по строке на обновление, .gz - со сжатием):
+{"t": время получения, "u": обновление в формате Bot API}
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Ключи с идентификаторами пользователей и чатов
+ID_PARENTS = {'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat',
+              'new_chat_member', 'new_chat_members', 'old_chat_member', 'left_chat_member',
+              'via_bot'}
+# Персональные данные, которые не нужны для воспроизведения
+DROP_KEYS = {'last_name', 'username', 'phone_number', 'contact', 'location', 'venue',
+             'bio', 'vcard', 'invite_link'}
+
+
+class UpdateRecorder:
+    def __init__(self, path: str = 'updates.ndjson.gz', salt: str = None,
+                 keep_texts=(), flush_interval: float = 1.0):
+        self.path = path
+        # Без постоянной соли идентификаторы разных запусков не совпадают
+        self.salt = (salt or secrets.token_hex(16)).encode('utf-8')
+        # Тексты, которые записываются как есть (кнопки меню, команды)
+        self.keep_texts = set(keep_texts)
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._file = None
+        self._last_flush = 0.0
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Дописывание в .gz создает новый член архива, gzip читает их подряд
+        if self.path.endswith('.gz'):
+            self._file = gzip.open(self.path, 'at', encoding='utf-8', compresslevel=6)
+        else:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Записано обновлений: {self.recorded} ({self.path})")
+
+    async def record(self, update: Update, context):
+        """Обработчик группы -1: вызывается до остальных и ничего не меняет"""
+        if self._file is None:
+            self.open()
+        line = json.dumps({'t': round(time.time(), 3), 'u': self.anonymize(update.to_dict())},
+                          ensure_ascii=False, separators=(',', ':'))
+        self._file.write(line + '\n')
+        self.recorded += 1
+
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            self._file.flush()
+
+    # === ОБЕЗЛИЧИВАНИЕ ===
+
+    def hash_id(self, value: int) -> int:
+        digest = hmac.new(self.salt, str(abs(value)).encode('ascii'), hashlib.sha256)
+        # Знак сохраняется: отрицательные id - группы и каналы
+        hashed = int(digest.hexdigest()[:12], 16) % 10 ** 12 + 10 ** 9
+        return -hashed if value < 0 else hashed
+
+    def hash_file(self, value: str) -> str:
+        digest = hmac.new(self.salt, value.encode('utf-8'), hashlib.sha256).hexdigest()
+        return f'anon{digest[:24]}'
+
+    def scrub_text(self, text: str) -> str:
+        if text in self.keep_texts:
+            return text
+        words = text.split(' ')
+        if words[0].startswith('/'):
+            # Команда остается, аргументы обезличиваются
+            return ' '.join([words[0]] + [self.scrub_text(word) for word in words[1:]])
+        # Длина в UTF-16 не меняется: смещения entities остаются верными
+        return ''.join('0' if c.isdigit() else 'x' if c.isalnum() else c for c in text)
+
+    def anonymize(self, data, parent: str = None):
+        if isinstance(data, list):
+            return [self.anonymize(item, parent) for item in data]
+        if not isinstance(data, dict):
+            return data
+
+        result = {}
+        for key, value in data.items():
+            if key in DROP_KEYS:
+                continue
+            if key == 'id' and parent in ID_PARENTS and isinstance(value, int):
+                result[key] = self.hash_id(value)
+            elif key in ('text', 'caption') and isinstance(value, str):
+                result[key] = self.scrub_text(value)
+            elif key in ('file_id', 'file_unique_id') and isinstance(value, str):
+                result[key] = self.hash_file(value)
+            elif key in ('first_name', 'title') and isinstance(value, str):
+                result[key] = 'User' if key == 'first_name' else 'Chat'
+            else:
+                result[key] = self.anonymize(value, key)
+        return result
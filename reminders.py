@@ -0,0 +1,314 @@
+"""
+Напоминания о сроках целей и начале занятий
+В памяти хранится только скользящее окно ближайших напоминаний (куча по
+времени срабатывания). Окно дозагружается диапазонными запросами по индексам
+goals(deadline) и schedule(day_of_week, start_time), изменения целей и
+расписания применяются точечно через подписку на Database
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, Optional
+
+from outbox import REMINDER, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+class Reminder:
+    __slots__ = ('table', 'item_id', 'user_id', 'fire_at', 'text', 'cancelled')
+
+    def __init__(self, table: str, item_id: int, user_id: int, fire_at: datetime, text: str):
+        self.table = table
+        self.item_id = item_id
+        self.user_id = user_id
+        self.fire_at = fire_at
+        self.text = text
+        self.cancelled = False
+
+
+class ReminderEngine:
+    def __init__(self, bot, horizon: timedelta = timedelta(hours=1),
+                 goal_lead: timedelta = timedelta(days=1),
+                 class_lead: timedelta = timedelta(minutes=15),
+                 grace: timedelta = timedelta(minutes=10),
+                 goal_day_time: dtime = dtime(9, 0),
+                 retry_delay: timedelta = timedelta(seconds=5),
+                 max_retry_delay: timedelta = timedelta(minutes=5)):
+        self.bot = bot
+        # Окно, которое держится в памяти (меньше недели: занятия повторяются)
+        self.horizon = min(horizon, timedelta(days=6))
+        self.goal_lead = goal_lead
+        self.class_lead = class_lead
+        # Напоминания, пропущенные во время перезапуска, отправляются с опозданием
+        self.grace = grace
+        # Время суток для сроков, заданных только датой
+        self.goal_day_time = goal_day_time
+        # Пауза после ошибки (база заблокирована, диск): удваивается до max_retry_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._failures = 0
+        self.loaded_until: Optional[datetime] = None
+        self.fired = 0
+        self._heap = []
+        self._entries: Dict[tuple, Reminder] = {}
+        self._changes = set()
+        self._seq = itertools.count()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    # === ЖИЗНЕННЫЙ ЦИКЛ ===
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.bot.db.listeners.append(self.on_change)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.on_change in self.bot.db.listeners:
+            self.bot.db.listeners.remove(self.on_change)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def on_change(self, table: str, item_id: int):
+        """Вызывается Database при изменении цели или занятия (из любого потока)"""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._mark_changed, table, item_id)
+
+    def _mark_changed(self, table: str, item_id: int):
+        self._changes.add((table, item_id))
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._entries)
+
+    # === ВРЕМЯ СРАБАТЫВАНИЯ ===
+
+    def goal_fire_time(self, deadline: str) -> datetime:
+        if len(deadline) <= 10:
+            moment = datetime.combine(date.fromisoformat(deadline), self.goal_day_time)
+        else:
+            moment = datetime.fromisoformat(deadline[:19])
+        return moment - self.goal_lead
+
+    def class_fire_time(self, start_time: str, day: date) -> datetime:
+        return datetime.combine(day, dtime.fromisoformat(start_time)) - self.class_lead
+
+    def next_class_fire_time(self, day_of_week: int, start_time: str,
+                             after: datetime) -> datetime:
+        day = after.date() + timedelta(days=(day_of_week - after.weekday()) % 7)
+        fire_at = self.class_fire_time(start_time, day)
+        if fire_at < after:
+            fire_at = self.class_fire_time(start_time, day + timedelta(days=7))
+        return fire_at
+
+    # === ТЕКСТЫ ===
+
+    def goal_reminder(self, row: Dict, fire_at: datetime) -> Reminder:
+        deadline = row['deadline']
+        when = (datetime.fromisoformat(deadline[:19]).strftime('%d.%m %H:%M')
+                if len(deadline) > 10 else date.fromisoformat(deadline).strftime('%d.%m'))
+        text = f"⏰ Напоминание о цели «{row['title']}»\nСрок: {when}"
+        return Reminder('goals', row['goal_id'], row['user_id'], fire_at, text)
+
+    def class_reminder(self, row: Dict, fire_at: datetime) -> Reminder:
+        minutes = int(self.class_lead.total_seconds() // 60)
+        text = f"📚 Через {minutes} мин: {row['subject']} ({row['start_time']})"
+        if row.get('location'):
+            text += f"\n📍 {row['location']}"
+        return Reminder('schedule', row['schedule_id'], row['user_id'], fire_at, text)
+
+    # === ЗАГРУЗКА ОКНА ===
+
+    def _schedule(self, reminder: Reminder):
+        key = (reminder.table, reminder.item_id)
+        existing = self._entries.get(key)
+        if existing is not None:
+            if existing.fire_at == reminder.fire_at:
+                return
+            existing.cancelled = True
+        self._entries[key] = reminder
+        heapq.heappush(self._heap, (reminder.fire_at, next(self._seq), reminder))
+
+    def _cancel(self, table: str, item_id: int):
+        existing = self._entries.pop((table, item_id), None)
+        if existing is not None:
+            existing.cancelled = True
+
+    def _fetch_window(self, start: datetime, end: datetime):
+        """Цели и занятия, напоминания о которых попадают в [start, end)"""
+        db = self.bot.db
+        reminders = []
+
+        # Сроки со временем - диапазон строк, сроки-даты - список дней
+        deadline_from = start + self.goal_lead
+        deadline_to = end + self.goal_lead
+        dates = []
+        day = deadline_from.date()
+        while day <= deadline_to.date():
+            if deadline_from <= datetime.combine(day, self.goal_day_time) < deadline_to:
+                dates.append(day.isoformat())
+            day += timedelta(days=1)
+        rows = db.get_goal_reminders(deadline_from.strftime('%Y-%m-%d %H:%M:%S'),
+                                     deadline_to.strftime('%Y-%m-%d %H:%M:%S'), dates)
+        for row in rows:
+            fire_at = self.goal_fire_time(row['deadline'])
+            if start <= fire_at < end:
+                reminders.append(self.goal_reminder(row, fire_at))
+
+        # Занятия: по одному интервалу времени на каждый день окна
+        class_from = start + self.class_lead
+        class_to = end + self.class_lead
+        slots = []
+        days = {}
+        day = class_from.date()
+        while day <= class_to.date():
+            day_start = datetime.combine(day, dtime.min)
+            low = max(class_from, day_start)
+            high = min(class_to, day_start + timedelta(days=1))
+            if low < high:
+                time_to = ('24:00' if high.date() > day
+                           else (high + timedelta(seconds=59)).strftime('%H:%M'))
+                slots.append((day.weekday(), low.strftime('%H:%M'), time_to))
+                days[day.weekday()] = day
+            day += timedelta(days=1)
+        for row in db.get_class_reminders(slots):
+            try:
+                fire_at = self.class_fire_time(row['start_time'], days[row['day_of_week']])
+            except ValueError:
+                continue
+            if start <= fire_at < end:
+                reminders.append(self.class_reminder(row, fire_at))
+
+        return reminders
+
+    def _fetch_item(self, table: str, item_id: int, now: datetime):
+        return self._reminder_for(table, self.bot.db.get_reminder_item(table, item_id), now)
+
+    def _reminder_for(self, table: str, row: Optional[Dict], now: datetime):
+        if row is None:
+            return None
+        try:
+            if table == 'goals':
+                fire_at = self.goal_fire_time(row['deadline'])
+                return self.goal_reminder(row, fire_at) if fire_at >= now else None
+            fire_at = self.next_class_fire_time(row['day_of_week'], row['start_time'], now)
+            return self.class_reminder(row, fire_at)
+        except ValueError:
+            return None
+
+    async def _load(self, now: datetime):
+        start = self.loaded_until or now - self.grace
+        end = now + self.horizon
+        reminders = await asyncio.to_thread(self._fetch_window, start, end)
+        for reminder in reminders:
+            self._schedule(reminder)
+        self.loaded_until = end
+
+    async def _apply_changes(self, now: datetime):
+        changes, self._changes = self._changes, set()
+        pending = list(changes)
+        try:
+            while pending:
+                table, item_id = pending[-1]
+                reminder = await asyncio.to_thread(self._fetch_item, table, item_id, now)
+                if reminder is None or reminder.fire_at >= self.loaded_until:
+                    # Дальние напоминания подхватит загрузка следующего окна
+                    self._cancel(table, item_id)
+                else:
+                    self._schedule(reminder)
+                pending.pop()
+        except Exception:
+            # Необработанные изменения повторятся на следующем проходе
+            self._changes.update(pending)
+            raise
+
+    # === СРАБАТЫВАНИЕ ===
+
+    async def _run(self):
+        while True:
+            # Сброс до обработки: изменения, пришедшие во время нее, не теряются
+            self._wakeup.clear()
+            try:
+                now = datetime.now()
+                if self.loaded_until is None or self.loaded_until - now < self.horizon / 2:
+                    await self._load(now)
+                if self._changes:
+                    await self._apply_changes(now)
+
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, reminder = heapq.heappop(self._heap)
+                    if reminder.cancelled:
+                        continue
+                    self._entries.pop((reminder.table, reminder.item_id), None)
+                    due.append(reminder)
+                if due:
+                    try:
+                        await self._fire(due)
+                    except Exception:
+                        self._requeue(due)
+                        raise
+                self._failures = 0
+            except Exception as e:
+                self._failures += 1
+                logger.error(f"Ошибка обработки напоминаний: {e}")
+
+            # Спим до ближайшего напоминания или до дозагрузки окна
+            now = datetime.now()
+            wake_at = self.loaded_until - self.horizon / 2 if self.loaded_until else now
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            if self._failures:
+                # После ошибки не повторяем сразу: цикл не должен крутиться вхолостую
+                delay = min(self.retry_delay * 2 ** min(self._failures - 1, 10),
+                            self.max_retry_delay)
+                wake_at = max(wake_at, now + delay)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       max(0.0, (wake_at - now).total_seconds()))
+            except asyncio.TimeoutError:
+                pass
+
+    def _requeue(self, due):
+        """Возврат напоминаний, которые не удалось отправить (если их не заменило изменение)"""
+        for reminder in due:
+            if (reminder.table, reminder.item_id) not in self._entries:
+                self._schedule(reminder)
+
+    def _validate(self, due):
+        # Цель могла быть выполнена или удалена другим процессом (utils.py)
+        rows = {}
+        for table in {reminder.table for reminder in due}:
+            rows[table] = self.bot.db.get_reminder_items(
+                table, [reminder.item_id for reminder in due if reminder.table == table]
+            )
+        valid = []
+        for reminder in due:
+            current = self._reminder_for(reminder.table,
+                                         rows[reminder.table].get(reminder.item_id),
+                                         reminder.fire_at)
+            if current is not None and current.fire_at == reminder.fire_at:
+                valid.append(current)
+        return valid
+
+    async def _fire(self, due):
+        valid = await asyncio.to_thread(self._validate, due)
+        # Ключ с временем срабатывания: после перезапуска напоминание не повторится
+        await self.bot.outbox.enqueue([
+            OutboxMessage(
+                reminder.user_id, reminder.text, priority=REMINDER,
+                key=(f"reminder:{reminder.table}:{reminder.item_id}:"
+                     f"{reminder.fire_at.strftime('%Y%m%d%H%M')}")
+            )
+            for reminder in valid
+        ])
+        self.fired += len(valid)
@@ -0,0 +1,153 @@
+"""
+Очистка старых записей activity_log без долгих блокировок
+Журнал обходится диапазонами log_id; каждый диапазон - короткая
+транзакция: старые строки сворачиваются в дневные итоги activity_daily,
+при необходимости дописываются в сжатый архив и удаляются. Между
+транзакциями - пауза, чтобы запись бота не ждала. В конце освободившиеся
+страницы возвращаются файловой системе (incremental_vacuum)
+"""
+
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from db_connection import connect
+
+
+class ActivityRetention:
+    def __init__(self, db_name: str = 'studyboost.db', days: int = 90,
+                 batch_size: int = 2000, pause: float = 0.05, archive_dir: str = None,
+                 vacuum_pages: int = 2000):
+        self.db_name = db_name
+        self.days = days
+        # Диапазон log_id на одну транзакцию
+        self.batch_size = batch_size
+        self.pause = pause
+        # Каталог для архива удаляемых строк (NDJSON.gz); None - без архива
+        self.archive_dir = archive_dir
+        # Страниц за один шаг incremental_vacuum
+        self.vacuum_pages = vacuum_pages
+
+    def run(self) -> Dict:
+        from database import Database
+        # Создает activity_daily в базе, открытой впервые после обновления
+        Database(self.db_name)
+
+        cutoff = (datetime.now() - timedelta(days=self.days)).strftime('%Y-%m-%d')
+        result = {'cutoff': cutoff, 'deleted': 0, 'batches': 0, 'archive': None,
+                  'freed_pages': 0}
+
+        conn = connect(self.db_name, timeout=30)
+        cursor = conn.cursor()
+        # Отдельные подзапросы: MIN и MAX в одном SELECT читают всю таблицу
+        cursor.execute('''
+            SELECT (SELECT MIN(log_id) FROM activity_log),
+                   (SELECT MAX(log_id) FROM activity_log)
+        ''')
+        low, high = cursor.fetchone()
+
+        archive = None
+        if self.archive_dir and low is not None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            result['archive'] = os.path.join(
+                self.archive_dir,
+                f"activity_log_{cutoff}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
+            )
+            archive = gzip.open(result['archive'], 'at', encoding='utf-8')
+
+        started = time.perf_counter()
+        try:
+            # Строки, добавленные после начала очистки, новее cutoff - их не трогаем
+            while low is not None and low <= high:
+                upper = min(low + self.batch_size, high + 1)
+                deleted = self.clean_range(conn, low, upper, cutoff, archive)
+                if deleted:
+                    result['deleted'] += deleted
+                    result['batches'] += 1
+                    time.sleep(self.pause)
+                low = upper
+        finally:
+            if archive is not None:
+                archive.close()
+
+        result['freed_pages'] = self.incremental_vacuum(conn)
+        conn.close()
+        result['seconds'] = round(time.perf_counter() - started, 2)
+        return result
+
+    def clean_range(self, conn, low: int, upper: int, cutoff: str, archive) -> int:
+        cursor = conn.cursor()
+        bounds = (low, upper, cutoff)
+        if archive is not None:
+            # Старые строки не меняются: архив пишется до блокировки записи
+            cursor.execute('''
+                SELECT * FROM activity_log
+                WHERE log_id >= ? AND log_id < ? AND created_at < ?
+            ''', bounds)
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            for row in rows:
+                archive.write(json.dumps(dict(row), ensure_ascii=False) + '\n')
+            # Архив на диске раньше, чем строки удалены из базы
+            archive.flush()
+
+        # Блокировка записи берется сразу: между итогами и удалением строки не меняются
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('''
+                INSERT INTO activity_daily (user_id, day, activity_type, events, points)
+                SELECT user_id, DATE(created_at), activity_type, COUNT(*),
+                       IFNULL(SUM(points_earned), 0)
+                FROM activity_log
+                WHERE log_id >= ? AND log_id < ? AND created_at < ?
+                GROUP BY user_id, DATE(created_at), activity_type
+                ON CONFLICT(user_id, day, activity_type) DO UPDATE SET
+                    events = events + excluded.events,
+                    points = points + excluded.points
+            ''', bounds)
+            cursor.execute('''
+                DELETE FROM activity_log
+                WHERE log_id >= ? AND log_id < ? AND created_at < ?
+            ''', bounds)
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+        except Exception:
+            conn.rollback()
+            raise
+
+    def incremental_vacuum(self, conn) -> int:
+        """Возврат свободных страниц порциями; без auto_vacuum=INCREMENTAL - 0"""
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            return 0
+
+        cursor.execute('PRAGMA freelist_count')
+        before = free = cursor.fetchone()[0]
+        while free:
+            # Каждый шаг прагмы освобождает одну страницу, а execute делает
+            # только первый шаг; executescript выполняет порцию до конца
+            conn.executescript(f'PRAGMA incremental_vacuum({min(free, self.vacuum_pages)})')
+            cursor.execute('PRAGMA freelist_count')
+            remaining = cursor.fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+            if free:
+                time.sleep(self.pause)
+        return before - free
+
+    def enable_incremental_vacuum(self):
+        """
+        Перевод существующей базы на auto_vacuum=INCREMENTAL.
+        Выполняет полный VACUUM - только при остановленном боте
+        """
+        conn = connect(self.db_name, timeout=30)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.close()
@@ -62,8 +62,33 @@ def main():
     print("🚀 Запуск бота...")
     print("💡 Для остановки нажмите Ctrl+C\n")
     
+    if 'slow_query_ms' in config:
+        from db_connection import query_log
+        query_log.configure(threshold_ms=config['slow_query_ms'])
+    
+    if 'profiling' in config:
+        from profiling import profiler
+        profiling = config['profiling']
+        profiler.output_dir = profiling.get('output_dir', profiler.output_dir)
+        profiler.enable(profiling.get('sample_rate', profiler.sample_rate))
+        profiler.snapshot_interval = profiling.get('snapshot_interval',
+                                                 profiler.snapshot_interval)
+    
+    if 'cache' in config:
+        from cache import caches
+        caches.configure(config['cache'])
+    
     try:
-        bot = StudyBoostBot(config['bot_token'])
+        bot = StudyBoostBot(
+            config['bot_token'],
+            warm_up=config.get('warm_up', False),
+            metrics_port=config.get('metrics_port'),
+            admin_ids=config.get('admin_ids', []),
+            concurrent_updates=config.get('concurrent_updates', 0),
+            webhook=config.get('webhook'),
+            digest_time=config.get('digest_time', '09:00'),
+            record_updates=config.get('record_updates')
+        )
         bot.run()
     except KeyboardInterrupt:
         print("\n\n👋 Бот остановлен")
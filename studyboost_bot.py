@@ -6,15 +6,16 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
-from database import Database
-from gamification import GamificationSystem
-from pdf_generator import PDFGenerator
-from cloud_sync import CloudSync
-from quiz_system import QuizSystem
+from cache import caches
+from lazy_loader import ComponentRegistry
+from metrics import metrics, MetricsServer
+from profiling import profiler
 from datetime import datetime, timedelta
+import asyncio
 import random
 
 logging.basicConfig(
@@ -23,18 +24,56 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Типы обновлений, для которых есть обработчики: остальные Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 (CHOOSING_CATEGORY, ADDING_NOTE, SETTING_GOAL, 
  ADDING_DEADLINE, CHOOSING_SUBJECT, QUIZ_ANSWER,
  ADDING_SCHEDULE, SETTING_REMINDER) = range(8)
 
 class StudyBoostBot:
-    def __init__(self, token: str):
+    def __init__(self, token: str, warm_up: bool = False, upload_backends=None,
+                 metrics_port: int = None, admin_ids=None, concurrent_updates: int = 0,
+                 webhook: dict = None, digest_time: str = '09:00',
+                 record_updates: dict = None):
         self.token = token
-        self.db = Database()
-        self.gamification = GamificationSystem()
-        self.pdf_gen = PDFGenerator()
-        self.cloud = CloudSync()
-        self.quiz = QuizSystem()
+        # Запись обезличенных обновлений для воспроизведения (path, salt)
+        self.record_updates = record_updates
+        self.recorder = None
+        # Время ежедневного дайджеста (ЧЧ:ММ, часовой пояс сервера)
+        self.digest_time = digest_time
+        # Настройки webhook (url, secret_token, listen, port, path, queue_size);
+        # без них бот работает через long polling
+        self.webhook = webhook
+        # Сколько обновлений разных пользователей обрабатывать одновременно
+        # (0 - по одному, как раньше)
+        self.concurrent_updates = concurrent_updates
+        self.warm_up_on_start = warm_up
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.admin_ids = set(admin_ids or [])
+        # Хранилища для загрузок (по умолчанию - CloudSync, для тестов - LocalBackend)
+        self.upload_backends = upload_backends
+        self.uploader = None
+        self.sync_scheduler = None
+        self.outbox = None
+        self.digest = None
+        self.reminders = None
+        
+        # Тяжелые подсистемы (reportlab, Pillow, облако) загружаются
+        # при первом обращении, чтобы бот быстрее стартовал
+        self.components = ComponentRegistry()
+        self.components.register('db', 'database', 'Database')
+        self.components.register('gamification', 'gamification', 'GamificationSystem')
+        self.components.register('pdf_gen', 'pdf_generator', 'PDFGenerator')
+        self.components.register('cloud', 'cloud_sync', 'CloudSync')
+        self.components.register('quiz', 'quiz_system', 'QuizSystem')
+        self.components.register('thumbnails', 'thumbnails', 'ThumbnailCache')
+        
+        self.db = metrics.instrument_object(self.components.get('db'), 'Database')
+        self.gamification = metrics.instrument_object(
+            self.components.get('gamification'), 'GamificationSystem'
+        )
         
         self.daily_tips = [
             "💡 Техника Pomodoro: 25 минут работы + 5 минут отдыха!",
@@ -49,6 +88,79 @@ class StudyBoostBot:
             "👥 Объясняйте материал другим - лучший способ его понять!"
         ]
     
+    @property
+    def pdf_gen(self):
+        return self.components.get('pdf_gen')
+    
+    @property
+    def cloud(self):
+        return self.components.get('cloud')
+    
+    @property
+    def quiz(self):
+        return self.components.get('quiz')
+    
+    @property
+    def thumbnails(self):
+        return self.components.get('thumbnails')
+    
+    def warm_up(self, names=None):
+        """Заблаговременная загрузка ленивых компонентов"""
+        self.components.warm_up(names)
+        logger.info(self.components.format_report())
+    
+    async def post_init(self, application: Application):
+        logger.info(self.components.format_report())
+        await caches.start(self.db.db_name)
+        if self.metrics_port:
+            self.metrics_server = MetricsServer(metrics, port=self.metrics_port)
+            await self.metrics_server.start()
+            logger.info(f"Метрики: http://127.0.0.1:{self.metrics_port}/metrics")
+        if self.outbox is not None:
+            await self.outbox.start(application.bot)
+            
+            from reminders import ReminderEngine
+            self.reminders = ReminderEngine(self)
+            self.reminders.start()
+        if self.warm_up_on_start:
+            # Прогрев в фоне, чтобы не задерживать прием обновлений
+            asyncio.get_running_loop().run_in_executor(None, self.warm_up)
+    
+    async def post_stop(self, application: Application):
+        if self.reminders is not None:
+            await self.reminders.stop()
+        # Бот еще доступен: начатые отправки завершаются и отмечаются в БД
+        if self.outbox is not None:
+            await self.outbox.stop()
+    
+    async def post_shutdown(self, application: Application):
+        if self.uploader is not None:
+            await self.uploader.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await caches.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        # Накопленные профили не должны теряться при остановке
+        await asyncio.to_thread(profiler.dump)
+    
+    async def get_uploader(self):
+        """Пул загрузок создается при первой синхронизации"""
+        if self.uploader is None:
+            from cloud_uploader import AsyncUploader, CloudSyncBackend
+            
+            backends = self.upload_backends or {
+                service: CloudSyncBackend(self.cloud, service)
+                for service in ('google_drive', 'dropbox')
+            }
+            self.uploader = AsyncUploader(
+                backends,
+                workers=4,
+                rate_limits={'google_drive': 10, 'dropbox': 10}
+            )
+            await self.uploader.start()
+        return self.uploader
+    
     def get_main_menu_keyboard(self):
         keyboard = [
             ['📝 Добавить заметку', '📚 Мои заметки'],
@@ -93,13 +205,12 @@ class StudyBoostBot:
             
             self.gamification.add_points(user_id, 10, "Регистрация")
         else:
-            level = self.gamification.get_user_level(user_id)
-            points = self.gamification.get_user_points(user_id)
+            dashboard = self.db.get_dashboard(user_id)
             
             await update.message.reply_text(
                 f"С возвращением, {user.first_name}! 🎓\n\n"
-                f"🏆 Уровень: {level}\n"
-                f"⭐ Баллы: {points}\n\n"
+                f"🏆 Уровень: {dashboard['current_level']}\n"
+                f"⭐ Баллы: {dashboard['total_points']}\n\n"
                 f"Готов продолжить учебу?",
                 reply_markup=self.get_main_menu_keyboard()
             )
@@ -225,6 +336,7 @@ class StudyBoostBot:
             note_data['type'] = 'photo'
             photo = update.message.photo[-1]
             note_data['file_id'] = photo.file_id
+            note_data['file_unique_id'] = photo.file_unique_id
             note_data['content'] = update.message.caption or ''
             note_data['tags'] = [word for word in (update.message.caption or '').split() if word.startswith('#')]
         
@@ -303,24 +415,27 @@ class StudyBoostBot:
     async def show_goals(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        stats = self.db.get_user_stats(user_id)
-        level = self.gamification.get_user_level(user_id)
-        points = self.gamification.get_user_points(user_id)
+        dashboard = self.db.get_dashboard(user_id)
+        if dashboard is None:
+            await update.message.reply_text("Сначала нажми /start")
+            return
+        level = dashboard['current_level']
+        points = dashboard['total_points']
         next_level_points = (level + 1) * 100
         progress = (points % 100) / 100 * 10
         
         progress_bar = "▰" * int(progress) + "▱" * (10 - int(progress))
         
-        goals = self.db.get_user_goals(user_id)
-        active_goals = [g for g in goals if not g.get('completed')]
-        completed_today = [g for g in goals if g.get('completed_today')]
+        active_goals = dashboard['active_goals']
+        completed_today = dashboard['completed_today']
         
         goals_text = ""
         if active_goals:
             goals_text = "\n\n*Активные цели:*\n"
-            for goal in active_goals[:5]:
-                status = "✅" if goal.get('completed_today') else "⬜"
-                goals_text += f"{status} {goal['title']}\n"
+            for goal in active_goals:
+                goals_text += f"⬜ {goal['title']}\n"
+            for goal in completed_today:
+                goals_text += f"✅ {goal['title']}\n"
         
         keyboard = [
             [InlineKeyboardButton("➕ Добавить цель", callback_data='add_goal')],
@@ -335,9 +450,9 @@ class StudyBoostBot:
             f"🏆 Уровень: {level}\n"
             f"⭐ Баллы: {points}/{next_level_points}\n"
             f"{progress_bar}\n\n"
-            f"📝 Заметок создано: {stats.get('total_notes', 0)}\n"
+            f"📝 Заметок создано: {dashboard['total_notes']}\n"
             f"✅ Целей выполнено сегодня: {len(completed_today)}\n"
-            f"🔥 Дней подряд: {stats.get('streak', 0)}"
+            f"🔥 Дней подряд: {dashboard['streak']}"
             f"{goals_text}",
             parse_mode='Markdown',
             reply_markup=reply_markup
@@ -559,7 +674,7 @@ class StudyBoostBot:
     
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        stats = self.db.get_detailed_stats(user_id)
+        stats = self.db.get_detailed_stats(user_id, use_cache=True)
         
         await update.message.reply_text(
             f"📊 *Твоя статистика*\n\n"
@@ -578,6 +693,83 @@ class StudyBoostBot:
             parse_mode='Markdown'
         )
     
+    async def schedule_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        version = self.db.get_schedule_version(user_id)
+        export = self.db.get_schedule_export(user_id)
+        
+        # Расписание не менялось - отправляем уже загруженный в Telegram файл
+        if export and export['version'] == version and export['file_id']:
+            await update.message.reply_document(
+                document=export['file_id'],
+                caption="📅 Твое расписание"
+            )
+            return
+        
+        schedule = self.db.get_schedule(user_id)
+        if not schedule:
+            await update.message.reply_text(
+                "📭 Расписание пока пустое.\n"
+                "Добавь занятия в разделе ⚙️ Настройки → 📅 Настроить расписание",
+                reply_markup=self.get_main_menu_keyboard()
+            )
+            return
+        
+        # Рендер reportlab занимает заметное время - не блокируем цикл
+        pdf_path = await asyncio.to_thread(
+            self.pdf_gen.get_schedule_pdf, user_id, schedule, version,
+            update.effective_user.first_name, export['file_path'] if export else None
+        )
+        
+        with open(pdf_path, 'rb') as document:
+            message = await update.message.reply_document(
+                document=document,
+                caption="📅 Твое расписание"
+            )
+        
+        self.db.save_schedule_export(user_id, version, pdf_path, 
+                                     message.document.file_id)
+    
+    async def perf_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user.id not in self.admin_ids:
+            return
+        await update.message.reply_text(
+            f"{metrics.format_summary()}\n\n{caches.format_stats()}"
+        )
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/profile on [доля] | off | mem [интервал] | nomem | dump | snapshot"""
+        if update.effective_user.id not in self.admin_ids:
+            return
+        
+        args = context.args or []
+        action = args[0] if args else 'status'
+        
+        try:
+            if action == 'on':
+                profiler.enable(float(args[1]) if len(args) > 1 else 0.05)
+            elif action == 'off':
+                profiler.disable()
+            elif action == 'mem':
+                profiler.enable_memory(float(args[1]) if len(args) > 1 else 300)
+            elif action == 'nomem':
+                profiler.disable_memory()
+            elif action == 'dump':
+                paths = await asyncio.to_thread(profiler.dump)
+                await update.message.reply_text(f"💾 Записано файлов: {len(paths)}")
+                return
+            elif action == 'snapshot':
+                path = await asyncio.to_thread(profiler.snapshot)
+                await update.message.reply_text(
+                    f"💾 Снимок памяти: {path}" if path else "tracemalloc выключен"
+                )
+                return
+        except ValueError:
+            await update.message.reply_text("❌ Неверный аргумент")
+            return
+        
+        await update.message.reply_text(profiler.format_status())
+    
     async def callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         data = query.data
@@ -596,6 +788,10 @@ class StudyBoostBot:
             return await self.sync_cloud_callback(update, context)
         elif data == 'view_achievements':
             return await self.view_achievements(update, context)
+        elif data == 'toggle_cloud':
+            return await self.toggle_cloud_callback(update, context)
+        elif data == 'toggle_notifications':
+            return await self.toggle_notifications_callback(update, context)
         
         await query.answer()
     
@@ -606,38 +802,115 @@ class StudyBoostBot:
         user_id = query.from_user.id
         username = query.from_user.first_name
         notes = self.db.get_user_notes(user_id)
+        from thumbnails import TelegramDownloader
+        thumbnails = await self.thumbnails.prepare(notes, TelegramDownloader(context.bot))
         
-        pdf_path = self.pdf_gen.create_notes_pdf(user_id, notes, username=username)
+        pdf_path = self.pdf_gen.create_notes_pdf(user_id, notes, username=username,
+                                                 thumbnails=thumbnails)
         
         await query.message.reply_document(
             document=open(pdf_path, 'rb'),
             caption="📄 Твой конспект готов!\n\n"
                    "Можешь сохранить его или распечатать 📚"
         )
+        
+        await self.backup_export(user_id, pdf_path,
+                                 content_key=self.pdf_gen.notes_digest(notes, username=username))
+    
+    async def backup_export(self, user_id: int, file_path: str, service: str = 'google_drive',
+                            content_key: str = None):
+        """Фоновая копия экспорта в облако (экспорт тех же данных не загружается повторно)"""
+        settings = self.db.get_user_settings(user_id)
+        if not settings.get('cloud_sync') or not self.cloud.is_connected(user_id, service):
+            return
+        
+        batch = await asyncio.to_thread(self.cloud.prepare_file_sync, user_id, file_path,
+                                        service, content_key)
+        if batch is None:
+            return
+        
+        async def on_done(job, success):
+            if success:
+                await asyncio.to_thread(self.cloud.commit_sync, batch)
+        
+        from cloud_uploader import UploadJob
+        uploader = await self.get_uploader()
+        try:
+            uploader.submit(UploadJob(user_id, service, batch['files'], on_done=on_done,
+                                      artifact=batch['artifact']))
+        except asyncio.QueueFull:
+            pass
     
     async def sync_cloud_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         user_id = query.from_user.id
+        service = 'google_drive'
         
-        if not self.cloud.is_connected(user_id):
+        if not self.cloud.is_connected(user_id, service):
             await query.answer("Сначала подключи облако в настройках!", show_alert=True)
             return
         
+        uploader = await self.get_uploader()
+        if self.sync_in_progress(user_id, service):
+            await query.answer("Синхронизация уже идет ⏳")
+            return
+        
+        batch = await asyncio.to_thread(self.cloud.prepare_sync, user_id, self.db, service)
+        if batch is None:
+            await query.answer("✅ Все заметки уже в облаке")
+            return
+        if self.sync_in_progress(user_id, service):
+            await query.answer("Синхронизация уже идет ⏳")
+            return
+        
         await query.answer("Синхронизация...")
+        chat_id = query.message.chat_id
         
-        notes = self.db.get_user_notes(user_id)
-        notes_data = {
-            'user_id': user_id,
-            'timestamp': datetime.now().isoformat(),
-            'notes': notes
-        }
+        async def on_done(job, success):
+            # Сообщаем результат, когда загрузка завершится в фоне
+            if success:
+                await asyncio.to_thread(self.cloud.commit_sync, batch, self.db)
+                await context.bot.send_message(chat_id, "✅ Заметки синхронизированы с облаком!")
+            else:
+                await context.bot.send_message(chat_id, "❌ Ошибка синхронизации. Попробуй позже.")
         
-        success = self.cloud.sync_notes(user_id, notes_data)
+        from cloud_uploader import UploadJob
+        try:
+            uploader.submit(UploadJob(user_id, service, batch['files'], on_done=on_done,
+                                      obsolete=batch['obsolete']))
+        except asyncio.QueueFull:
+            await query.message.reply_text("⏳ Облако перегружено. Попробуй позже.")
+    
+    def sync_in_progress(self, user_id: int, service: str) -> bool:
+        if self.uploader is not None and self.uploader.is_pending(user_id, service):
+            return True
+        return self.sync_scheduler is not None and self.sync_scheduler.is_scheduled(user_id)
+    
+    async def toggle_cloud_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        user_id = query.from_user.id
         
-        if success:
-            await query.message.reply_text("✅ Заметки синхронизированы с облаком!")
+        settings = self.db.get_user_settings(user_id)
+        settings['cloud_sync'] = not settings.get('cloud_sync', False)
+        self.db.update_user_settings(user_id, settings)
+        
+        if settings['cloud_sync']:
+            await query.answer("☁️ Автосинхронизация включена")
         else:
-            await query.message.reply_text("❌ Ошибка синхронизации. Попробуй позже.")
+            await query.answer("❌ Автосинхронизация выключена")
+    
+    async def toggle_notifications_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        user_id = query.from_user.id
+        
+        settings = self.db.get_user_settings(user_id)
+        settings['notifications'] = not settings.get('notifications', True)
+        self.db.update_user_settings(user_id, settings)
+        
+        if settings['notifications']:
+            await query.answer("🔔 Ежедневный дайджест включен")
+        else:
+            await query.answer("🔕 Уведомления выключены")
     
     async def view_achievements(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
@@ -658,8 +931,32 @@ class StudyBoostBot:
         
         await query.edit_message_text(text, parse_mode='Markdown')
     
-    def run(self):
-        application = Application.builder().token(self.token).build()
+    def build_application(self) -> Application:
+        builder = (
+            Application.builder()
+            .token(self.token)
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+        )
+        
+        # Очередь исходящих сообщений: рассылки и напоминания с учетом лимитов
+        # Telegram; ответы обработчиков проходят через тот же ограничитель
+        from outbox import Outbox
+        self.outbox = Outbox(self.db.db_name)
+        builder = builder.rate_limiter(self.outbox.rate_limiter)
+        if self.concurrent_updates > 1:
+            from update_processor import PerUserUpdateProcessor
+            # Обновления одного пользователя идут по очереди, разных - параллельно
+            builder = builder.concurrent_updates(
+                PerUserUpdateProcessor(self.concurrent_updates)
+            )
+        if self.webhook:
+            # Обновления приходят от WebhookServer, очередь ограничена
+            builder = builder.updater(None).update_queue(
+                asyncio.Queue(maxsize=self.webhook.get('queue_size', 1000))
+            )
+        application = builder.build()
         
         note_handler = ConversationHandler(
             entry_points=[MessageHandler(filters.Regex('^📝 Добавить заметку$'), 
@@ -689,14 +986,101 @@ class StudyBoostBot:
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("stats", self.stats_command))
+        application.add_handler(CommandHandler("schedule", self.schedule_command))
+        application.add_handler(CommandHandler("perf", self.perf_command))
+        application.add_handler(CommandHandler("profile", self.profile_command))
         application.add_handler(note_handler)
         application.add_handler(quiz_handler)
         application.add_handler(CallbackQueryHandler(self.callback_handler))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, 
                                               self.button_handler))
         
+        if application.job_queue is not None:
+            from sync_scheduler import SyncScheduler
+            self.sync_scheduler = SyncScheduler(self)
+            self.sync_scheduler.start(application.job_queue)
+            
+            from broadcast import DigestBroadcast
+            # JobQueue считает время без часового пояса как UTC
+            send_time = datetime.strptime(self.digest_time, '%H:%M').time().replace(
+                tzinfo=datetime.now().astimezone().tzinfo
+            )
+            self.digest = DigestBroadcast(self, send_time=send_time)
+            self.digest.start(application.job_queue)
+        else:
+            logger.warning("JobQueue недоступна: фоновая синхронизация и рассылки отключены "
+                           "(установите python-telegram-bot[job-queue])")
+        
+        # Замер времени и SQL-запросов каждого обработчика
+        metrics.profiler = profiler
+        metrics.instrument_application(application)
+        profiler.start(application.job_queue)
+        
+        if self.record_updates:
+            from recorder import UpdateRecorder
+            # Группа -1 выполняется раньше остальных; запись не входит в замеры
+            menu = self.get_main_menu_keyboard().keyboard
+            self.recorder = UpdateRecorder(
+                self.record_updates.get('path', 'updates.ndjson.gz'),
+                salt=self.record_updates.get('salt'),
+                keep_texts=[button.text for row in menu for button in row]
+            )
+            application.add_handler(TypeHandler(Update, self.recorder.record), group=-1)
+        return application
+    
+    def run(self):
+        application = self.build_application()
         logger.info("StudyBoost запущен!")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if self.webhook:
+            asyncio.run(self.run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
+    
+    async def run_webhook(self, application: Application):
+        """Работа через webhook до SIGINT/SIGTERM"""
+        import secrets
+        import signal
+        from webhook_server import WebhookServer
+        
+        # Без заданного секрета генерируем новый: Telegram получит его в setWebhook
+        secret_token = self.webhook.get('secret_token') or secrets.token_urlsafe(32)
+        server = WebhookServer(
+            application, secret_token,
+            host=self.webhook.get('listen', '127.0.0.1'),
+            port=self.webhook.get('port', 8443),
+            path=self.webhook.get('path', '/telegram')
+        )
+        
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        
+        # Без Updater методы post_init/post_shutdown вызываются вручную
+        await application.initialize()
+        try:
+            await self.post_init(application)
+            await application.start()
+            await server.start()
+            if self.webhook.get('url'):
+                await application.bot.set_webhook(
+                    self.webhook['url'],
+                    allowed_updates=ALLOWED_UPDATES,
+                    secret_token=secret_token,
+                    max_connections=self.webhook.get('max_connections', 40)
+                )
+            logger.info(f"Webhook: http://{server.host}:{server.port}{server.path}")
+            await stop.wait()
+        finally:
+            # Webhook не удаляем: Telegram придержит обновления до перезапуска
+            await server.stop()
+            if application.running:
+                await application.stop()
+                await self.post_stop(application)
+            await application.shutdown()
+            await self.post_shutdown(application)
+            logger.info(f"Webhook: принято {server.accepted}, "
+                        f"отклонено из-за переполнения {server.rejected}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+"""
+Фоновая синхронизация заметок с облаком
+Пользователи с включенной синхронизацией выбираются из очереди sync_pending
+и равномерно распределяются по интервалу планировщика
+"""
+
+import asyncio
+import logging
+import random
+
+from cloud_uploader import UploadJob
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ('google_drive', 'dropbox')
+
+
+class SyncScheduler:
+    def __init__(self, bot, interval: float = 300, batch_size: int = 200,
+                 max_in_flight: int = 100):
+        self.bot = bot
+        self.interval = interval
+        self.batch_size = batch_size
+        # Общий бюджет одновременных загрузок (включая ручные)
+        self.max_in_flight = max_in_flight
+        self.scheduled = set()
+
+    def is_scheduled(self, user_id: int) -> bool:
+        return user_id in self.scheduled
+
+    def start(self, job_queue):
+        job_queue.run_repeating(self.tick, interval=self.interval, 
+                                first=self.interval, name='cloud_sync')
+
+    async def tick(self, context):
+        uploader = await self.bot.get_uploader()
+        budget = self.max_in_flight - len(uploader.pending) - len(self.scheduled)
+        if budget <= 0:
+            logger.info("Фоновая синхронизация пропущена: бюджет загрузок исчерпан")
+            return
+
+        db = self.bot.db
+        cloud = self.bot.cloud
+        user_ids = await asyncio.to_thread(db.get_pending_sync_users, 
+                                           min(budget, self.batch_size))
+
+        by_service = {}
+        disconnected = []
+        for user_id in user_ids:
+            if user_id in self.scheduled:
+                continue
+            service = next((s for s in SERVICES if cloud.is_connected(user_id, s)), None)
+            if service is None:
+                disconnected.append(user_id)
+            elif not uploader.is_pending(user_id, service):
+                by_service.setdefault(service, []).append(user_id)
+
+        # Без подключенного облака синхронизировать некуда
+        for user_id in disconnected:
+            await asyncio.to_thread(db.clear_sync_pending, user_id)
+
+        batches = []
+        for service, service_users in by_service.items():
+            service_batches = await asyncio.to_thread(
+                cloud.prepare_sync_many, service_users, db, service
+            )
+            batches.extend(service_batches)
+            prepared = {batch['user_id'] for batch in service_batches}
+            idle = [user_id for user_id in service_users if user_id not in prepared]
+            await asyncio.to_thread(db.clear_synced_pending, idle, service)
+
+        # Разносим загрузки по интервалу, чтобы не создавать пиков
+        for i, batch in enumerate(batches):
+            when = (i + random.random()) * self.interval / len(batches)
+            self.scheduled.add(batch['user_id'])
+            context.job_queue.run_once(self.submit, when, data=batch,
+                                       name=f"cloud_sync_{batch['user_id']}")
+
+        if batches:
+            logger.info(f"Фоновая синхронизация: запланировано {len(batches)} загрузок")
+
+    async def submit(self, context):
+        batch = context.job.data
+        self.scheduled.discard(batch['user_id'])
+        uploader = await self.bot.get_uploader()
+
+        async def on_done(job, success):
+            if success:
+                await asyncio.to_thread(self.bot.cloud.commit_sync, batch, self.bot.db)
+            else:
+                logger.warning(f"Фоновая синхронизация пользователя {job.user_id} "
+                               f"не удалась: {job.error}")
+
+        try:
+            uploader.submit(UploadJob(batch['user_id'], batch['service'], batch['files'],
+                                      on_done=on_done, obsolete=batch['obsolete']))
+        except asyncio.QueueFull:
+            # Пользователь остается в sync_pending и попадет в следующий тик
+            pass
@@ -0,0 +1,168 @@
+"""
+Модуль миниатюр фотозаметок для PDF экспорта
+Скачивает фото параллельно, уменьшает их в отдельных процессах
+и хранит результат в контентно-адресуемом кэше на диске
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+
+def make_thumbnail(data: bytes, max_size: int = 800, quality: int = 75) -> bytes:
+    """
+    Уменьшение и пережатие изображения в JPEG
+
+    Выполняется в рабочем процессе, поэтому функция должна
+    оставаться на уровне модуля (pickle)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class TelegramDownloader:
+    """Загрузка файлов через Telegram Bot API"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def download(self, file_id: str) -> bytes:
+        telegram_file = await self.bot.get_file(file_id)
+        return bytes(await telegram_file.download_as_bytearray())
+
+
+class LocalDownloader:
+    """Загрузка файлов из локальной папки (для тестов и примеров)"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def download(self, file_id: str) -> bytes:
+        path = os.path.join(self.directory, file_id)
+        return await asyncio.to_thread(self._read, path)
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir: str = 'pdf_exports/thumbnails',
+                 max_size: int = 800, quality: int = 75,
+                 max_downloads: int = 8, workers: int = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.quality = quality
+        self.max_downloads = max_downloads
+        self.workers = workers
+        self._executor = None
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Пул процессов создается при первой необходимости"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def cache_path(self, cache_key: str) -> str:
+        """Путь к миниатюре в кэше по ключу файла"""
+        digest = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.jpg')
+
+    @staticmethod
+    def cache_key(note: Dict) -> str:
+        # file_unique_id одинаков для одного файла у всех ботов и не меняется,
+        # file_id используется как запасной вариант для старых заметок
+        return note.get('file_unique_id') or note.get('file_id') or ''
+
+    def get_cached(self, note: Dict) -> Optional[str]:
+        key = self.cache_key(note)
+        if not key:
+            return None
+        path = self.cache_path(key)
+        return path if os.path.exists(path) else None
+
+    async def prepare(self, notes: List[Dict], downloader) -> Dict[str, str]:
+        """
+        Подготовка миниатюр для фотозаметок
+
+        Args:
+            notes: Список заметок
+            downloader: Объект с методом async download(file_id) -> bytes
+
+        Returns:
+            Словарь file_id -> путь к миниатюре
+        """
+        thumbnails = {}
+        missing = {}
+
+        for note in notes:
+            if note.get('note_type') != 'photo' or not note.get('file_id'):
+                continue
+            cached = self.get_cached(note)
+            if cached:
+                thumbnails[note['file_id']] = cached
+            else:
+                missing.setdefault(self.cache_key(note), note)
+
+        if not missing:
+            return thumbnails
+
+        semaphore = asyncio.Semaphore(self.max_downloads)
+        results = await asyncio.gather(
+            *(self._build(key, note, downloader, semaphore)
+              for key, note in missing.items()),
+            return_exceptions=True
+        )
+
+        for note, result in zip(missing.values(), results):
+            if isinstance(result, Exception):
+                print(f"Ошибка подготовки миниатюры {note['file_id']}: {result}")
+                continue
+            thumbnails[note['file_id']] = result
+
+        # Одинаковые фото в разных заметках используют одну миниатюру
+        for note in notes:
+            if note.get('note_type') == 'photo' and note.get('file_id') not in thumbnails:
+                cached = self.get_cached(note)
+                if cached:
+                    thumbnails[note['file_id']] = cached
+
+        return thumbnails
+
+    async def _build(self, key: str, note: Dict, downloader,
+                     semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            data = await downloader.download(note['file_id'])
+
+        loop = asyncio.get_running_loop()
+        thumbnail = await loop.run_in_executor(
+            self.get_executor(), make_thumbnail, data, self.max_size, self.quality
+        )
+
+        path = self.cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл, чтобы параллельный экспорт
+        # не прочитал недописанную миниатюру
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(thumbnail)
+        os.replace(temp_path, path)
+        return path
@@ -0,0 +1,71 @@
+"""
+Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+Обновления разных пользователей выполняются одновременно (до лимита),
+обновления одного пользователя - строго по очереди, поэтому диалоги
+ConversationHandler (заметки, викторины) не ломаются
+"""
+
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import metrics
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = 32, max_pending_updates: int = 1000):
+        # Семафор базового класса ограничивает число принятых обновлений
+        # (включая ожидающие своей очереди), собственный - число выполняемых.
+        # Так серия сообщений одного пользователя не занимает слоты остальных
+        super().__init__(max_pending_updates)
+        self.max_running = max_concurrent_updates
+        self._running = None
+        # ключ -> [блокировка, число обновлений в очереди]
+        self._queues = {}
+
+    async def initialize(self):
+        self._running = asyncio.Semaphore(self.max_running)
+
+    async def shutdown(self):
+        self._queues.clear()
+
+    @staticmethod
+    def queue_key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    def queued(self, key) -> int:
+        entry = self._queues.get(key)
+        return entry[1] if entry else 0
+
+    async def do_process_update(self, update: object, coroutine):
+        key = self.queue_key(update)
+        started = time.perf_counter()
+
+        if key is None:
+            async with self._running:
+                metrics.update_wait_seconds.observe(time.perf_counter() - started)
+                await coroutine
+            return
+
+        entry = self._queues.get(key)
+        if entry is None:
+            entry = self._queues[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке поступления
+            async with entry[0]:
+                async with self._running:
+                    metrics.update_wait_seconds.observe(time.perf_counter() - started)
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._queues[key]
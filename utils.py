@@ -1,116 +1,182 @@
-import sqlite3
 import json
 from datetime import datetime
 import os
 
+from db_connection import connect
+
 class BotUtils:
     def __init__(self, db_name='studyboost.db'):
         self.db_name = db_name
     
-    def backup_database(self):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_name = f'backup_{timestamp}.db'
+    def backup_database(self, incremental=False):
+        """Резервная копия без остановки бота (см. backup.BackupManager)"""
+        from backup import BackupError, BackupManager
+        
+        try:
+            entry = BackupManager(self.db_name).backup(incremental=incremental)
+        except BackupError as e:
+            print(f"❌ {e}")
+            return None
         
-        if os.path.exists(self.db_name):
-            import shutil
-            shutil.copy2(self.db_name, backup_name)
-            print(f"✅ Резервная копия создана: {backup_name}")
-            return backup_name
-        else:
-            print("❌ База данных не найдена")
+        details = (f"изменено страниц: {entry['changed_pages']} из {entry['page_count']}"
+                   if entry['kind'] == 'delta' else f"страниц: {entry['page_count']}")
+        print(f"✅ Резервная копия создана: {entry['name']} "
+              f"({entry['size'] / 1024 / 1024:.1f} МБ, {details}, {entry['seconds']} с)")
+        return entry['name']
+    
+    def verify_backup(self, name=None):
+        from backup import BackupError, BackupManager
+        
+        try:
+            entry = BackupManager(self.db_name).verify(name)
+        except BackupError as e:
+            print(f"❌ {e}")
+            return False
+        print(f"✅ Копия {entry['name']} восстанавливается, integrity_check: ok")
+        return True
+    
+    def restore_backup(self, target, name=None):
+        from backup import BackupError, BackupManager
+        
+        if os.path.exists(target):
+            print(f"❌ Файл {target} уже существует")
             return None
+        try:
+            entry = BackupManager(self.db_name).restore(name, target)
+        except BackupError as e:
+            print(f"❌ {e}")
+            return None
+        print(f"✅ База восстановлена из {entry['name']}: {target}")
+        return target
     
     def export_user_data(self, user_id, output_file=None):
+        """Все данные пользователя одним JSON-документом (строки пишутся потоком)"""
+        from database import Database
+        from exporter import EXPORT_TABLES, iter_rows, write_document
+        
         if not output_file:
             output_file = f'user_{user_id}_export_{datetime.now().strftime("%Y%m%d")}.json'
         
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        data = {
-            'user_id': user_id,
-            'export_date': datetime.now().isoformat(),
-            'user_info': {},
-            'notes': [],
-            'goals': [],
-            'achievements': [],
-            'stats': {}
-        }
-        
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user_row = cursor.fetchone()
-        if user_row:
-            data['user_info'] = dict(user_row)
-        
-        cursor.execute('SELECT * FROM notes WHERE user_id = ?', (user_id,))
-        for row in cursor.fetchall():
-            data['notes'].append(dict(row))
-        
-        cursor.execute('SELECT * FROM goals WHERE user_id = ?', (user_id,))
-        for row in cursor.fetchall():
-            data['goals'].append(dict(row))
-        
-        cursor.execute('SELECT * FROM achievements WHERE user_id = ?', (user_id,))
-        for row in cursor.fetchall():
-            data['achievements'].append(dict(row))
-        
-        conn.close()
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # Таблицы, появившиеся после обновления, создаются до чтения
+        Database(self.db_name)
+        conn = connect(self.db_name)
+        # Одна транзакция чтения: таблицы документа согласованы между собой
+        conn.execute('BEGIN')
+        temp_path = output_file + '.part'
+        try:
+            user_row = conn.execute('SELECT * FROM users WHERE user_id = ?',
+                                    (user_id,)).fetchone()
+            header = {
+                'user_id': user_id,
+                'export_date': datetime.now().isoformat(),
+                'user_info': dict(user_row) if user_row else {},
+            }
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                write_document(f, header, {
+                    table: iter_rows(conn, table, user_id, user_id + 1)
+                    for table in EXPORT_TABLES if table != 'users'
+                })
+            # Недописанный файл не появляется под итоговым именем
+            os.replace(temp_path, output_file)
+        finally:
+            conn.rollback()
+            conn.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
         
         print(f"✅ Данные пользователя экспортированы: {output_file}")
         return output_file
     
-    def get_statistics(self):
-        conn = sqlite3.connect(self.db_name)
+    def export_all(self, directory=None, layout='tables', compress=True, workers=None):
+        """Выгрузка всей базы пулом процессов (см. exporter.DataExporter)"""
+        from exporter import DataExporter
+        
+        exporter = DataExporter(self.db_name, directory, layout=layout,
+                                compress=compress, workers=workers)
+        manifest = exporter.run()
+        
+        print(f"✅ Выгрузка: {exporter.directory} ({len(manifest['files'])} файлов, "
+              f"{len(manifest['partitions'])} диапазонов, {manifest['seconds']} с)")
+        for table, rows in manifest['totals'].items():
+            print(f"  {table}: {rows}")
+        return manifest
+    
+    def get_statistics(self, exact=False):
+        """
+        Общая статистика по счетчикам global_counters (их ведут триггеры).
+        exact=True - полный пересчет по таблицам (долго на большой базе)
+        """
+        from database import Database, GLOBAL_COUNTS_SQL
+        # Создает global_counters в базе, открытой впервые после обновления
+        Database(self.db_name)
+        
+        conn = connect(self.db_name)
         cursor = conn.cursor()
+        if exact:
+            cursor.execute(GLOBAL_COUNTS_SQL)
+        else:
+            cursor.execute('SELECT name, value FROM global_counters')
+        counters = {row[0]: row[1] for row in cursor.fetchall()}
+        conn.close()
         
+        return self.format_counters(counters)
+    
+    @staticmethod
+    def format_counters(counters):
         stats = {}
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        stats['total_users'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM notes')
-        stats['total_notes'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM goals')
-        stats['total_goals'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM achievements')
-        stats['total_achievements'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(total_points) FROM users')
-        result = cursor.fetchone()[0]
-        stats['total_points'] = result if result else 0
-        
-        cursor.execute('''
-            SELECT note_type, COUNT(*) 
-            FROM notes 
-            GROUP BY note_type
-        ''')
-        stats['notes_by_type'] = {}
-        for row in cursor.fetchall():
-            stats['notes_by_type'][row[0]] = row[1]
-        
-        cursor.execute('''
-            SELECT category, COUNT(*) 
-            FROM notes 
-            GROUP BY category 
-            ORDER BY COUNT(*) DESC 
-            LIMIT 5
-        ''')
-        stats['top_categories'] = {}
-        for row in cursor.fetchall():
-            stats['top_categories'][row[0]] = row[1]
-        
+        for name in ('total_users', 'total_notes', 'total_goals',
+                     'total_achievements', 'total_points'):
+            stats[name] = counters.get(name, 0)
+        
+        def group(prefix):
+            items = [(name[len(prefix):] or None, value)
+                     for name, value in counters.items()
+                     if name.startswith(prefix) and value > 0]
+            return sorted(items, key=lambda item: item[1], reverse=True)
+        
+        stats['notes_by_type'] = dict(group('note_type:'))
+        stats['top_categories'] = dict(group('category:')[:5])
+        return stats
+    
+    def reconcile_statistics(self):
+        """
+        Исправление расхождений global_counters с таблицами.
+        Пересчет идет под блокировкой записи, чтобы счетчики не изменились
+        между подсчетом и исправлением
+        """
+        from database import Database, GLOBAL_COUNTS_SQL
+        Database(self.db_name)
+        
+        conn = connect(self.db_name, timeout=60)
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT name, value FROM global_counters')
+        stored = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor.execute(GLOBAL_COUNTS_SQL)
+        exact = {row[0]: row[1] for row in cursor.fetchall()}
+        
+        drift = {}
+        for name in sorted(set(stored) | set(exact)):
+            difference = stored.get(name, 0) - exact.get(name, 0)
+            if difference:
+                drift[name] = difference
+        
+        cursor.execute('DELETE FROM global_counters')
+        cursor.executemany('INSERT INTO global_counters (name, value) VALUES (?, ?)',
+                           exact.items())
+        conn.commit()
         conn.close()
         
-        return stats
+        if drift:
+            print(f"⚠️  Исправлено счетчиков: {len(drift)}")
+            for name, difference in drift.items():
+                print(f"  {name}: {stored.get(name, 0)} → {exact.get(name, 0)}")
+        else:
+            print("✅ Счетчики совпадают с данными")
+        return drift
     
-    def print_statistics(self):
-        stats = self.get_statistics()
+    def print_statistics(self, exact=False):
+        stats = self.get_statistics(exact)
         
         print("\n📊 Общая статистика бота")
         print("=" * 50)
@@ -129,24 +195,96 @@ class BotUtils:
             print(f"  {i}. {category}: {count}")
         print()
     
-    def clean_old_data(self, days=90):
-        from datetime import timedelta
-        
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM activity_log 
-            WHERE created_at < ?
-        ''', (cutoff_date.strftime('%Y-%m-%d'),))
-        
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
+    def clean_old_data(self, days=90, archive_dir=None):
+        """Очистка activity_log порциями с дневными итогами (см. retention.py)"""
+        from retention import ActivityRetention
+        
+        result = ActivityRetention(self.db_name, days=days, archive_dir=archive_dir).run()
+        if result['deleted']:
+            self.publish_invalidations(['activity_log', 'activity_daily'])
+        
+        print(f"✅ Удалено старых записей активности: {result['deleted']} "
+              f"(до {result['cutoff']}, транзакций: {result['batches']}, {result['seconds']} с)")
+        if result['archive']:
+            print(f"📦 Архив: {result['archive']}")
+        if result['freed_pages']:
+            print(f"💾 Освобождено страниц: {result['freed_pages']}")
+        return result['deleted']
+    
+    def enable_incremental_vacuum(self):
+        from retention import ActivityRetention
         
-        print(f"✅ Удалено старых записей активности: {deleted}")
+        print("⚠️  Полный VACUUM: бот должен быть остановлен")
+        confirm = input("Введите 'ПОДТВЕРДИТЬ' для продолжения: ")
+        if confirm != 'ПОДТВЕРДИТЬ':
+            print("❌ Отменено")
+            return
+        ActivityRetention(self.db_name).enable_incremental_vacuum()
+        print("✅ База переведена на auto_vacuum=INCREMENTAL")
+    
+    def prerender_schedules(self):
+        from database import Database
+        from pdf_generator import PDFGenerator
+        
+        db = Database(self.db_name)
+        pdf_gen = PDFGenerator()
+        
+        rendered = 0
+        skipped = 0
+        for user in db.get_users_with_schedule():
+            user_id = user['user_id']
+            version = user['schedule_version'] or 0
+            export = db.get_schedule_export(user_id)
+            
+            if (export and export['version'] == version 
+                    and os.path.exists(export['file_path'] or '')):
+                skipped += 1
+                continue
+            
+            pdf_path = pdf_gen.get_schedule_pdf(
+                user_id, db.get_schedule(user_id), version,
+                username=user['first_name'] or 'Студент',
+                previous=export['file_path'] if export else None
+            )
+            db.save_schedule_export(user_id, version, pdf_path)
+            rendered += 1
+        
+        print(f"✅ Расписаний подготовлено: {rendered}, уже актуальны: {skipped}")
+    
+    def post_updates(self, updates_file, url=None, secret_token=None):
+        """Отправка сохраненных обновлений (JSON-массив или NDJSON) в webhook"""
+        import urllib.error
+        import urllib.request
+        
+        if url is None or secret_token is None:
+            with open('config.json', 'r', encoding='utf-8') as f:
+                webhook = json.load(f).get('webhook') or {}
+            port = webhook.get('port', 8443)
+            url = url or f"http://127.0.0.1:{port}{webhook.get('path', '/telegram')}"
+            secret_token = secret_token or webhook.get('secret_token', '')
+        
+        with open(updates_file, 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+        if text.startswith('['):
+            updates = json.loads(text)
+        else:
+            updates = [json.loads(line) for line in text.splitlines() if line.strip()]
+        
+        statuses = {}
+        for update in updates:
+            request = urllib.request.Request(
+                url, data=json.dumps(update).encode('utf-8'), method='POST',
+                headers={'Content-Type': 'application/json',
+                         'X-Telegram-Bot-Api-Secret-Token': secret_token}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            statuses[status] = statuses.get(status, 0) + 1
+        
+        print(f"✅ Отправлено обновлений: {len(updates)}, ответы: {statuses}")
     
     def reset_user_data(self, user_id):
         print(f"⚠️  ВНИМАНИЕ! Будут удалены ВСЕ данные пользователя {user_id}")
@@ -156,25 +294,45 @@ class BotUtils:
             print("❌ Отменено")
             return
         
-        conn = sqlite3.connect(self.db_name)
+        conn = connect(self.db_name)
         cursor = conn.cursor()
         
-        tables = ['notes', 'goals', 'achievements', 'activity_log', 
+        tables = ['notes', 'goals', 'achievements', 'activity_log', 'activity_daily',
                  'quiz_results', 'schedule', 'daily_tips_read']
         
         for table in tables:
             cursor.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
         
+        # Расписание удалено: закэшированный PDF (file_id в Telegram) устарел
+        cursor.execute('SELECT file_path FROM schedule_exports WHERE user_id = ?', (user_id,))
+        export = cursor.fetchone()
+        cursor.execute('DELETE FROM schedule_exports WHERE user_id = ?', (user_id,))
         cursor.execute('''
             UPDATE users 
-            SET total_points = 0, current_level = 1, streak = 0 
+            SET total_points = 0, current_level = 1, streak = 0,
+                schedule_version = COALESCE(schedule_version, 0) + 1
             WHERE user_id = ?
         ''', (user_id,))
         
         conn.commit()
         conn.close()
+        self.publish_invalidations(tables + ['users'], user_id)
+        # Файл рендера больше нигде не записан: следующий рендер его не найдет
+        if export and export['file_path'] and os.path.exists(export['file_path']):
+            os.remove(export['file_path'])
         
         print(f"✅ Данные пользователя {user_id} сброшены")
+    
+    def publish_invalidations(self, tables, user_id=None):
+        """Сброс кэшей бота после записи в tables (без user_id - кэши целиком)"""
+        from cache import caches
+        from database import Database
+        
+        items = Database.table_cache_keys(self.db_name, tables, user_id)
+        try:
+            caches.publish(self.db_name, items)
+        except Exception as e:
+            print(f"⚠️  Кэши бота не сброшены, изменения будут видны через TTL: {e}")
 
 
 def main():
@@ -187,21 +345,40 @@ def main():
         print("=" * 50)
         print("\nИспользование: python utils.py <команда> [параметры]")
         print("\nДоступные команды:")
-        print("  stats              - Показать общую статистику")
-        print("  backup             - Создать резервную копию БД")
+        print("  stats [--exact]    - Показать общую статистику (--exact - полный пересчет)")
+        print("  stats --reconcile  - Исправить расхождения счетчиков статистики")
+        print("  backup [--incremental] - Создать резервную копию БД (без остановки бота)")
+        print("  backup-verify [name] - Проверить восстановление копии")
+        print("  restore <file> [name] - Восстановить базу из копии в новый файл")
         print("  export <user_id>   - Экспортировать данные пользователя")
-        print("  clean [days]       - Очистить старые данные (по умолчанию 90 дней)")
+        print("  export-all [dir] [--documents] [--no-gzip] [--workers N] - Выгрузить всю базу")
+        print("  clean [days] [--archive[=dir]] - Очистить старые данные (по умолчанию 90 дней)")
+        print("  clean --enable-vacuum - Включить возврат места после очистки (VACUUM)")
         print("  reset <user_id>    - Сбросить данные пользователя")
+        print("  prerender-schedules - Подготовить PDF расписаний всех пользователей")
+        print("  post-updates <file> [url] - Отправить сохраненные обновления в webhook")
         print()
         return
     
     command = sys.argv[1]
     
     if command == 'stats':
-        utils.print_statistics()
+        if '--reconcile' in sys.argv[2:]:
+            utils.reconcile_statistics()
+        else:
+            utils.print_statistics(exact='--exact' in sys.argv[2:])
     
     elif command == 'backup':
-        utils.backup_database()
+        utils.backup_database(incremental='--incremental' in sys.argv[2:])
+    
+    elif command == 'backup-verify':
+        utils.verify_backup(sys.argv[2] if len(sys.argv) > 2 else None)
+    
+    elif command == 'restore':
+        if len(sys.argv) < 3:
+            print("❌ Укажите файл для восстановленной базы")
+            return
+        utils.restore_backup(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
     
     elif command == 'export':
         if len(sys.argv) < 3:
@@ -210,9 +387,30 @@ def main():
         user_id = int(sys.argv[2])
         utils.export_user_data(user_id)
     
+    elif command == 'export-all':
+        args = sys.argv[2:]
+        workers = None
+        if '--workers' in args:
+            index = args.index('--workers')
+            workers = int(args[index + 1])
+            del args[index:index + 2]
+        directory = next((arg for arg in args if not arg.startswith('--')), None)
+        utils.export_all(directory, layout='documents' if '--documents' in args else 'tables',
+                         compress='--no-gzip' not in args, workers=workers)
+    
     elif command == 'clean':
-        days = int(sys.argv[2]) if len(sys.argv) > 2 else 90
-        utils.clean_old_data(days)
+        args = sys.argv[2:]
+        if '--enable-vacuum' in args:
+            utils.enable_incremental_vacuum()
+            return
+        # Каталог только в виде --archive=DIR: `clean --archive 30` - 30 дней
+        archive_dir = None
+        for arg in list(args):
+            if arg == '--archive' or arg.startswith('--archive='):
+                archive_dir = arg.partition('=')[2] or 'archive'
+                args.remove(arg)
+        days = int(args[0]) if args else 90
+        utils.clean_old_data(days, archive_dir)
     
     elif command == 'reset':
         if len(sys.argv) < 3:
@@ -221,6 +419,16 @@ def main():
         user_id = int(sys.argv[2])
         utils.reset_user_data(user_id)
     
+    elif command == 'prerender-schedules':
+        utils.prerender_schedules()
+    
+    elif command == 'post-updates':
+        if len(sys.argv) < 3:
+            print("❌ Укажите файл с обновлениями")
+            return
+        url = sys.argv[3] if len(sys.argv) > 3 else None
+        utils.post_updates(sys.argv[2], url)
+    
     else:
         print(f"❌ Неизвестная команда: {command}")
 
@@ -0,0 +1,124 @@
+"""
+Прием обновлений Telegram через webhook
+Локальный HTTP сервер (за reverse proxy с TLS) проверяет секретный токен
+и кладет обновления в ограниченную очередь приложения. При переполнении
+отвечает 503, и Telegram повторяет доставку позже
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class WebhookServer:
+    def __init__(self, application, secret_token: str, host: str = '127.0.0.1',
+                 port: int = 8443, path: str = '/telegram',
+                 max_body_size: int = 1024 * 1024, read_timeout: float = 30.0):
+        self.application = application
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_body_size = max_body_size
+        self.read_timeout = read_timeout
+        self.accepted = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        # Telegram держит соединение открытым и шлет обновления подряд
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader),
+                                                 self.read_timeout)
+                if request is None:
+                    break
+                status, body, headers = self.process(*request)
+                keep_alive = request[2].get('connection', '').lower() != 'close'
+                self._write_response(writer, status, body, headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError:
+            self._write_response(writer, '400 Bad Request', b'Bad Request\n', {}, False)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) < 2:
+            raise ValueError("Некорректная строка запроса")
+        length = int(headers.get('content-length', '0'))
+        if length > self.max_body_size:
+            raise ValueError("Слишком большое тело запроса")
+        body = await reader.readexactly(length) if length else b''
+        return parts[0], parts[1].split('?')[0], headers, body
+
+    def process(self, method: str, path: str, headers: dict, body: bytes):
+        """
+        Обработка одного запроса
+
+        Returns:
+            (статус, тело ответа, дополнительные заголовки)
+        """
+        if path != self.path:
+            return '404 Not Found', b'Not Found\n', {}
+        if method != 'POST':
+            return '405 Method Not Allowed', b'Method Not Allowed\n', {'Allow': 'POST'}
+        # Сравнение за постоянное время, чтобы токен нельзя было подобрать по задержке.
+        # Байты, а не строки: compare_digest не принимает строки с не-ASCII символами
+        # (заголовок декодирован как latin-1 - кодируем обратно в исходные байты)
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('latin-1'),
+                                   self.secret_token.encode('utf-8')):
+            return '403 Forbidden', b'Forbidden\n', {}
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return '400 Bad Request', b'Bad Request\n', {}
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return '503 Service Unavailable', b'Busy\n', {'Retry-After': '1'}
+        self.accepted += 1
+        return '200 OK', b'', {}
+
+    @staticmethod
+    def _write_response(writer, status: str, body: bytes, headers: dict, keep_alive: bool):
+        lines = [f'HTTP/1.1 {status}', 'Content-Type: text/plain; charset=utf-8',
+                 f'Content-Length: {len(body)}',
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)